@@ -0,0 +1,119 @@
+"""
+Event loop benchmark: runs the same synthetic load on asyncio's loop and on uvloop (if installed),
+and compares throughput and loop lag.
+
+The load is many concurrent "commands", each making a few round trips to a local TCP echo server
+(standing in for database and discord requests) and building a small embed-like string.
+
+Run from the root directory:
+    python -m benchmarks.event_loop --clients 200 --commands 50
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from helper.loop_monitor import LoopMonitor
+
+# round trips per command, and bytes per message
+ROUND_TRIPS = 3
+MESSAGE = b"x" * 200 + b"\n"
+
+
+async def handle_echo(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while line := await reader.readline():
+            writer.write(line)
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+def build_embed(rows: int = 10) -> str:
+    """
+    CPU work of a command: formatting a leaderboard-like embed
+    """
+    records = [{'user_id': 10 ** 17 + i, 'balance': i * 12.5, 'pos': i} for i in range(rows)]
+    text = "".join(f"{i}. <@{r['user_id']}> - {r['balance']:.2f} credits, {r['pos']} shoes\n" for i, r in enumerate(records, 1))
+    return json.dumps({'title': "Leaderboard", 'description': text})
+
+
+async def client(port: int, commands: int, latencies: list):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+
+    try:
+        for _ in range(commands):
+            start = time.perf_counter()
+
+            for _ in range(ROUND_TRIPS):
+                writer.write(MESSAGE)
+                await writer.drain()
+                await reader.readline()
+
+            build_embed()
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def run_load(clients: int, commands: int) -> dict:
+    monitor = LoopMonitor(interval_ms = 10)
+    monitor.start()
+
+    server = await asyncio.start_server(handle_echo, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    latencies = []
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, commands, latencies) for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    server.close()
+    await server.wait_closed()
+    monitor.stop()
+
+    latencies.sort()
+    stats = monitor.get_stats()
+
+    return {
+        'commands/s': round(len(latencies) / elapsed),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        'lag_mean_ms': stats['mean_ms'],
+        'lag_p99_ms': stats['p99_ms'],
+        'lag_max_ms': stats['max_ms']
+    }
+
+
+def run_on(loop_factory, clients: int, commands: int) -> dict:
+    loop = loop_factory()
+
+    try:
+        return loop.run_until_complete(run_load(clients, commands))
+    finally:
+        loop.close()
+
+
+def main(clients: int, commands: int):
+    loops = [('asyncio', asyncio.new_event_loop)]
+
+    try:
+        import uvloop
+    except ImportError:
+        print("uvloop is not installed, only asyncio's loop is measured")
+    else:
+        loops.append(('uvloop', uvloop.new_event_loop))
+
+    print(f"{clients} clients x {commands} commands, {ROUND_TRIPS} round trips each")
+
+    for name, factory in loops:
+        result = run_on(factory, clients, commands)
+        print(f"{name:>8}: " + ", ".join(f"{key} {value}" for key, value in result.items()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type = int, default = 200)
+    parser.add_argument('--commands', type = int, default = 50)
+    args = parser.parse_args()
+
+    main(args.clients, args.commands)
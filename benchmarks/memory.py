@@ -0,0 +1,119 @@
+"""
+Memory benchmark: simulates guilds with an active giveaway each, as kept in bot.my_views.
+With --members, also compares the member cache with the members intent (MEMBER_INTENT) on and off,
+by parsing the guild payloads discord sends at startup through discord.py
+
+Run from the root directory:
+    python -m benchmarks.memory --guilds 10000 --claims 20
+    python -m benchmarks.memory --guilds 1000 --members 100
+"""
+import argparse
+import asyncio
+import gc
+import time
+import tracemalloc
+
+import discord
+from discord.state import ConnectionState
+
+from helper.objects import ViewHelper, Player, Event
+from helper.game_tasks import GiveawayView
+from helper.runtime import rss
+
+def make_guild(guild_id: int, claims: int):
+    """
+    Objects the bot holds for one guild with an active giveaway
+    """
+    used_users = [guild_id * 1000 + i for i in range(claims)]
+    vh = ViewHelper(None, message_id = guild_id, channel_id = guild_id, id = guild_id, used_users = used_users)
+    view = GiveawayView(None, vh)
+
+    # short lived objects made for every command, kept here to show their size too
+    return view, Event(guild_id, None), Player(guild_id, guild_id, None)
+
+def guild_payload(guild_id: int, members: int) -> dict:
+    """
+    GUILD_CREATE data of a guild with `members` members (discord only sends them with the members intent)
+    """
+    return {
+        'id': guild_id, 'name': f"guild {guild_id}", 'member_count': members,
+        'roles': [], 'emojis': [], 'stickers': [], 'channels': [],
+        'members': [
+            {
+                'user': {'id': guild_id * 100000 + i, 'username': f"user {i}", 'discriminator': '0', 'avatar': None},
+                'roles': [], 'joined_at': None, 'deaf': False, 'mute': False, 'flags': 0
+            }
+            for i in range(members)
+        ]
+    }
+
+def load_guilds(intent: bool, payloads: list) -> ConnectionState:
+    """
+    Caches the guilds like the bot does at startup, with the intents and member cache main.py uses
+    """
+    intents = discord.Intents(guilds = True, members = intent, messages = True, emojis = True)
+    flags = discord.MemberCacheFlags.from_intents(intents) if intent else discord.MemberCacheFlags.none()
+    state = ConnectionState(dispatch = lambda *args: None, handlers = {}, hooks = {}, http = None, intents = intents, member_cache_flags = flags)
+
+    for payload in payloads:
+        state._add_guild_from_data(payload)
+
+    return state
+
+def compare_member_intent(guilds: int, members: int):
+    """
+    Time and memory of caching the guilds at startup, with the members intent on and off
+    """
+    for intent in (True, False):
+        payloads = [guild_payload(guild_id, members if intent else 0) for guild_id in range(1, guilds + 1)]
+
+        gc.collect()
+        start = time.perf_counter()
+        load_guilds(intent, payloads)
+        took = time.perf_counter() - start
+
+        # measured again, as tracing slows it down
+        gc.collect()
+        tracemalloc.start()
+        state = load_guilds(intent, payloads)
+        gc.collect()
+        traced, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        cached = sum(len(guild.members) for guild in state.guilds)
+        print(f"members intent {'on ' if intent else 'off'}: {took:.2f}s, {traced / 1024 / 1024:.2f} MiB, {cached} members cached")
+
+async def main(guilds: int, claims: int):
+    gc.collect()
+    rss_before = rss()
+    tracemalloc.start()
+
+    my_views = []
+    objects = []
+
+    for guild_id in range(1, guilds + 1):
+        view, event, player = make_guild(guild_id, claims)
+        my_views.append(view)
+        objects.append((event, player))
+
+    gc.collect()
+    traced, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = rss()
+
+    print(f"guilds: {guilds}, claims per giveaway: {claims}")
+    print(f"traced: {traced / 1024 / 1024:.2f} MiB ({traced / guilds:.0f} B/guild), peak {peak / 1024 / 1024:.2f} MiB")
+    print(f"rss: {(rss_after - rss_before) / 1024 / 1024:.2f} MiB ({(rss_after - rss_before) / guilds:.0f} B/guild)")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guilds', type = int, default = 10000)
+    parser.add_argument('--claims', type = int, default = 20)
+    parser.add_argument('--members', type = int, default = 0, help = "members per guild, compares the members intent on and off")
+    args = parser.parse_args()
+
+    if args.members:
+        compare_member_intent(args.guilds, args.members)
+    else:
+        # views need a running event loop
+        asyncio.run(main(args.guilds, args.claims))
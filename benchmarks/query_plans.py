@@ -0,0 +1,186 @@
+"""
+Query plan regression check: runs EXPLAIN (ANALYZE, BUFFERS) on the hot statements in
+helper/queries.py (the SQL the bot sends) against a database seeded by benchmarks/seed.py,
+and fails (exit code 1) when one scans a table it should reach through an index,
+or goes over its buffer or time budget.
+
+Run from the root directory:
+    python -m benchmarks.seed postgresql://localhost/shoeman_bench
+    python -m benchmarks.query_plans postgresql://localhost/shoeman_bench
+
+Statements that change data run in a transaction that is rolled back.
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+import asyncpg
+
+from helper import queries
+from params import VIEW_INTERVAL_HRS, PRICE_TICK_DAYS, PRICE_HOURLY_DAYS
+
+class Statement:
+    def __init__(self, name: str, sql: str, args = (), *, buffers: int = 100, ms: float = 5.0, scans = ()) -> None:
+        self.name = name
+        self.sql = sql
+        # callable taking the sample values, returning query arguments
+        self.args = args
+        # most shared buffers (hit + read) allowed
+        self.buffers = buffers
+        # most execution time allowed, in milliseconds
+        self.ms = ms
+        # tables this statement may read with a sequential scan
+        self.scans = set(scans)
+
+
+# $n arguments come from the sample: s['guild'] is the largest guild, s['user'] one of its players.
+# statements run with executemany are explained with one row of arguments
+STATEMENTS = [
+    Statement("player exists", queries.PLAYER_EXISTS, lambda s: (s['user'], s['guild'])),
+    Statement("player details", queries.PLAYER_DETAILS, lambda s: (s['user'], s['guild'])),
+    Statement("create player", queries.CREATE_PLAYER, lambda s: (s['new_user'], s['guild'])),
+    Statement("player profile", queries.PLAYER_PROFILE, lambda s: (s['user'], s['guild'])),
+    Statement("claim shoes", queries.CLAIM_SHOES, lambda s: (s['user'], s['guild'])),
+    Statement("sell shoes", queries.SELL_SHOES, lambda s: (1, 10.0, s['user'], s['guild'])),
+    Statement("modify player", queries.MODIFY_PLAYER, lambda s: (100.0, None, s['guild'], s['user'])),
+    Statement("balance leaderboard", queries.PLAYER_LEADERBOARD.format('balance'), lambda s: (s['guild'], 10)),
+    Statement("ore leaderboard", queries.PLAYER_LEADERBOARD.format('day_ores'), lambda s: (s['guild'], 10)),
+    Statement("global leaderboard", queries.GLOBAL_LEADERBOARD, lambda s: (10, s['user'], s['guild'])),
+    Statement("event exists", queries.EVENT_EXISTS, lambda s: (s['guild'],)),
+    Statement("giveaway shoes", queries.GIVEAWAY_SHOES, lambda s: (s['guild'],)),
+    Statement("event channel", queries.EVENT_CHANNEL, lambda s: (s['guild'],)),
+    Statement("event shoe ores", queries.EVENT_SHOE_ORES, lambda s: (s['guild'],)),
+    Statement("event details", queries.EVENT_DETAILS, lambda s: (s['guild'],)),
+    Statement("last price change", queries.LATEST_PRICE_DATE, lambda s: (0,)),
+    Statement("current price", queries.LATEST_PRICE, lambda s: (s['market'],)),
+    Statement("set price", queries.INSERT_PRICE, lambda s: (s['market'], 10.0)),
+    Statement("price history", queries.PRICE_HISTORY, lambda s: (s['now'], 6, s['market'])),
+    Statement("price tick markets", queries.MARKETS,
+        lambda s: (0,), buffers = 100000, ms = 500, scans = ('events',)),
+    # background job over every market, so only checked against its own budget
+    Statement("compact ticks", queries.COMPACT_TICKS,
+        lambda s: (PRICE_TICK_DAYS,), buffers = 1000000, ms = 5000, scans = ('shoes',)),
+    Statement("compact hourly", queries.COMPACT_HOURLY,
+        lambda s: (PRICE_HOURLY_DAYS,), buffers = 1000000, ms = 5000, scans = ('shoes_hourly',)),
+    Statement("overdue views", queries.OVERDUE_VIEWS.format(VIEW_INTERVAL_HRS), buffers = 5000, ms = 100),
+    Statement("view from message", queries.VIEW_FROM_MESSAGE, lambda s: (s['message'], s['channel'])),
+    Statement("delete channel views", queries.DELETE_CHANNEL_VIEWS, lambda s: ([s['channel']],)),
+    Statement("add giveaway claimer", queries.ADD_VIEW_USER, lambda s: (s['user'], s['view'])),
+    Statement("overdue ore guilds", queries.OVERDUE_ORE_GUILDS, buffers = 1000, ms = 20),
+    Statement("ore payout players", queries.ORE_PAYOUT_PLAYERS,
+        lambda s: ([s['guild']],), buffers = 50000, ms = 500),
+    Statement("pay ores", queries.PAY_ORES, lambda s: (1, 1, s['user'], s['guild'])),
+    Statement("close ore day", queries.CLOSE_ORE_DAY, lambda s: ([s['guild']],), buffers = 50000, ms = 500),
+    Statement("add ores and ore total", queries.ADD_ORES, lambda s: (5, s['user'], s['guild'])),
+    Statement("player payout", queries.PLAYER_PAYOUT, lambda s: (s['user'], s['guild'])),
+    Statement("escrow shoes", queries.ESCROW_SHOES, lambda s: (1, s['user'], s['guild'])),
+    Statement("escrow balance", queries.ESCROW_BALANCE, lambda s: (10.0, s['user'], s['guild'])),
+    Statement("credit player", queries.CREDIT_PLAYER, lambda s: (1, 10.0, s['user'], s['guild'])),
+    Statement("fill order", queries.FILL_ORDER, lambda s: (1, s['order'])),
+    Statement("delete filled orders", queries.DELETE_ORDERS, lambda s: ([s['order']],)),
+    Statement("insert order", queries.INSERT_ORDER, lambda s: (s['guild'], s['user'], 'sell', 10.0, 1)),
+    Statement("cancel order", queries.CANCEL_ORDER, lambda s: (s['order'], s['guild'], s['user'])),
+    Statement("market depth", queries.MARKET_DEPTH.format('ASC'),
+        lambda s: (s['guild'], 'sell', 5), buffers = 1000, ms = 20),
+    Statement("player orders", queries.PLAYER_ORDERS, lambda s: (s['guild'], s['user'])),
+    Statement("ore history", queries.ORE_HISTORY,
+        lambda s: (s['guild'], s['user'], s['month_ago']), buffers = 300),
+    Statement("guild player count", queries.GUILD_PLAYER_COUNT,
+        lambda s: (s['guild'],), buffers = 5000, ms = 100),
+    # reads the whole guild, like the ore payout
+    Statement("guild player stats", queries.GUILD_PLAYER_STATS,
+        lambda s: (s['guild'],), buffers = 50000, ms = 500),
+    Statement("ledger entries", queries.LEDGER_ENTRIES, lambda s: (s['guild'], s['user'], 15)),
+]
+
+
+async def get_sample(conn: asyncpg.Connection) -> dict:
+    """
+    Values to run the statements with: the largest guild (the worst case) and one of its players
+    """
+    guild = await conn.fetchval("SELECT guild_id FROM players GROUP BY guild_id ORDER BY COUNT(*) DESC LIMIT 1")
+    user = await conn.fetchval("SELECT user_id FROM players WHERE guild_id = $1 LIMIT 1", guild)
+    # not a player of the guild yet, for the profile insert
+    new_user = await conn.fetchval("SELECT MAX(user_id) + 1 FROM players")
+    view = await conn.fetchrow("SELECT id, message_id, channel_id FROM views LIMIT 1")
+    market = await conn.fetchval("SELECT guild_id FROM shoes WHERE guild_id <> 0 LIMIT 1") or 0
+    order = await conn.fetchval("SELECT id FROM orders WHERE guild_id = $1 LIMIT 1", guild) or 0
+    now = await conn.fetchval("SELECT NOW()")
+
+    return {
+        'guild': guild, 'user': user, 'new_user': new_user, 'market': market, 'order': order, 'now': now,
+        'month_ago': await conn.fetchval("SELECT NOW() - INTERVAL '30 days'"),
+        'view': view['id'], 'message': view['message_id'], 'channel': view['channel_id']
+    }
+
+
+def walk(node: dict):
+    yield node
+    for child in node.get('Plans', []):
+        yield from walk(child)
+
+
+async def check(conn: asyncpg.Connection, statement: Statement, sample: dict) -> list:
+    """
+    Returns list of problems with the statement's plan (empty if it passes)
+    """
+    args = statement.args(sample) if callable(statement.args) else statement.args
+
+    # rolled back, so statements changing data can be explained too
+    tr = conn.transaction()
+    await tr.start()
+    try:
+        result = await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement.sql}", *args)
+    finally:
+        await tr.rollback()
+
+    explain = json.loads(result)[0] if isinstance(result, str) else result[0]
+    plan = explain['Plan']
+    problems = []
+
+    for node in walk(plan):
+        if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') not in statement.scans:
+            # partitions of ore_payouts are checked like the parent table
+            relation = node.get('Relation Name', '')
+            if not (relation.startswith('ore_payouts_') and 'ore_payouts' in statement.scans):
+                problems.append(f"sequential scan on {relation}")
+
+    buffers = plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0)
+    if buffers > statement.buffers:
+        problems.append(f"{buffers} buffers (budget {statement.buffers})")
+
+    ms = explain['Execution Time']
+    if ms > statement.ms:
+        problems.append(f"{ms:.2f} ms (budget {statement.ms} ms)")
+
+    print(f"{'FAIL' if problems else 'ok  '} {statement.name}: {buffers} buffers, {ms:.2f} ms")
+    for problem in problems:
+        print(f"     - {problem}")
+
+    return problems
+
+
+async def main(dsn: str) -> int:
+    conn = await asyncpg.connect(dsn)
+
+    try:
+        sample = await get_sample(conn)
+        failed = 0
+
+        for statement in STATEMENTS:
+            if await check(conn, statement, sample):
+                failed += 1
+
+    finally:
+        await conn.close()
+
+    print(f"{len(STATEMENTS) - failed}/{len(STATEMENTS)} statements within budget")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dsn')
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(main(args.dsn)))
@@ -0,0 +1,33 @@
+"""
+Randomness benchmark: cost of one ore roll and one normal draw, per call
+
+Run from the root directory:
+    python -m benchmarks.randomness --calls 100000
+"""
+import argparse
+import timeit
+
+import numpy as np
+
+from helper.randomness import Randomness
+
+def main(calls: int):
+    service = Randomness(seed = 1)
+
+    cases = {
+        'ore roll, new generator per call': lambda: np.random.default_rng().integers(0, 11),
+        'ore roll, shared service': service.ore_roll,
+        'normal, new generator per call': lambda: np.random.default_rng().normal(0.0, 100),
+        'normal, shared service': lambda: service.normal(0.0, 100),
+    }
+
+    for name, func in cases.items():
+        seconds = min(timeit.repeat(func, number = calls, repeat = 3))
+        print(f"{name}: {seconds / calls * 1e6:.3f} us/call")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type = int, default = 100000)
+    args = parser.parse_args()
+
+    main(args.calls)
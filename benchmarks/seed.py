@@ -0,0 +1,160 @@
+"""
+Seeds a database with a large, realistic dataset using COPY. Use an empty database, not the bot's
+
+Run from the root directory:
+    python -m benchmarks.seed postgresql://localhost/shoeman_bench --guilds 10000 --players 1000000
+"""
+import argparse
+import asyncio
+import random
+from datetime import timedelta, datetime, timezone
+
+import asyncpg
+
+import db_init
+from helper.objects import OreHistory
+from params import PRICE_CHANGE_HRS, first_price
+
+# rows sent per COPY
+CHUNK = 50000
+
+
+async def copy(conn: asyncpg.Connection, table: str, columns: tuple, rows):
+    """
+    COPY rows from an iterable into table, CHUNK rows at a time so memory stays bounded
+    """
+    chunk = []
+    count = 0
+
+    for row in rows:
+        chunk.append(row)
+
+        if len(chunk) >= CHUNK:
+            await conn.copy_records_to_table(table, records = chunk, columns = columns)
+            count += len(chunk)
+            chunk = []
+
+    if chunk:
+        await conn.copy_records_to_table(table, records = chunk, columns = columns)
+        count += len(chunk)
+
+    print(f"{table}: {count} rows")
+
+
+def guild_sizes(rng: random.Random, guilds: int, players: int) -> list:
+    """
+    Players per guild, long tailed like real servers: a few huge guilds, many small ones
+    """
+    weights = [1 / (rank ** 1.1) for rank in range(1, guilds + 1)]
+    rng.shuffle(weights)
+    total = sum(weights)
+
+    return [max(1, int(players * w / total)) for w in weights]
+
+
+async def seed(
+    conn: asyncpg.Connection, *,
+    guilds: int = 10000, players: int = 1000000, views: int = 100000,
+    price_years: int = 3, price_markets: int = 100, orders: int = 100000, ore_days: int = 30,
+    random_seed: int = 1
+):
+    """
+    Creates the schema and fills every table. `price_markets` guilds get `price_years` of prices,
+    and `ore_days` of ore payouts are made for a sample of players
+    """
+    rng = random.Random(random_seed)
+    now = datetime.now(timezone.utc)
+
+    await db_init.init_db(conn)
+
+    guild_ids = list(range(1, guilds + 1))
+    sizes = guild_sizes(rng, guilds, players)
+
+    await copy(conn, 'events', ('guild_id', 'pos_given', 'channel_id', 'last_collect', 'shoe_ores'), (
+        (g, rng.randint(5, 50), g * 10, now - timedelta(minutes = rng.randint(0, 48 * 60)), rng.randint(10, 500))
+        for g in guild_ids
+    ))
+
+    def player_rows():
+        for g, size in zip(guild_ids, sizes):
+            for i in range(size):
+                yield (g * 10_000_000 + i, g, rng.expovariate(1 / 5000), rng.randint(0, 200), rng.randint(0, 300))
+
+    await copy(conn, 'players', ('user_id', 'guild_id', 'balance', 'pos', 'day_ores'), player_rows())
+
+    await conn.execute(
+        """
+        UPDATE events
+        SET ore_total = totals.day_ores
+        FROM (SELECT guild_id, SUM(day_ores) AS day_ores FROM players GROUP BY guild_id) AS totals
+        WHERE events.guild_id = totals.guild_id;
+        """
+    )
+
+    await copy(conn, 'views', ('channel_id', 'message_id', 'used_users', 'created_on'), (
+        (
+            rng.choice(guild_ids) * 10,
+            n,
+            [rng.randint(1, 10 ** 12) for _ in range(rng.randint(0, 20))],
+            now - timedelta(hours = rng.uniform(0, 24))
+        )
+        for n in range(1, views + 1)
+    ))
+
+    # years of prices for the default market and some guild markets
+    ticks = int(price_years * 365 * 24 / PRICE_CHANGE_HRS)
+
+    def price_rows():
+        for g in [0] + guild_ids[:price_markets]:
+            price = first_price
+            for t in range(ticks, 0, -1):
+                price += rng.gauss(0, 100)
+                yield (g, now - timedelta(hours = t * PRICE_CHANGE_HRS), price)
+
+    await copy(conn, 'shoes', ('guild_id', 'price_date', 'price'), price_rows())
+
+    await copy(conn, 'orders', ('guild_id', 'user_id', 'side', 'price', 'shoes'), (
+        (rng.choice(guild_ids), rng.randint(1, 10 ** 12), rng.choice(('sell', 'buy')), rng.uniform(500, 1500), rng.randint(1, 10))
+        for _ in range(orders)
+    ))
+
+    # payouts for a sample of players in each of the last days
+    for day in range(ore_days, 0, -1):
+        paid_on = now - timedelta(days = day)
+        await OreHistory.ensure_partition(conn, paid_on.date())
+
+        await copy(conn, 'ore_payouts', ('guild_id', 'user_id', 'paid_on', 'ores', 'guild_ores', 'shoes'), (
+            (g, g * 10_000_000 + i, paid_on, rng.randint(1, 300), size * 150, rng.randint(0, 20))
+            for g, size in zip(guild_ids, sizes)
+            for i in range(min(size, 20))
+        ))
+
+    await conn.execute("REFRESH MATERIALIZED VIEW global_leaderboard")
+    await conn.execute("ANALYZE")
+
+
+async def main(dsn: str, **kwargs):
+    conn = await asyncpg.connect(dsn)
+
+    try:
+        await seed(conn, **kwargs)
+    finally:
+        await conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dsn')
+    parser.add_argument('--guilds', type = int, default = 10000)
+    parser.add_argument('--players', type = int, default = 1000000)
+    parser.add_argument('--views', type = int, default = 100000)
+    parser.add_argument('--price-years', type = int, default = 3)
+    parser.add_argument('--price-markets', type = int, default = 100)
+    parser.add_argument('--orders', type = int, default = 100000)
+    parser.add_argument('--ore-days', type = int, default = 30)
+    args = parser.parse_args()
+
+    asyncio.run(main(
+        args.dsn, guilds = args.guilds, players = args.players, views = args.views,
+        price_years = args.price_years, price_markets = args.price_markets,
+        orders = args.orders, ore_days = args.ore_days
+    ))
@@ -7,6 +7,9 @@ from typing import Optional
 
 from helper.objects import Player, Event, ViewHelper
 from helper.game_tasks import send_view
+from helper.market import OrderBook
+from helper import ledger
+from helper.middleware import handled
 
 class AdminCommands(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
@@ -26,6 +29,7 @@ class AdminCommands(commands.Cog):
         name = "set_player",
         description = "Set player's details, in case they abuse!"
     )
+    @handled
     async def set_player_details(
         self, itx: discord.Interaction,
         member: discord.Member,
@@ -41,13 +45,25 @@ class AdminCommands(commands.Cog):
 
         player = await Player.create_profile(member.id, itx.guild_id, self.pool)
 
-        changed = await player.modify_fields(balance = balance, pos = shoes)
+        changed = await player.modify_fields(balance = balance, pos = shoes, actor_id = itx.user.id)
 
         if changed:
             await itx.response.send_message("Details have been changed.")
         else:
             await itx.response.send_message("Provide details for the change.", ephemeral = True)
 
+    @app_commands.command(
+        name = "audit",
+        description = "See a player's latest balance and shoe changes"
+    )
+    @handled
+    async def audit_player(self, itx: discord.Interaction, member: discord.Member, count: app_commands.Range[int, 1, 25] = 15):
+        """
+        Shows the player's latest ledger entries: sells, trades, claims, payouts and admin changes
+        """
+        embed = await ledger.writer.show_player_entries(itx.guild_id, member.id, count)
+        await itx.response.send_message(embed = embed, ephemeral = True)
+
 class EventCog(commands.GroupCog, name = "event"):
     def __init__(self, bot) -> None:
         self.bot = bot
@@ -67,6 +83,7 @@ class EventCog(commands.GroupCog, name = "event"):
         name = "start",
         description = "Start the event"
     )
+    @handled
     async def start_event(
         self, itx: discord.Interaction,
         giveaway_shoes: int,
@@ -99,12 +116,14 @@ class EventCog(commands.GroupCog, name = "event"):
         name = "end",
         description = "End the event. Do not do this unless you are absolutely sure!"
     )
+    @handled
     async def end_event(self, itx: discord.Interaction):
         """
         Checks if event exists, if it does then...
         - Sends a final leaderboard message in channel
         - Deletes all player records of this guild
         - Deletes event record in events table
+        - Deletes all open orders of this guild
         - Deletes all view records of this guild in views table
         - Stops any active views
         - Removes view from my_views
@@ -122,7 +141,7 @@ class EventCog(commands.GroupCog, name = "event"):
         
         if channel is not None:
             # send leaderboard message
-            embed = await event.show_leaderboard(itx.guild)
+            embed = await event.show_leaderboard()
             await channel.send(embed = embed)
 
         # delete views of this channel_id (ie this guild)
@@ -137,20 +156,28 @@ class EventCog(commands.GroupCog, name = "event"):
                 x.stop()
                 break
 
-        # delete event and players record
+        # delete event, players and orders record
         await event.end_event()
+        OrderBook.drop(itx.guild_id)
 
         await itx.followup.send("Adios my friend. Hope we meet again.")
 
     @app_commands.command(
         name = "config",
-        description = "Change the channel given, shoes to giveaway from events or ores"
+        description = "Change the channel given, shoes to giveaway from events or ores, or how the price changes"
     )
+    @app_commands.describe(
+        price_mean = "Average change of this server's shoe price, every price change",
+        price_std_dev = "How much this server's shoe price changes by, every price change"
+    )
+    @handled
     async def config_event(
         self, itx: discord.Interaction, 
         channel: Optional[discord.TextChannel],
         giveaway_shoes: Optional[int],
-        ore_shoes: Optional[int]
+        ore_shoes: Optional[int],
+        price_mean: Optional[float],
+        price_std_dev: Optional[app_commands.Range[float, 0]]
     ):
         """
         If event exists...
@@ -162,13 +189,37 @@ class EventCog(commands.GroupCog, name = "event"):
             return
         
         event = Event(itx.guild_id, self.pool)
-        changed = await event.modify_details(new_channel = channel, pos_given = giveaway_shoes, shoe_ores = ore_shoes)
+        changed = await event.modify_details(
+            new_channel = channel, pos_given = giveaway_shoes, shoe_ores = ore_shoes,
+            price_mu = price_mean, price_sd = price_std_dev
+        )
     
         if changed:
             embed = await event.get_info()
             await itx.response.send_message("Changes are in effect", embed = embed)
         else:
             await itx.response.send_message("Please provide something to change!", ephemeral = True)
+
+
+    @app_commands.command(
+        name = "stats",
+        description = "Show the health of this server's economy"
+    )
+    @handled
+    async def show_stats(self, itx: discord.Interaction):
+        """
+        If event exists...
+        - Show coin and shoe supply, inequality and today's ore participation
+        """
+        if not await Event.exists(itx.guild_id, self.pool):
+            await itx.response.send_message("Event does not exist", ephemeral = True)
+            return
+
+        # deferring in case it takes longer than 3 seconds on large servers
+        await itx.response.defer(thinking = True)
+
+        embed = await Event(itx.guild_id, self.pool).show_stats()
+        await itx.followup.send(embed = embed)
       
 
 async def setup(bot: commands.Bot) -> None:
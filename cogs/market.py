@@ -0,0 +1,162 @@
+import discord
+from discord import app_commands
+from discord.ext import commands
+from asyncpg import Pool
+
+from params import EMBED_COLOUR
+from helper.objects import Player, Event
+from helper.market import OrderBook, SELL, BUY
+from helper.middleware import handled
+
+class MarketCommands(commands.Cog):
+    def __init__(self, bot: commands.Bot) -> None:
+        self.bot = bot
+        self.pool: Pool = self.bot.pool
+        # takes over the market if the process running it stops
+        self.bot.supervisor.add('market_lock', self.claim_market, seconds = 60)
+
+    async def cog_load(self) -> None:
+        # rebuild the matching engines from the orders table, if no other process runs them
+        if not await OrderBook.claim(self.pool):
+            print("Another process runs the market, orders can't be placed or cancelled here")
+
+    async def cog_unload(self) -> None:
+        self.bot.supervisor.remove('market_lock')
+        await OrderBook.release_lock(self.pool)
+
+    async def claim_market(self):
+        await OrderBook.claim(self.pool)
+
+    async def market_closed(self, itx: discord.Interaction) -> bool:
+        """
+        Tells the user when orders are matched by another process. Returns bool whether it did
+        """
+        if OrderBook.owner is not None:
+            return False
+
+        await itx.response.send_message("The market is not available right now, try again in a minute", ephemeral = True)
+        return True
+
+    async def interaction_check(self, itx: discord.Interaction) -> bool:
+        """
+        Do not allow commands when event does not exist
+        """
+        if await Event.exists(itx.guild_id, self.pool):
+            return True
+        await itx.response.send_message("An event needs to be active here to use this command", ephemeral = True)
+        return False
+
+    async def place_order(self, itx: discord.Interaction, side: str, price: float, shoes: int):
+        """
+        Places order for the user and replies with the outcome
+        """
+        if shoes < 1 or price <= 0:
+            await itx.response.send_message("Invalid price or number of shoes", ephemeral = True)
+            return
+
+        if await self.market_closed(itx):
+            return
+
+        await Player.create_profile(itx.user.id, itx.guild_id, self.pool)
+
+        book = OrderBook.get(itx.guild_id, self.pool)
+        outcome = await book.place(itx.user.id, side, price, shoes)
+
+        if outcome is None:
+            if side == SELL:
+                await itx.response.send_message("You do not have enough shoes!", ephemeral = True)
+            else:
+                await itx.response.send_message("You do not have enough money!", ephemeral = True)
+            return
+
+        action = "Sold" if side == SELL else "Bought"
+        message = f"{action} {outcome['filled']} shoes for {round(outcome['value'], 2)} coins."
+
+        if outcome['order_id'] is not None:
+            message += f" {shoes - outcome['filled']} shoes are in the market as order `{outcome['order_id']}`."
+
+        await itx.response.send_message(message)
+
+    @app_commands.command(
+        name = "offer",
+        description = "Offer to sell shoes at a price per pair. Stays in the market until filled or cancelled"
+    )
+    @handled
+    async def make_offer(self, itx: discord.Interaction, price: float, shoes: int = 1):
+        """
+        Place sell order for by default 1 shoe
+        """
+        await self.place_order(itx, SELL, price, shoes)
+
+    @app_commands.command(
+        name = "bid",
+        description = "Bid to buy shoes at a price per pair. Stays in the market until filled or cancelled"
+    )
+    @handled
+    async def make_bid(self, itx: discord.Interaction, price: float, shoes: int = 1):
+        """
+        Place buy order for by default 1 shoe
+        """
+        await self.place_order(itx, BUY, price, shoes)
+
+    @app_commands.command(
+        name = "market",
+        description = "Show the best offers and bids"
+    )
+    @handled
+    async def show_market(self, itx: discord.Interaction):
+        """
+        Shows market depth: best 5 prices on each side
+        """
+        embed = await OrderBook.get(itx.guild_id, self.pool).show_depth()
+        await itx.response.send_message(embed = embed)
+
+    @app_commands.command(
+        name = "orders",
+        description = "Show your open offers and bids"
+    )
+    @handled
+    async def show_orders(self, itx: discord.Interaction):
+        """
+        Shows open orders of the user
+        """
+        records = await OrderBook.get(itx.guild_id, self.pool).get_player_orders(itx.user.id)
+
+        embed = discord.Embed(
+            colour = discord.Colour.from_str(EMBED_COLOUR),
+            title = "Your orders",
+            description = ""
+        )
+
+        if records == []:
+            embed.description = "You have no open orders"
+
+        for record in records:
+            embed.description += "`{0}` - {1} {2} shoes at {3} coins\n".format(
+                record['id'], record['side'], record['shoes'], round(record['price'], 2)
+            )
+
+        await itx.response.send_message(embed = embed, ephemeral = True)
+
+    @app_commands.command(
+        name = "cancel",
+        description = "Cancel one of your open orders"
+    )
+    @handled
+    async def cancel_order(self, itx: discord.Interaction, order_id: int):
+        """
+        Cancels order, returning its shoes or coins
+        """
+        if await self.market_closed(itx):
+            return
+
+        cancelled = await OrderBook.get(itx.guild_id, self.pool).cancel(itx.user.id, order_id)
+
+        if cancelled:
+            await itx.response.send_message(f"Order `{order_id}` cancelled.", ephemeral = True)
+        else:
+            await itx.response.send_message("You have no such order", ephemeral = True)
+
+
+async def setup(bot: commands.Bot) -> None:
+    await bot.add_cog(MarketCommands(bot))
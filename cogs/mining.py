@@ -1,29 +1,29 @@
 import discord
 from discord import app_commands
-from discord.ext import commands, tasks
+from discord.ext import commands
 from asyncpg import Pool
 
-import numpy as np
-
+from helper import randomness
+from helper.cooldowns import cooldown
+from params import MINE_COOLDOWN_SECS
 from helper.objects import Player, Event
-from helper.game_tasks import send_shoe_ores
+from helper.game_tasks import send_shoe_ores, drop_ore_history
+from helper.middleware import handled
 
 class MiningCommands(commands.Cog):
+    ores = app_commands.Group(name = "ores", description = "Ore leaderboard, payout and history")
+
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
         self.pool: Pool = self.bot.pool
-        self.shoe_ores.start()
+        self.bot.supervisor.add('shoe_ores', self.shoe_ores, seconds = 30 * 60, before = self.bot.wait_until_ready)
 
     def cog_unload(self):
-        self.shoe_ores.cancel()
+        self.bot.supervisor.remove('shoe_ores')
 
-    @tasks.loop(minutes = 30)
     async def shoe_ores(self):
         await send_shoe_ores(self.pool)
-
-    @shoe_ores.before_loop
-    async def before_shoes(self):
-        await self.bot.wait_until_ready()
+        await drop_ore_history(self.pool)
 
 
     async def interaction_check(self, itx: discord.Interaction) -> bool:
@@ -39,21 +39,23 @@ class MiningCommands(commands.Cog):
         name = "mine",
         description = "Mine some ore!"
     )
-    @app_commands.checks.cooldown(1, 60, key = lambda i: (i.guild_id, i.user.id))
+    @cooldown(1, MINE_COOLDOWN_SECS)
+    @handled
     async def mine_ore(self, itx: discord.Interaction):
         """
         Adds ore to the player's profile.
 
         Ore calculation is done by simply picking a random number between 0 and 10
         """
-        rng = np.random.default_rng()
-        rint = rng.integers(0, 11)
+        rint = (await randomness.ready()).ore_roll()
 
         player = await Player.create_profile(itx.user.id, itx.guild_id, self.pool)
 
-        await player.add_ores(rint)
+        ores = await player.add_ores(rint)
 
-        await itx.response.send_message(f"You earned {rint} ores")
+        await itx.response.send_message(
+            f"You earned {rint} ores ({ores['ores']} today, ~{ores['shoes']} shoes at next payout)"
+        )
     
     @mine_ore.error
     async def on_test_error(self, itx: discord.Interaction, error: app_commands.AppCommandError):
@@ -61,18 +63,45 @@ class MiningCommands(commands.Cog):
             retry_after = int(error.retry_after)
             await itx.response.send_message(f"Wait for {retry_after} seconds before trying again", ephemeral=True)
 
-    @app_commands.command(
-        name = "ores",
+    @ores.command(
+        name = "leaderboard",
         description = "Get ore leaderboard"
     )
+    @handled
     async def show_ore_leaderbord(self, itx: discord.Interaction):
         """
         Shows leaderboard based on ores, for top 10 only
         """
         event = Event(itx.guild_id, self.pool)
-        embed = await event.show_ore_leaderboard(itx.guild)
+        embed = await event.show_ore_leaderboard()
         await itx.response.send_message(embed = embed)
 
+    @ores.command(
+        name = "payout",
+        description = "See your share of today's ores and your projected shoe payout"
+    )
+    @handled
+    async def show_ore_payout(self, itx: discord.Interaction):
+        """
+        Shows the player's ores, the server's ores, and the shoes they would get if the payout was now
+        """
+        player = await Player.create_profile(itx.user.id, itx.guild_id, self.pool)
+        embed = await player.show_payout()
+        await itx.response.send_message(embed = embed, ephemeral = True)
+
+    @ores.command(
+        name = "history",
+        description = "Get your ore rewards for the last few days"
+    )
+    @handled
+    async def show_ore_history(self, itx: discord.Interaction, days: app_commands.Range[int, 1, 30] = 7):
+        """
+        Shows shoes the player got from ores, for each of the last `days` days
+        """
+        player = Player(itx.user.id, itx.guild_id, self.pool)
+        embed = await player.show_ore_history(days)
+        await itx.response.send_message(embed = embed, ephemeral = True)
+
 
 async def setup(bot: commands.Bot) -> None:
     await bot.add_cog(MiningCommands(bot))
\ No newline at end of file
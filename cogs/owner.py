@@ -1,8 +1,15 @@
 from typing import Literal, Optional
 import helper.objects as o
+from helper.fairness import scheduler
+from helper import command_sync
+from helper.profiler import profiler
+from helper.loop_monitor import monitor
+import asyncio
+import io
 import discord
 from discord.ext import commands
 from asyncpg import Pool
+from params import PROFILE_MAX_SECS
 
 class Owner(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
@@ -14,19 +21,21 @@ class Owner(commands.Cog):
 
     @commands.guild_only()
     @commands.command(hidden = True)
-    async def sync(self, ctx: commands.Context, guilds: commands.Greedy[discord.Object], spec: Optional[Literal["~", "*", "^"]] = None) -> None:
+    async def sync(self, ctx: commands.Context, guilds: commands.Greedy[discord.Object], spec: Optional[Literal["~", "*", "^", "!"]] = None) -> None:
         """
-        Sync commands (Owner only)
+        Sync commands where they changed since the last sync, and report which did (Owner only)
         """
         # FOR TESTING: SYNC * -> SYNC ^ -> SYNC
         # IE: sync to testing guild, remove all commands from testing guild, sync to all guilds
+        # every sync compares the tree with the hashes of the last sync (see helper/command_sync.py),
+        # ... and only calls discord when something changed
 
         if not guilds:
             # This will sync all GUILD commands for the current context’s guild
             # it will not sync GLOBAL commands that haven't been synced yet
             # USE FOR: syncing guild commands of this guild to discord
             if spec == "~":
-                synced = await ctx.bot.tree.sync(guild=ctx.guild)
+                results = {ctx.guild.id: await command_sync.sync_if_changed(ctx.bot, ctx.guild)}
             
             # copies all global commands (and guild commands of that guild) to current guild, and syncs
             # USE FOR: testing global commands before releasing
@@ -34,48 +43,172 @@ class Owner(commands.Cog):
             # have been synced before 
             elif spec == "*":
                 ctx.bot.tree.copy_global_to(guild=ctx.guild)
-                synced = await ctx.bot.tree.sync(guild=ctx.guild)
+                results = {ctx.guild.id: await command_sync.sync_if_changed(ctx.bot, ctx.guild)}
             
             # removes guild commands from this guild
             # USE FOR: clearing testing commands from test guild
             # CAUTION: removes guild commands too. make sure to add them back if there are any
             elif spec == "^":
                 ctx.bot.tree.clear_commands(guild=ctx.guild)
-                await ctx.bot.tree.sync(guild=ctx.guild)
-                synced = []
+                results = {ctx.guild.id: await command_sync.sync_if_changed(ctx.bot, ctx.guild)}
+
+            # sync global tree (and guilds with their own commands) to discord, even if nothing changed
+            # USE FOR: when discord's commands were changed outside of the bot
+            elif spec == "!":
+                results = await command_sync.sync_all(ctx.bot, force = True)
             
-            # sync global tree to discord
+            # sync global tree (and guilds with their own commands) to discord
             # USE FOR: releasing global commands to all servers
             else:
-                synced = await ctx.bot.tree.sync()
+                results = await command_sync.sync_all(ctx.bot)
 
-            await ctx.send(
-                f"Synced {len(synced)} commands {'globally' if spec is None else 'to the current guild.'}"
-            )
-            return
+        else:
+            results = {}
 
-        ret = 0
-        for guild in guilds:
-            try:
-                await ctx.bot.tree.sync(guild=guild)
-            except discord.HTTPException:
-                pass
-            else:
-                ret += 1
+            for guild in guilds:
+                try:
+                    results[guild.id] = await command_sync.sync_if_changed(ctx.bot, guild)
+                except discord.HTTPException:
+                    pass
+
+        lines = []
+        for scope, result in results.items():
+            where = "Global" if scope == command_sync.GLOBAL else f"Guild {scope}"
+            status = "synced" if result['synced'] else "up to date"
+            lines.append(f"**{where}**: {status} ({command_sync.describe(result)})")
+
+        if guilds:
+            lines.append(f"Checked the tree for {len(results)}/{len(guilds)} guilds.")
 
-        await ctx.send(f"Synced the tree to {ret}/{len(guilds)}.")
+        await ctx.send("\n".join(lines))
 
     @commands.command(hidden = True)
     async def set_pos(self, ctx: commands.Context, amount: float):
         """
-        Set price of shoes manually. Note that the price is recorded and doesn't change until 24 hours are up (owner only)
+        Set price of shoes manually, for this guild's market (or the default market in DMs).
+        Note that the price is recorded and doesn't change until 24 hours are up (owner only)
         """
         now = discord.utils.utcnow()
+        guild_id = ctx.guild.id if ctx.guild is not None else o.Shoe.DEFAULT_MARKET
 
-        await o.Shoe.set_price(self.pool, new_price = amount)
+        await o.Shoe.set_price(self.pool, new_price = amount, guild_id = guild_id)
 
         await ctx.send(f"Price set to: {amount} on {discord.utils.format_dt(now, 'F')}")
     
+    @commands.command(name = "pool", hidden = True)
+    async def pool_stats(self, ctx: commands.Context):
+        """
+        Show database pool metrics (owner only)
+        """
+        stats = self.bot.pool.get_stats()
+
+        await ctx.send(
+            "```\n" + "\n".join(f"{key}: {value}" for key, value in stats.items()) + "\n```"
+        )
+
+    @commands.command(hidden = True)
+    async def fairness(self, ctx: commands.Context):
+        """
+        Show interaction scheduling and latency of the busiest guilds (owner only)
+        """
+        stats = scheduler.get_stats()
+        guilds = stats.pop('guilds')
+
+        lines = [f"{key}: {value}" for key, value in stats.items()]
+        lines.append("")
+        lines.append(f"{'guild':>20} {'handled':>8} {'queued':>6} {'p50 ms':>8} {'p99 ms':>8}")
+        lines += [
+            f"{g['guild_id']:>20} {g['handled']:>8} {g['waiting']:>6} {g['p50_ms']:>8} {g['p99_ms']:>8}"
+            for g in guilds
+        ]
+
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
+    @commands.command(name = "loop", hidden = True)
+    async def loop_stats(self, ctx: commands.Context):
+        """
+        Show event loop lag histogram, and the last stack that blocked it (owner only)
+        """
+        stats = monitor.get_stats()
+        histogram = stats.pop('histogram')
+        total = stats['samples'] or 1
+
+        lines = [f"{key}: {value}" for key, value in stats.items()]
+        lines.append("")
+        lines += [f"{bucket:>10} {count:>8} {'#' * round(count / total * 40)}" for bucket, count in histogram]
+
+        message = "```\n" + "\n".join(lines) + "\n```"
+
+        if monitor.last_block is None:
+            await ctx.send(message)
+            return
+
+        # stacks can be long, so the last one is uploaded instead of going over the message limit
+        file = discord.File(io.BytesIO(monitor.last_block.encode()), filename = "last_block.txt")
+        await ctx.send(message + "Last block is attached.", file = file)
+
+    @commands.group(hidden = True, invoke_without_command = True)
+    async def profile(self, ctx: commands.Context, seconds: float = 30):
+        """
+        Profile the running bot for `seconds` (capped at PROFILE_MAX_SECS), then upload
+        the collapsed stacks for a flamegraph (owner only)
+        """
+        try:
+            profiler.start(asyncio.get_running_loop(), seconds)
+        except RuntimeError as e:
+            await ctx.send(str(e))
+            return
+
+        await ctx.send(f"Profiling CPU for {min(seconds, PROFILE_MAX_SECS):g} seconds, use `profile stop` to end early.")
+
+        await profiler.wait()
+
+        lines = [f"{name}: {count} samples ({fraction:.1%})" for name, count, fraction in profiler.summary()]
+        file = discord.File(io.BytesIO(profiler.collapsed().encode()), filename = "profile.folded")
+
+        await ctx.send(
+            f"Profile done: {profiler.samples} samples over {profiler.ended - profiler.started:.1f}s\n"
+            "```\n" + "\n".join(lines) + "\n```",
+            file = file
+        )
+
+    @profile.command(name = "stop", hidden = True)
+    async def profile_stop(self, ctx: commands.Context):
+        """
+        End the running profile early, it is uploaded where it was started (owner only)
+        """
+        if not profiler.running:
+            await ctx.send("No profile is running.")
+            return
+
+        profiler.stop()
+
+    @commands.command(hidden = True)
+    async def jobs(self, ctx: commands.Context):
+        """
+        Show health of background jobs (owner only)
+        """
+        embed = discord.Embed(title = "Background jobs", timestamp = discord.utils.utcnow())
+
+        for job in self.bot.supervisor.get_health():
+            status = "running" if job['running'] else ("failing" if job['failing'] else "ok")
+            last_run = discord.utils.format_dt(job['last_run'], 'R') if job['last_run'] else "never"
+            next_run = discord.utils.format_dt(job['next_run'], 'R') if job['next_run'] else "-"
+
+            value = (
+                f"**{status}**, {job['runs']} runs, {job['failures']} failures, {job['skipped']} skipped, "
+                f"{job['restarts']} restarts\n"
+                f"avg {job['avg_secs']:.2f}s, max {job['max_secs']:.2f}s\n"
+                f"last {last_run}, next {next_run}"
+            )
+
+            if job['last_error']:
+                value += f"\n`{job['last_error'][:200]}`"
+
+            embed.add_field(name = job['name'], value = value, inline = False)
+
+        await ctx.send(embed = embed)
+
     @commands.command(hidden = True)
     async def test(self, ctx: commands.Context):
         """
@@ -1,12 +1,26 @@
 import asyncio
 import asyncpg
-from config import connection_uri
-from params import first_price
+from params import first_price, GLOBAL_LEADERBOARD_SIZE
+
+async def main(dsn: str = None):
+    """
+    Initialises the database in config.py, or `dsn` if given
+    """
+    if dsn is None:
+        from config import connection_uri as dsn
 
-async def main():
     # Establish a connection to an existing database
-    conn = await asyncpg.connect(connection_uri)
-    
+    conn = await asyncpg.connect(dsn)
+
+    await init_db(conn)
+
+    # Close the connection.
+    await conn.close()
+
+async def init_db(conn: asyncpg.connection.Connection):
+    """
+    Creates all tables and sets the first price, then runs the updates
+    """
     # Execute statement to create tables
     await conn.execute(
         '''
@@ -59,9 +73,6 @@ async def main():
     
     await do_updates(conn)
 
-    # Close the connection.
-    await conn.close()
-
 async def do_updates(conn: asyncpg.connection.Connection):
     """
     This function runs all statements that are updates to the game
@@ -78,5 +89,191 @@ async def do_updates(conn: asyncpg.connection.Connection):
         """
     )
 
+    # order book for the shoe market
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            id SERIAL PRIMARY KEY,
+            guild_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            side TEXT NOT NULL CHECK (side IN ('sell', 'buy')),
+            price FLOAT NOT NULL CHECK (price > 0),
+            shoes INT NOT NULL CHECK (shoes > 0),
+            created_on TIMESTAMPTZ DEFAULT NOW()
+        );
+
+        CREATE INDEX IF NOT EXISTS orders_book_idx ON orders (guild_id, side, price, id);
+        CREATE INDEX IF NOT EXISTS orders_player_idx ON orders (guild_id, user_id);
+        """
+    )
+
+    # compacted shoe prices, and index for latest/historic price lookups
+    await conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS shoes_date_idx ON shoes (price_date DESC);
+
+        CREATE TABLE IF NOT EXISTS shoes_hourly (
+            bucket TIMESTAMPTZ PRIMARY KEY,
+            open FLOAT NOT NULL,
+            high FLOAT NOT NULL,
+            low FLOAT NOT NULL,
+            close FLOAT NOT NULL,
+            ticks INT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS shoes_daily (
+            bucket TIMESTAMPTZ PRIMARY KEY,
+            open FLOAT NOT NULL,
+            high FLOAT NOT NULL,
+            low FLOAT NOT NULL,
+            close FLOAT NOT NULL,
+            ticks INT NOT NULL
+        );
+        """
+    )
+
+    # per-guild shoe markets (guild 0 is the default market, which existing prices belong to)
+    await conn.execute(
+        """
+        ALTER TABLE events
+            ADD COLUMN IF NOT EXISTS price_mu FLOAT,
+            ADD COLUMN IF NOT EXISTS price_sd FLOAT;
+
+        ALTER TABLE shoes
+            ADD COLUMN IF NOT EXISTS guild_id BIGINT NOT NULL DEFAULT 0;
+        CREATE INDEX IF NOT EXISTS shoes_guild_date_idx ON shoes (guild_id, price_date DESC);
+
+        ALTER TABLE shoes_hourly
+            ADD COLUMN IF NOT EXISTS guild_id BIGINT NOT NULL DEFAULT 0,
+            DROP CONSTRAINT IF EXISTS shoes_hourly_pkey;
+        CREATE UNIQUE INDEX IF NOT EXISTS shoes_hourly_guild_bucket_idx ON shoes_hourly (guild_id, bucket);
+
+        ALTER TABLE shoes_daily
+            ADD COLUMN IF NOT EXISTS guild_id BIGINT NOT NULL DEFAULT 0,
+            DROP CONSTRAINT IF EXISTS shoes_daily_pkey;
+        CREATE UNIQUE INDEX IF NOT EXISTS shoes_daily_guild_bucket_idx ON shoes_daily (guild_id, bucket);
+        """
+    )
+
+    # daily ore payouts, partitioned by day (partitions are created by the payout task)
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ore_payouts (
+            guild_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            paid_on TIMESTAMPTZ NOT NULL,
+            ores INT NOT NULL,
+            guild_ores BIGINT NOT NULL,
+            shoes INT NOT NULL
+        ) PARTITION BY RANGE (paid_on);
+
+        CREATE INDEX IF NOT EXISTS ore_payouts_player_idx ON ore_payouts (guild_id, user_id, paid_on DESC);
+        """
+    )
+
+    # running ore total per guild, kept up to date by every ore write and rebuilt at payout
+    # filled from players once, when the column is added
+    has_total = await conn.fetchval(
+        """
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns WHERE table_name = 'events' AND column_name = 'ore_total'
+        );
+        """
+    )
+
+    if not has_total:
+        await conn.execute(
+            """
+            ALTER TABLE events
+                ADD COLUMN ore_total BIGINT NOT NULL DEFAULT 0;
+
+            UPDATE events
+            SET ore_total = totals.day_ores
+            FROM (SELECT guild_id, SUM(day_ores) AS day_ores FROM players GROUP BY guild_id) AS totals
+            WHERE events.guild_id = totals.guild_id;
+            """
+        )
+
+    # append-only ledger of balance and shoe changes, written in batches by helper/ledger.py
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ledger (
+            id BIGSERIAL PRIMARY KEY,
+            guild_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            kind TEXT NOT NULL,
+            balance FLOAT NOT NULL DEFAULT 0,
+            shoes INT NOT NULL DEFAULT 0,
+            price FLOAT,
+            other_id BIGINT,
+            actor_id BIGINT,
+            created_on TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+
+        CREATE INDEX IF NOT EXISTS ledger_player_idx ON ledger (guild_id, user_id, created_on DESC);
+        """
+    )
+
+    # hashes of the commands at the last tree sync, per scope (0 for global), see helper/command_sync.py
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS command_hashes (
+            scope BIGINT PRIMARY KEY,
+            hashes JSONB NOT NULL,
+            synced_on TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        """
+    )
+
+    # top players across every guild, refreshed concurrently by a job (unique index needed for that)
+    # to change GLOBAL_LEADERBOARD_SIZE, drop the view first so it is created again
+    await conn.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS players_balance_idx ON players (balance DESC);
+
+        CREATE MATERIALIZED VIEW IF NOT EXISTS global_leaderboard AS
+            SELECT
+                row_number() OVER (ORDER BY balance DESC, user_id, guild_id) AS rank,
+                user_id, guild_id, balance, pos
+            FROM players
+            WHERE balance IS NOT NULL
+            ORDER BY balance DESC, user_id, guild_id
+            LIMIT {int(GLOBAL_LEADERBOARD_SIZE)};
+
+        CREATE UNIQUE INDEX IF NOT EXISTS global_leaderboard_rank_idx ON global_leaderboard (rank);
+        CREATE INDEX IF NOT EXISTS global_leaderboard_player_idx ON global_leaderboard (user_id, guild_id);
+        """
+    )
+
+    # command cooldowns shared by every bot process, see helper/cooldowns.py
+    # unlogged: cheaper to write, and losing it on a database crash only resets cooldowns
+    await conn.execute(
+        """
+        CREATE UNLOGGED TABLE IF NOT EXISTS cooldowns (
+            command TEXT NOT NULL,
+            guild_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            tat TIMESTAMPTZ NOT NULL,
+            updated_on TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+
+            PRIMARY KEY (command, guild_id, user_id)
+        );
+
+        CREATE INDEX IF NOT EXISTS cooldowns_updated_idx ON cooldowns (updated_on);
+        """
+    )
+
+    # indexes for per-guild and time based lookups (checked by benchmarks/query_plans.py)
+    await conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS players_guild_balance_idx ON players (guild_id, balance DESC);
+        CREATE INDEX IF NOT EXISTS players_guild_ores_idx ON players (guild_id, day_ores DESC);
+        CREATE INDEX IF NOT EXISTS events_last_collect_idx ON events (last_collect);
+        CREATE INDEX IF NOT EXISTS views_message_idx ON views (message_id);
+        CREATE INDEX IF NOT EXISTS views_channel_idx ON views (channel_id);
+        CREATE INDEX IF NOT EXISTS views_created_idx ON views (created_on);
+        """
+    )
+
 if __name__ == '__main__':
-    asyncio.get_event_loop().run_until_complete(main())
\ No newline at end of file
+    asyncio.get_event_loop().run_until_complete(main())
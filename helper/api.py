@@ -0,0 +1,168 @@
+import hashlib
+import json
+import time
+
+from aiohttp import web
+from discord.ext import commands
+
+from params import API_HOST, API_PORT, API_CACHE_SECS, API_RATE_PER_MIN
+from helper.objects import Shoe, Event, Leaderboard
+
+# IMPORTANT
+# read-only JSON API, run in the bot process when API_ENABLED is set. responses are cached for API_CACHE_SECS.
+# ids are sent as strings, as they don't fit in a javascript number.
+
+class DashboardAPI:
+    # most price history points served
+    MAX_HISTORY = 50
+
+    def __init__(self, bot: commands.Bot) -> None:
+        self.bot = bot
+        self.runner = None
+        # key -> (built_on, body, etag)
+        self.cache = {}
+        # ip -> (tokens, last_seen)
+        self.buckets = {}
+
+        self.app = web.Application(middlewares = [self.rate_limit])
+        self.app.add_routes([
+            web.get('/api/price', self.get_price),
+            web.get('/api/price/history', self.get_price_history),
+            web.get('/api/guilds/{guild_id}/leaderboard', self.get_leaderboard),
+        ])
+
+    async def start(self):
+        """
+        Start serving on API_HOST:API_PORT
+        """
+        self.runner = web.AppRunner(self.app, access_log = None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, API_HOST, API_PORT).start()
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    @web.middleware
+    async def rate_limit(self, request: web.Request, handler):
+        """
+        Token bucket per client IP: API_RATE_PER_MIN requests a minute, with bursts up to the same amount
+        """
+        ip = request.remote or 'unknown'
+        now = time.monotonic()
+        tokens, last_seen = self.buckets.get(ip, (API_RATE_PER_MIN, now))
+
+        tokens = min(API_RATE_PER_MIN, tokens + (now - last_seen) * API_RATE_PER_MIN / 60)
+
+        if tokens < 1:
+            retry_after = (1 - tokens) * 60 / API_RATE_PER_MIN
+            return web.json_response(
+                {'error': 'rate limited'}, status = 429,
+                headers = {'Retry-After': str(int(retry_after) + 1)}
+            )
+
+        self.buckets[ip] = (tokens - 1, now)
+
+        # forget clients idle for a minute (their bucket is full again), so the table doesn't grow forever
+        if len(self.buckets) > 10000:
+            self.buckets = {k: v for k, v in self.buckets.items() if now - v[1] < 60}
+
+        return await handler(request)
+
+    async def respond(self, request: web.Request, key, build) -> web.Response:
+        """
+        Responds with the cached body for `key`, rebuilding it with `build()` once it is older than API_CACHE_SECS.
+        Answers 304 if the client already has it
+        """
+        cached = self.cache.get(key)
+
+        if cached is None or (time.monotonic() - cached[0]) >= API_CACHE_SECS:
+            body = json.dumps(await build(), separators = (',', ':')).encode()
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            cached = self.cache[key] = (time.monotonic(), body, etag)
+
+        _, body, etag = cached
+        headers = {'ETag': etag, 'Cache-Control': f'public, max-age={API_CACHE_SECS}'}
+
+        if etag in request.headers.get('If-None-Match', ''):
+            return web.Response(status = 304, headers = headers)
+
+        return web.Response(body = body, content_type = 'application/json', headers = headers)
+
+    def get_guild_id(self, value) -> int:
+        """
+        Guild id from the request, which must be a guild the bot is in. Raises 404 otherwise
+        """
+        if value is None:
+            return Shoe.DEFAULT_MARKET
+
+        try:
+            guild_id = int(value)
+        except ValueError:
+            raise web.HTTPNotFound()
+
+        if self.bot.get_guild(guild_id) is None:
+            raise web.HTTPNotFound()
+
+        return guild_id
+
+    async def get_price(self, request: web.Request) -> web.Response:
+        """
+        GET /api/price?guild=<id>: current shoe price of a guild's market (or the default market)
+        """
+        guild_id = self.get_guild_id(request.query.get('guild'))
+
+        async def build():
+            return {'guild_id': str(guild_id), 'price': await Shoe.get_price(self.bot.pool, guild_id)}
+
+        return await self.respond(request, ('price', guild_id), build)
+
+    async def get_price_history(self, request: web.Request) -> web.Response:
+        """
+        GET /api/price/history?guild=<id>&count=<n>: latest prices, newest first
+        """
+        guild_id = self.get_guild_id(request.query.get('guild'))
+
+        try:
+            count = min(self.MAX_HISTORY, max(1, int(request.query.get('count', 10))))
+        except ValueError:
+            raise web.HTTPBadRequest()
+
+        async def build():
+            records = await Shoe.get_price_history(self.bot.pool, count, guild_id = guild_id)
+            return {
+                'guild_id': str(guild_id),
+                'prices': [{'date': r['price_date'].isoformat(), 'price': r['price']} for r in records]
+            }
+
+        return await self.respond(request, ('history', guild_id, count), build)
+
+    async def get_leaderboard(self, request: web.Request) -> web.Response:
+        """
+        GET /api/guilds/<id>/leaderboard?board=balance|ores: top players of the guild
+        """
+        guild_id = self.get_guild_id(request.match_info['guild_id'])
+        board = request.query.get('board', 'balance')
+
+        if board not in ('balance', 'ores'):
+            raise web.HTTPBadRequest()
+
+        async def build():
+            _, records, _ = await Leaderboard.get_snapshot(Event(guild_id, self.bot.pool), board)
+            return {
+                'guild_id': str(guild_id),
+                'board': board,
+                'players': [
+                    {
+                        'rank': rank,
+                        'user_id': str(r['user_id']),
+                        'balance': r['balance'],
+                        'shoes': r['pos'],
+                        'ores': r['day_ores']
+                    }
+                    for rank, r in enumerate(records, start = 1)
+                ]
+            }
+
+        return await self.respond(request, ('leaderboard', guild_id, board), build)
@@ -0,0 +1,124 @@
+import hashlib
+import json
+
+import discord
+from discord.ext import commands
+
+# IMPORTANT
+# a scope (0 for global, else the guild id) is only synced when its commands' hashes differ from the last sync's.
+
+GLOBAL = 0
+
+
+def _key(payload: dict) -> str:
+    # slash commands and context menus can share a name
+    if payload.get('type', 1) == discord.AppCommandType.chat_input.value:
+        return payload['name']
+
+    return f"{payload['name']} (menu)"
+
+
+def get_hashes(tree: discord.app_commands.CommandTree, guild: discord.abc.Snowflake = None) -> dict:
+    """
+    Get stable hash of every command of the tree in a scope (global when `guild` is None), by command name
+    """
+    hashes = {}
+
+    for command in tree.get_commands(guild = guild):
+        payload = command.to_dict()
+        serialized = json.dumps(payload, sort_keys = True, separators = (',', ':'), default = str)
+        hashes[_key(payload)] = hashlib.sha256(serialized.encode()).hexdigest()
+
+    return hashes
+
+
+def diff(old: dict, new: dict) -> dict:
+    """
+    Commands "added", "removed" and "changed" between two sets of hashes
+    """
+    return {
+        'added': sorted(new.keys() - old.keys()),
+        'removed': sorted(old.keys() - new.keys()),
+        'changed': sorted(name for name in new.keys() & old.keys() if new[name] != old[name])
+    }
+
+
+def describe(changes: dict) -> str:
+    """
+    One line description of a diff (or a result of sync_if_changed)
+    """
+    parts = [
+        f"{kind} {', '.join(f'`{name}`' for name in changes[kind])}"
+        for kind in ('added', 'removed', 'changed') if changes.get(kind)
+    ]
+
+    return "; ".join(parts) if parts else "no changes"
+
+
+async def get_stored(pool, scope: int) -> dict:
+    """
+    Get hashes of the last sync of a scope (empty if it was never synced)
+    """
+    hashes = await pool.fetchval("SELECT hashes FROM command_hashes WHERE scope = $1", scope)
+
+    return json.loads(hashes) if hashes is not None else {}
+
+
+async def store(pool, scope: int, hashes: dict):
+    # guilds left without commands don't need to be checked again
+    if scope != GLOBAL and not hashes:
+        await pool.execute("DELETE FROM command_hashes WHERE scope = $1", scope)
+        return
+
+    await pool.execute(
+        """
+        INSERT INTO command_hashes (scope, hashes, synced_on)
+        VALUES ($1, $2, NOW())
+        ON CONFLICT (scope) DO UPDATE SET hashes = EXCLUDED.hashes, synced_on = EXCLUDED.synced_on
+        """,
+        scope, json.dumps(hashes)
+    )
+
+
+async def sync_if_changed(bot: commands.Bot, guild: discord.abc.Snowflake = None, *, force: bool = False) -> dict:
+    """
+    Syncs a scope of the tree (global when `guild` is None) if its commands changed since the last sync,
+    or always when `force` is set.
+
+    Returns dictionary with "synced" bool and the "added", "removed" and "changed" command names
+    """
+    scope = guild.id if guild is not None else GLOBAL
+    hashes = get_hashes(bot.tree, guild)
+    changes = diff(await get_stored(bot.pool, scope), hashes)
+
+    synced = force or any(changes.values())
+
+    if synced:
+        await bot.tree.sync(guild = guild)
+        await store(bot.pool, scope, hashes)
+
+    return {'synced': synced, **changes}
+
+
+async def sync_all(bot: commands.Bot, *, force: bool = False) -> dict:
+    """
+    Syncs the global commands, and the commands of each guild that has its own, where they changed.
+    Guilds that had commands at their last sync but have none now are synced too, so they are removed.
+
+    Returns dictionary of scope (0 for global) -> result of sync_if_changed
+    """
+    results = {GLOBAL: await sync_if_changed(bot, force = force)}
+
+    # guilds with commands synced before, or the bot's guilds with commands in the tree
+    stored = await bot.pool.fetch("SELECT scope FROM command_hashes WHERE scope <> $1", GLOBAL)
+    guild_ids = {record['scope'] for record in stored}
+    guild_ids.update(guild.id for guild in bot.guilds if bot.tree.get_commands(guild = guild))
+
+    for guild_id in guild_ids:
+        try:
+            results[guild_id] = await sync_if_changed(bot, discord.Object(guild_id), force = force)
+        except discord.HTTPException as e:
+            # e.g. the bot was removed from the guild
+            print(f"Could not sync commands of guild {guild_id}: {e}")
+
+    return results
@@ -0,0 +1,170 @@
+import asyncio
+import contextlib
+import time
+import traceback
+from datetime import datetime, timezone
+
+from discord import app_commands
+
+from params import COOLDOWN_SYNC_SECS
+
+# IMPORTANT
+# cooldowns (GCRA) are checked against a local copy, synced with the `cooldowns` table every COOLDOWN_SYNC_SECS,
+# ... so between processes a cooldown can be missed for at most that long.
+
+# rows read again on each sync, in seconds, so rows committed late by other processes aren't missed
+OVERLAP_SECS = 5
+# syncs between deletes of expired rows
+EXPIRE_EVERY = 60
+
+
+class CooldownStore:
+    def __init__(self) -> None:
+        self.pool = None
+        self.task = None
+
+        # (command, guild_id, user_id) -> tat, as a unix timestamp
+        self.tats = {}
+        # keys used since the last sync
+        self.dirty = set()
+        # database time of the last read
+        self.synced_on = None
+        self.syncs = 0
+
+    async def start(self, pool):
+        """
+        Loads cooldowns that haven't ended and starts syncing. Use on startup
+        """
+        self.pool = pool
+        records = await pool.fetch("SELECT command, guild_id, user_id, tat FROM cooldowns WHERE tat > NOW()")
+
+        for record in records:
+            self.tats[(record['command'], record['guild_id'], record['user_id'])] = record['tat'].timestamp()
+
+        self.synced_on = await pool.fetchval("SELECT NOW()")
+        self.task = asyncio.create_task(self._loop(), name = "cooldowns")
+
+    async def stop(self):
+        """
+        Stops syncing, writing the last uses. Call before the pool is closed
+        """
+        if self.task is not None:
+            self.task.cancel()
+            # a write in progress puts its keys back in dirty when cancelled, so wait for it
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+
+        if self.pool is not None:
+            await self._write()
+
+    def hit(self, command: str, guild_id: int, user_id: int, rate: int, per: float) -> float:
+        """
+        Uses the cooldown of `command` for the player, allowing `rate` uses every `per` seconds.
+        Returns 0 if allowed, else seconds until it is
+        """
+        key = (command, guild_id or 0, user_id)
+        now = time.time()
+        interval = per / rate
+        tat = max(self.tats.get(key, now), now)
+
+        # every token is used
+        if tat - now > per - interval:
+            return tat - now - (per - interval)
+
+        self.tats[key] = tat + interval
+        self.dirty.add(key)
+        return 0.0
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(COOLDOWN_SYNC_SECS)
+
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                print("Cooldown sync failed:")
+                traceback.print_exc()
+
+    async def _write(self):
+        """
+        Writes local uses since the last sync, keeping the later tat where processes disagree
+        """
+        if not self.dirty:
+            return
+
+        keys, self.dirty = self.dirty, set()
+
+        try:
+            await self.pool.execute(
+                """
+                INSERT INTO cooldowns (command, guild_id, user_id, tat, updated_on)
+                SELECT *, clock_timestamp() FROM unnest($1::TEXT[], $2::BIGINT[], $3::BIGINT[], $4::TIMESTAMPTZ[])
+                ON CONFLICT (command, guild_id, user_id) DO UPDATE
+                SET tat = GREATEST(cooldowns.tat, EXCLUDED.tat), updated_on = EXCLUDED.updated_on
+                """,
+                [k[0] for k in keys], [k[1] for k in keys], [k[2] for k in keys],
+                [datetime.fromtimestamp(self.tats[k], timezone.utc) for k in keys]
+            )
+        except BaseException:
+            # written on the next sync
+            self.dirty |= keys
+            raise
+
+    async def sync(self):
+        """
+        Writes local uses, and reads the uses other processes made since the last sync
+        """
+        await self._write()
+
+        now = await self.pool.fetchval("SELECT NOW()")
+        records = await self.pool.fetch(
+            "SELECT command, guild_id, user_id, tat FROM cooldowns WHERE updated_on > $1 - $2 * INTERVAL '1 second'",
+            self.synced_on, OVERLAP_SECS
+        )
+        self.synced_on = now
+
+        for record in records:
+            key = (record['command'], record['guild_id'], record['user_id'])
+            tat = record['tat'].timestamp()
+
+            if tat > self.tats.get(key, 0):
+                self.tats[key] = tat
+
+        self.syncs += 1
+
+        if self.syncs % EXPIRE_EVERY == 0:
+            await self._expire()
+
+    async def _expire(self):
+        """
+        Forgets cooldowns that have ended, locally and in the table
+        """
+        now = time.time()
+        self.tats = {k: v for k, v in self.tats.items() if v > now or k in self.dirty}
+        await self.pool.execute("DELETE FROM cooldowns WHERE tat < NOW() - INTERVAL '1 minute'")
+
+
+# the process's cooldowns
+store = CooldownStore()
+
+
+def cooldown(rate: int, per: float, name: str = None):
+    """
+    Command check like app_commands.checks.cooldown, per player in each guild, using the shared store.
+    `name` is the key of the cooldown (the command's qualified name by default)
+    """
+    bucket = app_commands.Cooldown(rate, per)
+
+    def predicate(itx) -> bool:
+        command = name or itx.command.qualified_name
+        retry_after = store.hit(command, itx.guild_id, itx.user.id, rate, per)
+
+        if retry_after:
+            raise app_commands.CommandOnCooldown(bucket, retry_after)
+
+        return True
+
+    return app_commands.check(predicate)
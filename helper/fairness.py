@@ -0,0 +1,202 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from helper import tracing
+from params import FAIR_MAX_ACTIVE, FAIR_GUILD_MAX_ACTIVE, FAIR_GUILD_WEIGHTS, FAIR_LATENCY_SAMPLES
+
+# IMPORTANT
+# every interaction waits here for a slot, FAIR_MAX_ACTIVE at once and FAIR_GUILD_MAX_ACTIVE per guild,
+# ... given out round robin between guilds, so a busy guild only delays its own queue.
+
+class GuildStats:
+    """
+    Recent latencies of one guild's interactions, from creation to handled
+    """
+    __slots__ = ('latencies', 'handled', 'last_seen')
+
+    def __init__(self) -> None:
+        self.latencies = deque(maxlen = FAIR_LATENCY_SAMPLES)
+        self.handled = 0
+        self.last_seen = 0.0
+
+
+class FairScheduler:
+    # stats of guilds idle for this long are dropped, in seconds
+    STATS_IDLE_SECS = 3600
+
+    def __init__(self, max_active: int = FAIR_MAX_ACTIVE, guild_max_active: int = FAIR_GUILD_MAX_ACTIVE) -> None:
+        self.max_active = max_active
+        self.guild_max_active = guild_max_active
+        self.active = 0
+
+        # guild_id -> futures waiting for a slot
+        self.queues = {}
+        # guild_id -> interactions running
+        self.running = {}
+        # guilds with waiting interactions, in round robin order
+        self.ring = deque()
+        # slots the guild at the front of the ring can still get this turn
+        self.credit = 0
+
+        # guild_id -> GuildStats
+        self.stats = {}
+        self.waits = deque(maxlen = FAIR_LATENCY_SAMPLES)
+
+    def weight(self, guild_id: int) -> int:
+        return max(1, FAIR_GUILD_WEIGHTS.get(guild_id, 1))
+
+    def _can_run(self, guild_id: int) -> bool:
+        return self.running.get(guild_id, 0) < self.guild_max_active
+
+    def _grant(self, guild_id: int):
+        self.active += 1
+        self.running[guild_id] = self.running.get(guild_id, 0) + 1
+
+    def _next_turn(self):
+        self.ring.rotate(-1)
+        self.credit = self.weight(self.ring[0]) if self.ring else 0
+
+    def _dispatch(self):
+        """
+        Gives free slots to waiting interactions, round robin over the guilds
+        """
+        # guilds passed over in a row, because they are at their cap
+        passed = 0
+
+        while self.ring and self.active < self.max_active and passed < len(self.ring):
+            guild_id = self.ring[0]
+            queue = self.queues[guild_id]
+
+            # drop interactions that stopped waiting
+            while queue and queue[0].done():
+                queue.popleft()
+
+            if not queue:
+                del self.queues[guild_id]
+                self.ring.popleft()
+                self.credit = self.weight(self.ring[0]) if self.ring else 0
+                continue
+
+            if not self._can_run(guild_id):
+                passed += 1
+                self._next_turn()
+                continue
+
+            passed = 0
+            self._grant(guild_id)
+            queue.popleft().set_result(None)
+            self.credit -= 1
+
+            if self.credit <= 0:
+                self._next_turn()
+
+    def _release(self, guild_id: int):
+        self.active -= 1
+        self.running[guild_id] -= 1
+
+        if not self.running[guild_id]:
+            del self.running[guild_id]
+
+        self._dispatch()
+
+    async def _wait(self, guild_id: int):
+        """
+        Waits for a slot for the guild
+        """
+        # nothing queued: run right away, if under the caps
+        if not self.ring and self.active < self.max_active and self._can_run(guild_id):
+            self._grant(guild_id)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+
+        if guild_id not in self.queues:
+            self.queues[guild_id] = deque()
+            self.ring.append(guild_id)
+
+            if len(self.ring) == 1:
+                self.credit = self.weight(guild_id)
+
+        self.queues[guild_id].append(future)
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # the slot was given just as the wait was cancelled: pass it on
+            if future.done() and not future.cancelled():
+                self._release(guild_id)
+            raise
+
+    @asynccontextmanager
+    async def slot(self, guild_id: int, created: float = None):
+        """
+        Runs the block once the guild gets a slot. `created` is the interaction's creation
+        as a time.time() timestamp, for latency stats (defaults to now)
+        """
+        guild_id = guild_id or 0
+        start = time.perf_counter()
+
+        with tracing.span('fair.wait'):
+            await self._wait(guild_id)
+
+        self.waits.append(time.perf_counter() - start)
+
+        try:
+            yield
+        finally:
+            self._release(guild_id)
+            self._record(guild_id, time.time() - created if created is not None else time.perf_counter() - start)
+
+    def _record(self, guild_id: int, latency: float):
+        stats = self.stats.get(guild_id)
+
+        if stats is None:
+            stats = self.stats[guild_id] = GuildStats()
+
+        stats.latencies.append(latency)
+        stats.handled += 1
+        stats.last_seen = time.monotonic()
+
+    def _prune(self):
+        now = time.monotonic()
+        self.stats = {k: v for k, v in self.stats.items() if now - v.last_seen < self.STATS_IDLE_SECS}
+
+    def get_stats(self, top: int = 10) -> dict:
+        """
+        Get scheduler state and the p50/p99 latency (ms) of the `top` busiest guilds
+        """
+        self._prune()
+
+        def pct(values, p):
+            return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 2) if values else 0.0
+
+        guilds = []
+        for guild_id, stats in sorted(self.stats.items(), key = lambda item: item[1].handled, reverse = True)[:top]:
+            latencies = sorted(stats.latencies)
+            guilds.append({
+                'guild_id': guild_id,
+                'handled': stats.handled,
+                'waiting': len(self.queues.get(guild_id, ())),
+                'running': self.running.get(guild_id, 0),
+                'p50_ms': pct(latencies, 0.5),
+                'p99_ms': pct(latencies, 0.99)
+            })
+
+        waits = sorted(self.waits)
+
+        return {
+            'active': self.active,
+            'max_active': self.max_active,
+            'guild_max_active': self.guild_max_active,
+            'waiting': sum(len(q) for q in self.queues.values()),
+            'queued_guilds': len(self.ring),
+            'wait_p99_ms': pct(waits, 0.99),
+            'guilds': guilds
+        }
+
+
+# the process's scheduler
+scheduler = FairScheduler()
@@ -1,10 +1,13 @@
 import discord
 from discord.ext import commands
+from discord.utils import utcnow
 from asyncpg import Pool
 
-from params import EMBED_COLOUR
+from params import EMBED_COLOUR, ORE_HISTORY_DAYS, PRICE_TICK_DAYS, PRICE_HOURLY_DAYS
 
-from helper.objects import Shoe, ViewHelper, Player, Event
+from helper import ledger, queries
+from helper.objects import Shoe, ViewHelper, Player, Event, Leaderboard, OreHistory, mention, projected_shoes
+from helper.middleware import BotView
 
 # IMPORTANT
 # records to view tables can only be added/removed 
@@ -13,11 +16,31 @@ from helper.objects import Shoe, ViewHelper, Player, Event
 
 async def price_fluct(pool: Pool):
     """
-    Fluctuates price once designated interval is up
+    Fluctuates price of every market once designated interval is up
     """
-    # check last change
-    if await Shoe.check_last_change(pool):
-        await Shoe.set_price(pool)
+    # checks the last change itself, under the price lock
+    await Shoe.tick(pool)
+    
+async def catch_up_prices(pool: Pool):
+    """
+    Makes up price changes missed while the bot was down
+    """
+    missed = await Shoe.catch_up(pool)
+
+    if missed:
+        print(f"Made up {missed} missed price changes")
+
+async def refresh_global_leaderboard(pool: Pool):
+    """
+    Rebuilds the global leaderboard
+    """
+    await Leaderboard.refresh_global(pool)
+
+async def compact_prices(pool: Pool):
+    """
+    Rolls old shoe prices into hourly and daily aggregates
+    """
+    await Shoe.compact(pool, PRICE_TICK_DAYS, PRICE_HOURLY_DAYS)
     
 async def pos_giveaway(bot: commands.Bot, pool: Pool):
     """
@@ -34,17 +57,18 @@ async def pos_giveaway(bot: commands.Bot, pool: Pool):
     inv_views = await ViewHelper.get_overdue_views(pool)
     cids = set()
 
+    # views by id, so each overdue view is found without scanning my_views
+    views_by_id = {x.view.id: x for x in bot.my_views}
+    stopped = set()
+
     for record in inv_views:
         # get view to stop
-        for x in bot.my_views:
-            if x.view.id == record['id']:
-                # remove this view from my_views list, now that we are stopping it
-                bot.my_views.remove(x)
-    
-                # stop the view
-                x.stop()
+        x = views_by_id.get(record['id'])
 
-                break
+        if x is not None:
+            # stop the view, it is removed from my_views below
+            x.stop()
+            stopped.add(record['id'])
     
         # add to set of channel ids to remove from views table
         # ... and for sending new views
@@ -52,6 +76,10 @@ async def pos_giveaway(bot: commands.Bot, pool: Pool):
         # note that set is being used to avoid duplicates
         cids.add(record['channel_id'])
 
+    # remove stopped views from my_views list, in one pass
+    if stopped:
+        bot.my_views[:] = [x for x in bot.my_views if x.view.id not in stopped]
+
     # all ids to remove have been collected
     # ... now remove them from views table
     await ViewHelper.delete_views(pool, channel_ids = cids)
@@ -67,76 +95,67 @@ async def send_shoe_ores(pool: Pool):
     """
     Calculates shoes per person based on ore reward, 
     for each guild that has surpassed a day in last_collect
+
+    Each guild's ores come from its running total (events.ore_total), which is rebuilt at payout.
+    Each payout is recorded in ore_payouts, in the same transaction
     """
-    
-    # get sum of all guilds
-    guild_ores = await pool.fetch("SELECT guild_id, sum(day_ores) AS day_ores FROM players GROUP BY guild_id;")
-
-    # get all players that are in overdue guilds (overdue ie >24 hours)
-    players = await pool.fetch(
-        """
-        SELECT players.* FROM players
-        INNER JOIN events ON players.guild_id = events.guild_id
-        WHERE (NOW() - events.last_collect) >= INTERVAL '24 hours';
-        """
-    )
+
+    # get overdue guilds (overdue ie >24 hours)
+    guild_ids = await pool.fetch(queries.OVERDUE_ORE_GUILDS)
 
     # if there are no overdue guilds, just finish the task
-    if players == []:
+    if guild_ids == []:
         return
 
-    # update guilds with overdue timer
-    # I am doing this update here so there is no delay between fetching and updating
-    await pool.execute(
-        """
-        UPDATE events
-        SET last_collect = NOW()
-        WHERE (NOW() - last_collect) >= INTERVAL '24 hours';
-        """
-    )
+    guild_ids = [record['guild_id'] for record in guild_ids]
 
-    player_frac = 0
+    # get all players with ores in these guilds, with their guild's totals
+    players = await pool.fetch(queries.ORE_PAYOUT_PLAYERS, guild_ids)
     insert_players = []
+    history = []
+    paid_on = utcnow()
 
     # iterate through all these players
     for player in players:
-        # just move on if player has no ores
-        if player['day_ores'] == 0:
-            continue
-
-        # get player's fraction of total ores
-        for guild in guild_ores:
-            if guild['guild_id'] == player['guild_id']:
-                # note that we don't check if guild's total ores is not zero
-                # (to prevent division by zero)
-                # we skipped all players who have zero ores, and so any players who go through this section
-                # ... will have >0 ores and hence >0 guild's total ores
-                player_frac = player['day_ores'] / guild['day_ores']
-                    
-                # get total shoes given away
-                shoes = await pool.fetchval("SELECT shoe_ores FROM events WHERE guild_id = $1", player['guild_id'])
-
-                # get player shoes
-                # note that I am not keeping track of total shoes
-                # so it will give away more than total shoes in some situations
-                player_shoes = round(player_frac * shoes)
-
-                # insert to a list of tuples (player_id, guild_id, shoes)
-                # note that players who have 0 ores will not be updated, because there's nothing to update
-                insert_players.append((player_shoes, player['user_id'], player['guild_id']))
-
-                # we found our record, break from guilds loop
-                break
-
-    # update shoes using list of tuples, and reset day_ores to 0
-    await pool.executemany(
-        """
-        UPDATE players
-        SET pos = pos + $1, day_ores = 0
-        WHERE user_id = $2 AND guild_id = $3;
-        """,
-        insert_players
-    )
+        # note that we don't check if guild's total ores is not zero
+        # we only fetched players who have ores, so their guild's total is >0 too
+        # note that I am not keeping track of total shoes
+        # so it will give away more than total shoes in some situations
+        player_shoes = projected_shoes(player['day_ores'], player['ore_total'], player['shoe_ores'])
+
+        # insert to a list of tuples (shoes, ores paid, player_id, guild_id)
+        insert_players.append((player_shoes, player['day_ores'], player['user_id'], player['guild_id']))
+
+        # and keep the day's record of it
+        history.append((
+            player['guild_id'], player['user_id'], paid_on, 
+            player['day_ores'], player['ore_total'], player_shoes
+        ))
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # update shoes using list of tuples, and take away the ores paid for
+            # ores mined since the players were fetched are kept for the next payout
+            await conn.executemany(queries.PAY_ORES, insert_players)
+
+            # update guilds with overdue timer, and rebuild their ore totals from what is left
+            # only the guilds fetched above, in case another one became overdue in the meantime
+            await conn.execute(queries.CLOSE_ORE_DAY, guild_ids)
+
+            await OreHistory.record(conn, history, paid_on)
+
+    for player_shoes, _, user_id, guild_id in insert_players:
+        if player_shoes:
+            ledger.record(guild_id, user_id, ledger.ORE_PAYOUT, shoes = player_shoes)
+
+    # balances and ores changed for these guilds
+    Leaderboard.invalidate_many(guild_ids)
+
+async def drop_ore_history(pool: Pool):
+    """
+    Drops days of ore history older than ORE_HISTORY_DAYS
+    """
+    await OreHistory.drop_old(pool, ORE_HISTORY_DAYS)
 
 async def make_giveaway_embed(pool: Pool, guild_id: int, pos_given: int = None, description: str = None) -> discord.Embed:
 
@@ -178,7 +197,7 @@ async def send_view(pool: Pool, channel: discord.TextChannel, my_views):
     # add view to my_views
     my_views.append(view)
 
-class GiveawayView(discord.ui.View):
+class GiveawayView(BotView):
     def __init__(self, pool: Pool, view: ViewHelper = None):
         self.pool = pool
         self.view = view
@@ -202,7 +221,7 @@ class GiveawayView(discord.ui.View):
         pos_given = await Event(itx.guild_id, self.pool).get_pos_given()
 
         # edit giveaway embed to show all claims
-        description = "Claimed by: " + ", ".join([itx.guild.get_member(x).mention for x in self.view.used_users])
+        description = "Claimed by: " + ", ".join([mention(x) for x in self.view.used_users])
         embed = await make_giveaway_embed(self.pool, itx.guild_id, pos_given, description)
 
         # if limit reached, disable the button
@@ -0,0 +1,165 @@
+import asyncio
+import contextlib
+import traceback
+
+from discord import Embed, Colour
+from discord.utils import utcnow, format_dt
+
+from params import EMBED_COLOUR, LEDGER_BATCH_SIZE, LEDGER_FLUSH_SECS, LEDGER_MAX_BUFFER
+from helper import queries
+
+# IMPORTANT
+# `record` only buffers an entry, call it after the change is committed.
+# the writer COPYs the buffer every LEDGER_FLUSH_SECS (or LEDGER_BATCH_SIZE entries), and when the bot closes.
+
+# kinds of entries
+SELL = 'sell'
+CLAIM = 'claim'
+ORE_PAYOUT = 'ore_payout'
+ADMIN_SET = 'admin_set'
+ORDER_ESCROW = 'order_escrow'
+ORDER_REFUND = 'order_refund'
+TRADE = 'trade'
+
+COLUMNS = ('guild_id', 'user_id', 'kind', 'balance', 'shoes', 'price', 'other_id', 'actor_id', 'created_on')
+
+
+class LedgerWriter:
+    """
+    Buffers ledger entries and writes them in batches
+    """
+    def __init__(self) -> None:
+        self.pool = None
+        self.buffer = []
+        self.task = None
+        self.wake = asyncio.Event()
+
+        # metrics
+        self.written = 0
+        self.dropped = 0
+        self.failures = 0
+
+    def record(
+        self, guild_id: int, user_id: int, kind: str, *,
+        balance: float = 0.0, shoes: int = 0, price: float = None, other_id: int = None, actor_id: int = None
+    ):
+        """
+        Adds an entry: `balance` and `shoes` are the changes to the player's balance and shoes,
+        `price` the price per pair, `other_id` the other player of a trade and `actor_id` who made an admin change
+        """
+        self.buffer.append((guild_id, user_id, kind, float(balance), int(shoes), price, other_id, actor_id, utcnow()))
+
+        if len(self.buffer) >= LEDGER_BATCH_SIZE:
+            self.wake.set()
+
+    def start(self, pool):
+        self.pool = pool
+        self.task = asyncio.create_task(self._loop(), name = "ledger")
+
+    async def stop(self):
+        """
+        Stops the writer and flushes what is left. Call before the pool is closed
+        """
+        if self.task is not None:
+            self.task.cancel()
+            # a flush in progress puts its batch back in the buffer when cancelled, so wait for it
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+
+        await self.flush()
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), LEDGER_FLUSH_SECS)
+            except asyncio.TimeoutError:
+                pass
+
+            self.wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        """
+        Writes buffered entries with COPY, keeping them for the next flush if it fails
+        """
+        if not self.buffer or self.pool is None:
+            return
+
+        batch, self.buffer = self.buffer, []
+
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.copy_records_to_table('ledger', records = batch, columns = COLUMNS)
+        except asyncio.CancelledError:
+            self.buffer[:0] = batch
+            raise
+        except Exception:
+            self.failures += 1
+            print("Ledger flush failed:")
+            traceback.print_exc()
+
+            # put them back in front of newer entries, dropping the oldest beyond the limit
+            self.buffer[:0] = batch
+            excess = len(self.buffer) - LEDGER_MAX_BUFFER
+
+            if excess > 0:
+                del self.buffer[:excess]
+                self.dropped += excess
+        else:
+            self.written += len(batch)
+
+    async def get_player_entries(self, guild_id: int, user_id: int, limit: int = 15):
+        """
+        Get a player's most recent ledger entries, newest first. Flushes first, so the latest changes are included
+        """
+        await self.flush()
+
+        return await self.pool.fetch(queries.LEDGER_ENTRIES, guild_id, user_id, limit)
+
+    async def show_player_entries(self, guild_id: int, user_id: int, limit: int = 15) -> Embed:
+        """
+        Create discord Embed for a player's recent balance and shoe changes
+        """
+        records = await self.get_player_entries(guild_id, user_id, limit)
+
+        embed = Embed(
+            colour = Colour.from_str(EMBED_COLOUR),
+            title = "Player audit",
+            description = f"Latest changes for <@{user_id}>\n\n"
+        )
+
+        if records == []:
+            embed.description += "No recorded changes..."
+            return embed
+
+        for record in records:
+            changes = []
+
+            if record['balance']:
+                changes.append(f"{record['balance']:+.2f} credits")
+            if record['shoes']:
+                changes.append(f"{record['shoes']:+d} shoes")
+
+            line = f"- {format_dt(record['created_on'], 'f')} **{record['kind']}**: {', '.join(changes) or 'no change'}"
+
+            if record['price'] is not None:
+                line += f" at {record['price']:.2f}"
+            if record['other_id'] is not None:
+                line += f" with <@{record['other_id']}>"
+            if record['actor_id'] is not None:
+                line += f" by <@{record['actor_id']}>"
+
+            embed.description += line + "\n"
+
+        return embed
+
+
+# the process's ledger
+writer = LedgerWriter()
+
+def record(guild_id: int, user_id: int, kind: str, **kwargs):
+    """
+    Adds an entry to the process's ledger, see LedgerWriter.record
+    """
+    writer.record(guild_id, user_id, kind, **kwargs)
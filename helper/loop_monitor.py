@@ -0,0 +1,135 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+
+from params import LOOP_LAG_INTERVAL_MS, LOOP_LAG_THRESHOLD_MS
+
+# IMPORTANT
+# a task sleeping LOOP_LAG_INTERVAL_MS at a time measures how late the loop wakes it up, and a watchdog thread
+# ... prints the loop thread's stack once when the loop has been stuck for LOOP_LAG_THRESHOLD_MS.
+
+# upper bounds of the histogram buckets, in milliseconds (the last bucket has no bound)
+BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class LoopMonitor:
+    def __init__(self, interval_ms: float = LOOP_LAG_INTERVAL_MS, threshold_ms: float = LOOP_LAG_THRESHOLD_MS) -> None:
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+
+        self.task = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.loop_thread = None
+        # monotonic time the monitor task last ran
+        self.heartbeat = None
+
+        # metrics
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.samples = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.blocks = 0
+        self.last_block = None
+
+    def start(self):
+        """
+        Starts measuring the running loop. Must be called from the loop
+        """
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stopping.clear()
+
+        self.task = asyncio.create_task(self._measure(), name = "loop-monitor")
+        self.thread = threading.Thread(target = self._watch, name = "loop-watchdog", daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+        self.stopping.set()
+
+    def record(self, lag: float):
+        """
+        Adds one lag measurement, in seconds
+        """
+        self.counts[bisect_left(BUCKETS, lag * 1000)] += 1
+        self.samples += 1
+        self.total += lag
+        self.max = max(self.max, lag)
+
+    async def _measure(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+
+            now = time.monotonic()
+            self.heartbeat = now
+            self.record(max(0.0, now - expected))
+
+    def _watch(self):
+        """
+        Watchdog thread: prints the loop thread's stack when the loop is stuck past the threshold
+        """
+        # the heartbeat of the block that was reported, so each block is reported once
+        reported = None
+
+        while not self.stopping.wait(self.threshold / 2):
+            heartbeat = self.heartbeat
+            stuck = time.monotonic() - heartbeat - self.interval
+
+            if stuck < self.threshold or heartbeat == reported:
+                continue
+
+            reported = heartbeat
+            frame = sys._current_frames().get(self.loop_thread)
+
+            if frame is None:
+                return
+
+            self.blocks += 1
+            self.last_block = "".join(traceback.format_stack(frame))
+            print(f"Event loop blocked for over {stuck * 1000:.0f} ms, at:\n{self.last_block}", file = sys.stderr)
+
+    def percentile(self, p: float) -> float:
+        """
+        Upper bound (ms) of the bucket the `p` percentile of lag falls in, from the histogram
+        """
+        if not self.samples:
+            return 0.0
+
+        target = p * self.samples
+        seen = 0
+
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= target:
+                # no lag was above the max
+                return min(bound, round(self.max * 1000, 2))
+
+        return round(self.max * 1000, 2)
+
+    def get_stats(self) -> dict:
+        """
+        Get lag metrics: mean, max and percentiles in ms, and the histogram as (bucket, count)
+        """
+        labels = [f"<={b}ms" for b in BUCKETS] + [f">{BUCKETS[-1]}ms"]
+
+        return {
+            'samples': self.samples,
+            'mean_ms': round(self.total / self.samples * 1000, 2) if self.samples else 0.0,
+            'max_ms': round(self.max * 1000, 2),
+            'p50_ms': self.percentile(0.5),
+            'p99_ms': self.percentile(0.99),
+            'blocks': self.blocks,
+            'histogram': list(zip(labels, self.counts))
+        }
+
+
+# the process's monitor
+monitor = LoopMonitor()
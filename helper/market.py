@@ -0,0 +1,368 @@
+import asyncio
+import heapq
+from asyncpg import Pool
+from discord import Embed, Colour
+from discord.utils import utcnow
+
+from params import EMBED_COLOUR
+from helper import ledger, queries
+from helper.objects import Leaderboard
+
+# IMPORTANT
+# orders hold their escrow, so a match never checks balances. trades happen at the resting order's price,
+# ... never between two orders of the same player, and only in the process holding the market lock.
+
+SELL = 'sell'
+BUY = 'buy'
+
+class OrderBook:
+    """
+    In-memory matching engine for one guild, mirrored by the `orders` table.
+
+    Sells are a min-heap and buys a max-heap of [key, order_id, user_id, price, shoes] entries,
+    where order_id (SERIAL) breaks price ties by time. Cancelled or filled entries get 0 shoes
+    and are dropped lazily when they reach the top of the heap.
+    """
+    # guild_id -> OrderBook
+    books = {}
+    # session advisory lock key of the market
+    LOCK_KEY = 0x0DE4B00C
+    # connection holding the market lock, while this process runs the matching engines
+    owner = None
+
+    def __init__(self, guild_id: int, pool: Pool) -> None:
+        self.guild_id = guild_id
+        self.pool = pool
+        self.sells = []
+        self.buys = []
+        # order_id -> heap entry, for cancelling
+        self.orders = {}
+        # matching for a guild happens one order at a time
+        self.lock = asyncio.Lock()
+
+    @classmethod
+    async def claim(cls, pool: Pool) -> bool:
+        """
+        Takes the market lock and rebuilds the books, unless another process holds it.
+        Call again to retry, or to notice the lock was lost with its connection.
+        Returns bool whether this process runs the market
+        """
+        if cls.owner is not None:
+            if not cls.owner.is_closed():
+                return True
+
+            # the lock went with the connection, and the books may be out of date
+            print("Lost the market lock, its connection closed")
+            await cls.release_lock(pool)
+
+        # taken from the asyncpg pool itself, so the held connection doesn't count against MeteredPool's limit
+        raw = getattr(pool, 'pool', pool)
+        conn = await raw.acquire()
+
+        try:
+            locked = await conn.fetchval(queries.MARKET_LOCK, cls.LOCK_KEY)
+        except BaseException:
+            await raw.release(conn)
+            raise
+
+        if not locked:
+            await raw.release(conn)
+            return False
+
+        cls.owner = conn
+        await cls.load_all(pool)
+        return True
+
+    @classmethod
+    async def release_lock(cls, pool: Pool):
+        """
+        Gives up the market lock (the pool resets the connection, which unlocks it). Use before closing the pool
+        """
+        if cls.owner is not None:
+            conn, cls.owner = cls.owner, None
+            cls.books = {}
+            await getattr(pool, 'pool', pool).release(conn)
+
+    @classmethod
+    def get(cls, guild_id: int, pool: Pool):
+        """
+        Get order book of a guild, creating an empty one if needed
+        """
+        book = cls.books.get(guild_id)
+
+        if book is None:
+            book = cls.books[guild_id] = cls(guild_id, pool)
+
+        return book
+
+    @classmethod
+    async def load_all(cls, pool: Pool):
+        """
+        Rebuilds every guild's book from the orders table. Use on startup
+        """
+        cls.books = {}
+        records = await pool.fetch("SELECT id, guild_id, user_id, side, price, shoes FROM orders ORDER BY id")
+
+        for record in records:
+            book = cls.get(record['guild_id'], pool)
+            book._push(record['id'], record['user_id'], record['side'], record['price'], record['shoes'])
+
+        for book in cls.books.values():
+            heapq.heapify(book.sells)
+            heapq.heapify(book.buys)
+
+    @classmethod
+    def drop(cls, guild_id: int):
+        """
+        Forget a guild's book. Use when the event ends (orders are deleted with the event)
+        """
+        cls.books.pop(guild_id, None)
+
+    def _push(self, order_id: int, user_id: int, side: str, price: float, shoes: int, heap: bool = False):
+        """
+        Adds entry to the book. When `heap` is False, the caller has to heapify afterwards
+        """
+        if side == SELL:
+            entry = [price, order_id, user_id, price, shoes]
+            target = self.sells
+        else:
+            entry = [-price, order_id, user_id, price, shoes]
+            target = self.buys
+
+        if heap:
+            heapq.heappush(target, entry)
+        else:
+            target.append(entry)
+
+        self.orders[order_id] = entry
+
+    @staticmethod
+    def _top(heap: list):
+        """
+        Returns best live entry of the heap (or None), dropping dead entries on the way
+        """
+        while heap and heap[0][4] <= 0:
+            heapq.heappop(heap)
+
+        return heap[0] if heap else None
+
+    async def place(self, user_id: int, side: str, price: float, shoes: int) -> dict:
+        """
+        Places an order and matches it against the other side of the book.
+        The player's own resting orders are passed over and stay in the book.
+
+        Returns None if the player can't cover the order, otherwise a dictionary with
+        "filled" shoes, "value" of the trades, and "order_id" of the resting remainder (None if fully filled)
+        """
+        async with self.lock:
+            book = self.buys if side == SELL else self.sells
+
+            # pop every entry this order crosses, so we can restore them if the transaction fails
+            taken = []
+            # the player's own entries, popped to reach the ones behind them and always restored
+            skipped = []
+            fills = []
+            remaining = shoes
+
+            while remaining > 0:
+                entry = self._top(book)
+
+                if entry is None:
+                    break
+                if side == SELL and entry[3] < price:
+                    break
+                if side == BUY and entry[3] > price:
+                    break
+
+                heapq.heappop(book)
+
+                if entry[2] == user_id:
+                    skipped.append(entry)
+                    continue
+
+                taken.append(entry)
+
+                quantity = min(remaining, entry[4])
+                fills.append((entry, quantity))
+                remaining -= quantity
+
+            for entry in skipped:
+                heapq.heappush(book, entry)
+
+            try:
+                order_id = await self._execute(user_id, side, price, shoes, fills, remaining)
+            except BaseException:
+                for entry in taken:
+                    heapq.heappush(book, entry)
+                raise
+
+            if order_id is False:
+                for entry in taken:
+                    heapq.heappush(book, entry)
+                return None
+
+            # transaction went through, now update the engine
+            for entry, quantity in fills:
+                entry[4] -= quantity
+
+                if entry[4] > 0:
+                    heapq.heappush(book, entry)
+                else:
+                    del self.orders[entry[1]]
+
+            if order_id is not None:
+                self._push(order_id, user_id, side, price, remaining, heap = True)
+
+        self._record(user_id, side, price, shoes, fills)
+        Leaderboard.invalidate(self.guild_id)
+
+        return {
+            'filled': shoes - remaining,
+            'value': sum(entry[3] * quantity for entry, quantity in fills),
+            'order_id': order_id
+        }
+
+    def _record(self, user_id: int, side: str, price: float, shoes: int, fills: list):
+        """
+        Records the escrow and each side of every fill in the ledger, matching what _execute wrote
+        """
+        if side == SELL:
+            ledger.record(self.guild_id, user_id, ledger.ORDER_ESCROW, shoes = -shoes, price = price)
+        else:
+            ledger.record(self.guild_id, user_id, ledger.ORDER_ESCROW, balance = -price * shoes, price = price)
+
+        for entry, quantity in fills:
+            other_id, trade_price = entry[2], entry[3]
+
+            if side == SELL:
+                ledger.record(self.guild_id, other_id, ledger.TRADE, shoes = quantity, price = trade_price, other_id = user_id)
+                ledger.record(self.guild_id, user_id, ledger.TRADE, balance = trade_price * quantity, price = trade_price, other_id = other_id)
+            else:
+                ledger.record(self.guild_id, other_id, ledger.TRADE, balance = trade_price * quantity, price = trade_price, other_id = user_id)
+                ledger.record(
+                    self.guild_id, user_id, ledger.TRADE,
+                    balance = (price - trade_price) * quantity, shoes = quantity, price = trade_price, other_id = other_id
+                )
+
+    async def _execute(self, user_id: int, side: str, price: float, shoes: int, fills: list, remaining: int):
+        """
+        Writes escrow, fills and the resting order in one transaction.
+
+        Returns False if the player can't cover the order, else the id of the resting order (or None)
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # take escrow
+                if side == SELL:
+                    ok = await conn.fetchval(queries.ESCROW_SHOES, shoes, user_id, self.guild_id)
+                else:
+                    ok = await conn.fetchval(queries.ESCROW_BALANCE, price * shoes, user_id, self.guild_id)
+
+                if not ok:
+                    return False
+
+                # (pos, balance, user_id) increments for each fill
+                credits = []
+                filled_ids = []
+                partial = []
+
+                for entry, quantity in fills:
+                    order_id, other_id, trade_price = entry[1], entry[2], entry[3]
+
+                    if side == SELL:
+                        # buyer already paid when placing the bid, gets shoes; seller gets coins
+                        credits.append((quantity, 0.0, other_id))
+                        credits.append((0, trade_price * quantity, user_id))
+                    else:
+                        # seller already gave shoes, gets coins; buyer gets shoes and the difference back
+                        credits.append((0, trade_price * quantity, other_id))
+                        credits.append((quantity, (price - trade_price) * quantity, user_id))
+
+                    if quantity >= entry[4]:
+                        filled_ids.append(order_id)
+                    else:
+                        partial.append((entry[4] - quantity, order_id))
+
+                if credits:
+                    await conn.executemany(queries.CREDIT_PLAYER, [(p, b, uid, self.guild_id) for p, b, uid in credits])
+
+                if filled_ids:
+                    await conn.execute(queries.DELETE_ORDERS, filled_ids)
+
+                if partial:
+                    await conn.executemany(queries.FILL_ORDER, partial)
+
+                if remaining > 0:
+                    return await conn.fetchval(queries.INSERT_ORDER, self.guild_id, user_id, side, price, remaining)
+
+        return None
+
+    async def cancel(self, user_id: int, order_id: int) -> bool:
+        """
+        Cancels a player's order and gives back what is left of its escrow
+        Returns bool whether an order was cancelled
+        """
+        async with self.lock:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    record = await conn.fetchrow(queries.CANCEL_ORDER, order_id, self.guild_id, user_id)
+
+                    if record is None:
+                        return False
+
+                    if record['side'] == SELL:
+                        refund = (record['shoes'], 0.0)
+                    else:
+                        refund = (0, record['price'] * record['shoes'])
+
+                    await conn.execute(queries.CREDIT_PLAYER, *refund, user_id, self.guild_id)
+
+            ledger.record(self.guild_id, user_id, ledger.ORDER_REFUND, shoes = refund[0], balance = refund[1], price = record['price'])
+
+            # dropped from the heap when it reaches the top
+            entry = self.orders.pop(order_id, None)
+            if entry is not None:
+                entry[4] = 0
+
+        Leaderboard.invalidate(self.guild_id)
+        return True
+
+    async def get_player_orders(self, user_id: int):
+        """
+        Get open orders of a player, oldest first
+        """
+        return await self.pool.fetch(queries.PLAYER_ORDERS, self.guild_id, user_id)
+
+    async def get_depth(self, side: str, levels: int = 5):
+        """
+        Get (price, shoes, orders) for the best `levels` prices on one side of the book
+        """
+        order = 'ASC' if side == SELL else 'DESC'
+
+        return await self.pool.fetch(queries.MARKET_DEPTH.format(order), self.guild_id, side, levels)
+
+    async def show_depth(self, levels: int = 5) -> Embed:
+        """
+        Returns embed of market depth for both sides
+        """
+        embed = Embed(
+            title = "Shoe market",
+            timestamp = utcnow(),
+            colour = Colour.from_str(EMBED_COLOUR)
+        )
+
+        for side, name in ((SELL, "Asks (selling)"), (BUY, "Bids (buying)")):
+            records = await self.get_depth(side, levels)
+
+            if records == []:
+                value = "No orders"
+            else:
+                value = "\n".join(
+                    f"`{round(r['price'], 2)}` coins - {r['shoes']} shoes ({r['orders']} orders)" for r in records
+                )
+
+            embed.add_field(name = name, value = value, inline = False)
+
+        embed.set_footer(text = "Prices are per pair of shoes")
+
+        return embed
@@ -0,0 +1,258 @@
+import asyncio
+import functools
+from contextlib import asynccontextmanager, AsyncExitStack
+
+import discord
+from discord import app_commands
+from discord.utils import utcnow
+
+from helper import tracing
+from helper.fairness import scheduler
+from helper.profiler import label
+from params import DEFER_AFTER_SECS
+
+# IMPORTANT
+# the root span, deadline and fair scheduler slot start in the tree (or BotView) check, before cog and view checks,
+# ... and end in `finish`.
+# private discord.py hooks: the deadline replaces itx._cs_response, tracing patches HTTPClient/AsyncWebhookAdapter.request
+
+class DeadlineResponse(discord.InteractionResponse):
+    """
+    InteractionResponse that can be deferred by the deadline watchdog,
+    and sends to the followup webhook once it has been
+    """
+    def __init__(self, parent: discord.Interaction) -> None:
+        super().__init__(parent)
+        # a response method was called by the command (or the watchdog)
+        self._started = False
+        # the watchdog's defer, if it fired
+        self._auto_defer = None
+        # the deferred "thinking" message has not been replaced yet
+        self._thinking = False
+
+    async def auto_defer(self):
+        """
+        Called by the watchdog. Defers unless the command already started responding
+        """
+        if self._started:
+            return
+
+        self._started = True
+        thinking = self._parent.type is discord.InteractionType.application_command
+
+        # for buttons, defer without a new message, so the clicked message can still be edited
+        self._auto_defer = asyncio.ensure_future(super().defer(thinking = thinking))
+        self._thinking = thinking
+        # shielded, so the defer still finishes if the command ends and the watchdog is cancelled
+        await asyncio.shield(self._auto_defer)
+
+    async def _wait_auto_defer(self) -> bool:
+        """
+        Returns whether the interaction was deferred by the watchdog, waiting for the defer to finish
+        """
+        if self._auto_defer is None:
+            return False
+
+        await self._auto_defer
+        return True
+
+    async def defer(self, **kwargs) -> None:
+        # already deferred for the command
+        if await self._wait_auto_defer():
+            return
+
+        self._started = True
+        await super().defer(**kwargs)
+
+    async def send_message(self, content = None, **kwargs) -> None:
+        if not await self._wait_auto_defer():
+            self._started = True
+            return await super().send_message(content, **kwargs)
+
+        kwargs.pop('delete_after', None)
+
+        # the thinking message is public, so remove it rather than replace it with an ephemeral message
+        if self._thinking and kwargs.get('ephemeral', False):
+            await self._parent.delete_original_response()
+
+        self._thinking = False
+        await self._parent.followup.send(content, **kwargs)
+
+    async def edit_message(self, **kwargs) -> None:
+        if not await self._wait_auto_defer():
+            self._started = True
+            return await super().edit_message(**kwargs)
+
+        kwargs.pop('delete_after', None)
+        # deferred component interaction: the original response is the message with the view
+        await self._parent.edit_original_response(**kwargs)
+
+
+async def _watch(response: DeadlineResponse, delay: float):
+    await asyncio.sleep(delay)
+
+    try:
+        await response.auto_defer()
+    except discord.HTTPException:
+        # the command gets the same error when it tries to respond
+        pass
+
+
+@asynccontextmanager
+async def deadline(itx: discord.Interaction):
+    """
+    Defers the interaction if nothing was sent within DEFER_AFTER_SECS of its creation
+    """
+    if itx.type not in (discord.InteractionType.application_command, discord.InteractionType.component):
+        yield
+        return
+
+    # replace the lazily created response object, before anything touches itx.response
+    response = DeadlineResponse(itx)
+    itx._cs_response = response
+
+    # time already spent since discord created the interaction
+    elapsed = (utcnow() - itx.created_at).total_seconds()
+    delay = min(DEFER_AFTER_SECS, max(0.0, DEFER_AFTER_SECS - elapsed))
+
+    watchdog = asyncio.create_task(_watch(response, delay))
+
+    try:
+        yield
+    finally:
+        watchdog.cancel()
+
+
+async def begin(itx: discord.Interaction, name: str):
+    """
+    Opens the interaction's root span, starts its deadline and waits for a fair scheduler slot.
+    Called from the tree and view checks, so the other checks (and their queries) run after it.
+    Does nothing if it was already opened
+    """
+    if 'middleware' in itx.extras:
+        return
+
+    # samples of the profiler are put under the command or view
+    label(name)
+
+    async with AsyncExitStack() as stack:
+        stack.enter_context(tracing.root_span(name, **{'discord.guild_id': itx.guild_id or 0, 'discord.interaction_type': itx.type.name}))
+        # the deadline starts before the wait, so interactions queued behind a burst are deferred in time
+        await stack.enter_async_context(deadline(itx))
+        await stack.enter_async_context(scheduler.slot(itx.guild_id, itx.created_at.timestamp()))
+
+        # kept open until finish (closed here only if the wait failed)
+        itx.extras['middleware'] = stack.pop_all()
+
+
+async def finish(itx: discord.Interaction, error: BaseException = None):
+    """
+    Closes what `begin` opened, recording `error` on the root span. Does nothing if already closed
+    """
+    stack = itx.extras.pop('middleware', None)
+
+    if stack is None:
+        return
+
+    if error is None:
+        await stack.aclose()
+    else:
+        await stack.__aexit__(type(error), error, error.__traceback__)
+
+
+async def _run(itx: discord.Interaction, name: str, callback, *args, **kwargs):
+    """
+    Runs an interaction callback through the middleware, then closes its root span
+    """
+    await begin(itx, name)
+
+    try:
+        result = await callback(*args, **kwargs)
+    except BaseException as e:
+        await finish(itx, e)
+        raise
+
+    await finish(itx)
+    return result
+
+
+def handled(callback):
+    """
+    Decorator running an app command callback through the middleware. Put it right above the function,
+    under @app_commands.command and any checks
+    """
+    @functools.wraps(callback)
+    async def wrapper(self, itx: discord.Interaction, *args, **kwargs):
+        return await _run(itx, f"command {itx.command.qualified_name}", callback, self, itx, *args, **kwargs)
+
+    return wrapper
+
+
+class BotTree(app_commands.CommandTree):
+    """
+    Command tree that opens the root span of app commands before any check runs.
+    The tree's error handler has to call `finish`, for commands whose checks failed
+    """
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        command = interaction.command
+        name = command.qualified_name if command is not None else (interaction.data or {}).get('name', 'unknown')
+
+        if interaction.type is discord.InteractionType.application_command:
+            await begin(interaction, f"command {name}")
+        else:
+            label(f"command {name}")
+
+        return True
+
+
+class BotView(discord.ui.View):
+    """
+    View that handles every item callback through the middleware.
+    The root span is opened before the view's interaction_check, and closed if it rejects the interaction
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+
+        # items made from decorated methods are added without add_item
+        for item in self.children:
+            self._wrap(item)
+
+        check = self.interaction_check
+
+        async def interaction_check(interaction: discord.Interaction) -> bool:
+            await begin(interaction, self._name((interaction.data or {}).get('custom_id')))
+
+            try:
+                allowed = await check(interaction)
+            except BaseException as e:
+                await finish(interaction, e)
+                raise
+
+            if not allowed:
+                await finish(interaction)
+            return allowed
+
+        # looked up on the instance by discord.py, so this runs instead of the subclass's check
+        self.interaction_check = interaction_check
+
+    def _name(self, custom_id) -> str:
+        return f"view {type(self).__name__} {custom_id}"
+
+    def add_item(self, item: discord.ui.Item):
+        self._wrap(item)
+        return super().add_item(item)
+
+    def _wrap(self, item: discord.ui.Item):
+        callback = item.callback
+
+        # already wrapped, e.g. an item moved from another view
+        if getattr(callback, '__handled__', False):
+            return
+
+        name = self._name(getattr(item, 'custom_id', None) or type(item).__name__)
+
+        async def handled_callback(interaction: discord.Interaction):
+            await _run(interaction, name, callback, interaction)
+
+        handled_callback.__handled__ = True
+        item.callback = handled_callback
@@ -1,11 +1,70 @@
-from asyncpg import Pool
-from discord import Embed, TextChannel, Guild, Colour
+from asyncpg import Pool, Connection
+from discord import Embed, TextChannel, Colour
 from discord.utils import utcnow, format_dt
-from datetime import timedelta
-import numpy as np
-from params import VIEW_INTERVAL_HRS, PRICE_CHANGE_HRS, EMBED_COLOUR, mu, sd 
+from datetime import timedelta, datetime, date, timezone
+import asyncio
+import time
+from array import array
+from typing import TYPE_CHECKING
+from helper import randomness, ledger, queries
+from params import (
+    VIEW_INTERVAL_HRS, PRICE_CHANGE_HRS, PRICE_CACHE_SECS, EMBED_COLOUR, LEADERBOARD_REFRESH_SECS, 
+    STATS_CACHE_SECS, STATS_CHUNK_SIZE, GLOBAL_LEADERBOARD_SIZE, GLOBAL_LEADERBOARD_REFRESH_SECS, first_price, mu, sd 
+)
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# numpy is imported where it is used, so starting the bot doesn't wait for it
+PERCENTILES = (10, 25, 50, 75, 90, 99)
+
+def mention(user_id: int) -> str:
+    """
+    Mention for a user from their id, so no member cache is needed (and players who left still render)
+    """
+    return f"<@{user_id}>"
+
+def projected_shoes(ores: int, guild_ores: int, shoe_ores: int) -> int:
+    """
+    Shoes `ores` turn into at the next payout: their share of the guild's ores, times the shoes given for ores
+    """
+    if not ores or not guild_ores:
+        return 0
+
+    return round(ores / guild_ores * (shoe_ores or 0))
+
+def gini(values: 'np.ndarray') -> float:
+    """
+    Gini coefficient of the values (0 is perfect equality, 1 is one player owning everything)
+    """
+    import numpy as np
+
+    # negative balances would push it outside [0, 1]
+    values = np.sort(np.clip(values, 0, None))
+    n = values.size
+    total = values.sum()
+
+    if n == 0 or total == 0:
+        return 0.0
+
+    index = np.arange(1, n + 1)
+    return float((2 * np.sum(index * values)) / (n * total) - (n + 1) / n)
+
+def percentiles(values: 'np.ndarray') -> dict:
+    """
+    Returns {percentile: value} for PERCENTILES
+    """
+    import numpy as np
+
+    if values.size == 0:
+        return {p: 0 for p in PERCENTILES}
+
+    return dict(zip(PERCENTILES, np.percentile(values, PERCENTILES).tolist()))
+
 
 class Player:
+    __slots__ = ('user_id', 'guild_id', 'pool')
+
     def __init__(self, user_id: int, guild_id: int, pool: Pool) -> None:
         self.user_id = user_id
         self.guild_id = guild_id
@@ -16,11 +75,11 @@ class Player:
         """
         Constructor. Checks if user record on table, and creates it if not
         """
-        exists = await pool.fetchval("SELECT EXISTS (SELECT 1 FROM players WHERE user_id = $1 AND guild_id = $2)",
-            user_id, guild_id)
+        exists = await pool.fetchval(queries.PLAYER_EXISTS, user_id, guild_id)
         
         if not exists:
-            await pool.execute("INSERT INTO players VALUES ($1, $2, 0, 0)", user_id, guild_id)
+            await pool.execute(queries.CREATE_PLAYER, user_id, guild_id)
+            Leaderboard.invalidate(guild_id)
 
         return cls(user_id, guild_id, pool)
     
@@ -28,10 +87,7 @@ class Player:
         """
         Private method: Get specific details about player from database
         """
-        row = await self.pool.fetchrow(
-            "SELECT * FROM players WHERE user_id = $1 AND guild_id = $2", 
-            self.user_id, self.guild_id
-        )
+        row = await self.pool.fetchrow(queries.PLAYER_DETAILS, self.user_id, self.guild_id)
 
         if field is not None:
             return row[field]
@@ -44,8 +100,9 @@ class Player:
 
         increases pos by 1
         """
-        await self.pool.execute("UPDATE players SET pos = pos + 1 WHERE user_id = $1 AND guild_id = $2",
-            self.user_id, self.guild_id)
+        await self.pool.execute(queries.CLAIM_SHOES, self.user_id, self.guild_id)
+        ledger.record(self.guild_id, self.user_id, ledger.CLAIM, shoes = 1)
+        Leaderboard.invalidate(self.guild_id)
         
     async def sell_pos(self, quantity = 1) -> dict:
         """
@@ -62,77 +119,151 @@ class Player:
             quantity = 0
 
         # get profit
-        prices = await Shoe.get_price_history(self.pool, count = 1)
-        price = prices[0]['price']
+        price = await Shoe.get_price(self.pool, self.guild_id)
         profit = price * quantity
 
         # update database
-        await self.pool.execute(
-            """
-            UPDATE players 
-                SET pos = pos - $1, 
-                balance = balance + $2
-            WHERE user_id = $3 AND guild_id = $4
-            """, quantity, profit, self.user_id, self.guild_id 
-        )
+        await self.pool.execute(queries.SELL_SHOES, quantity, profit, self.user_id, self.guild_id)
+        if quantity:
+            ledger.record(self.guild_id, self.user_id, ledger.SELL, balance = profit, shoes = -quantity, price = price)
+        Leaderboard.invalidate(self.guild_id)
 
         return {'price': price, 'profit': profit}
 
-    async def modify_fields(self, *, balance: float = None, pos: int = None):
+    async def modify_fields(self, *, balance: float = None, pos: int = None, actor_id: int = None):
         """
-        Manually update fields of player. Useful for admin command in case of abuse
+        Manually update fields of player. Useful for admin command in case of abuse.
+        The change is recorded in the ledger, with `actor_id` as who made it
         Returns bool for status of change
         """
-        if None not in [balance, pos]:
-            await self.pool.execute(
-                "UPDATE players SET balance = $1, pos = $2 WHERE guild_id = $3 AND user_id = $4", 
-                balance, pos, self.guild_id, self.user_id
-            )
-    
-        elif balance is not None:
-            await self.pool.execute("UPDATE players SET balance = $1 WHERE guild_id = $2 AND user_id = $3", 
-                balance, self.guild_id, self.user_id)
-
-        elif pos is not None:
-            await self.pool.execute("UPDATE players SET pos = $1 WHERE guild_id = $2 AND user_id = $3", 
-                pos, self.guild_id, self.user_id)
-            
         # no details provided, return False    
-        else:
+        if balance is None and pos is None:
             return False
-        
+
+        # fields not given keep their value, and the old values are returned for the ledger
+        row = await self.pool.fetchrow(queries.MODIFY_PLAYER, balance, pos, self.guild_id, self.user_id)
+
+        if row is not None:
+            ledger.record(
+                self.guild_id, self.user_id, ledger.ADMIN_SET,
+                balance = row['balance'] - row['old_balance'], shoes = row['pos'] - row['old_pos'], actor_id = actor_id
+            )
+
+        Leaderboard.invalidate(self.guild_id)
         return True
 
+    async def get_payout(self) -> dict:
+        """
+        Get player's ores, the guild's running ore total, and the shoes they would get at the next payout.
+        One primary key lookup on each table, no aggregate
+        """
+        row = await self.pool.fetchrow(queries.PLAYER_PAYOUT, self.user_id, self.guild_id)
+
+        ores = row['day_ores'] if row is not None else 0
+        guild_ores = (row['ore_total'] if row is not None else 0) or 0
+        shoe_ores = (row['shoe_ores'] if row is not None else 0) or 0
+        last_collect = row['last_collect'] if row is not None else None
+
+        return {
+            'ores': ores,
+            'guild_ores': guild_ores,
+            'shoe_ores': shoe_ores,
+            'shoes': projected_shoes(ores, guild_ores, shoe_ores),
+            'next_payout': last_collect + timedelta(hours = 24) if last_collect is not None else None
+        }
+
     async def show_profile(self) -> Embed:
         """
         Create discord Embed for profile
         """
-        # get player details
-        row = await self.__get_details()
+        # get player details, with the guild's ore total for the projected payout
+        row = await self.pool.fetchrow(queries.PLAYER_PROFILE, self.user_id, self.guild_id)
         pos = row["pos"]
         bal = round(row["balance"], 2)
         ores = row['day_ores']
+        shoes = projected_shoes(ores, row['ore_total'], row['shoe_ores'])
 
         # create embed
         embed = Embed(
             colour = Colour.from_str(EMBED_COLOUR),
             title = "Player profile",
-            description = f"**Pairs of shoes owned:** {pos}\n**Credts:** {bal}\n**Ores:** {ores}"    
+            description = f"**Pairs of shoes owned:** {pos}\n**Credts:** {bal}\n**Ores:** {ores} (~{shoes} shoes at next payout)"    
+        )
+
+        return embed
+
+    async def add_ores(self, ores: int) -> dict:
+        """
+        Adds ores to player database, and to the guild's running ore total in the same statement
+
+        Returns dictionary with the player's "ores", the guild's "guild_ores" and the projected "shoes"
+        """
+        row = await self.pool.fetchrow(queries.ADD_ORES, ores, self.user_id, self.guild_id)
+        Leaderboard.invalidate(self.guild_id)
+
+        if row is None:
+            return {'ores': ores, 'guild_ores': ores, 'shoes': 0}
+
+        return {
+            'ores': row['day_ores'],
+            'guild_ores': row['ore_total'],
+            'shoes': projected_shoes(row['day_ores'], row['ore_total'], row['shoe_ores'])
+        }
+
+    async def show_payout(self) -> Embed:
+        """
+        Create discord Embed for the player's share of the guild's ores and projected payout
+        """
+        payout = await self.get_payout()
+
+        share = payout['ores'] / payout['guild_ores'] * 100 if payout['guild_ores'] else 0.0
+
+        embed = Embed(
+            colour = Colour.from_str(EMBED_COLOUR),
+            title = "Ore payout",
+            description = (
+                f"**Your ores:** {payout['ores']}\n"
+                f"**Server ores:** {payout['guild_ores']} ({share:.2f}% yours)\n"
+                f"**Shoes given for ores:** {payout['shoe_ores']}\n"
+                f"**Projected payout:** ~{payout['shoes']} shoes"
+            )
         )
 
+        if payout['next_payout'] is not None:
+            embed.description += f"\n**Next payout:** {format_dt(payout['next_payout'], 'R')}"
+
+        embed.set_footer(text = "Your share changes as others mine before the payout")
+
         return embed
 
-    async def add_ores(self, ores: int):
+    async def show_ore_history(self, days: int) -> Embed:
         """
-        Adds ores to player database
+        Create discord Embed for ore payouts in the last `days` days
         """
-        await self.pool.execute("""
-            UPDATE players 
-            SET day_ores = day_ores + $1 
-            WHERE user_id = $2 AND guild_id = $3""",
-            ores, self.user_id, self.guild_id
+        records = await OreHistory.get_player_history(self.pool, self.guild_id, self.user_id, days)
+
+        embed = Embed(
+            colour = Colour.from_str(EMBED_COLOUR),
+            title = f"Ore history (last {days} days)",
+            description = ""
         )
 
+        if records == []:
+            embed.description = "No ore rewards in this time..."
+            return embed
+
+        for record in records:
+            embed.description += "- {0}: **{1} shoes** for {2}/{3} ores\n".format(
+                format_dt(record['paid_on'], 'd'),
+                record['shoes'],
+                record['ores'],
+                record['guild_ores']
+            )
+
+        embed.set_footer(text = f"{sum(r['shoes'] for r in records)} shoes in total")
+
+        return embed
+
     async def get_pos(self):
         # get shoes owned
         return await self.__get_details('pos')
@@ -140,81 +271,241 @@ class Player:
     async def get_balance(self):
         # get balance of player
         return await self.__get_details('balance')
-    
-    async def exchange_details(self, dest_player_id: int, source_shoes: int, source_price: float):
-        
-        # increase source player's balance, and reduce shoes owned
-        await self.pool.execute(
-            """
-            UPDATE players 
-            SET balance = balance + $1,
-            pos = pos - $2
-            WHERE user_id = $3 AND guild_id = $4
-            """,
-            source_price, source_shoes, self.user_id, self.guild_id
-        )
-
-        # decrease dest player's balance, and increase shoes owned
-        await self.pool.execute(
-            """
-            UPDATE players 
-            SET balance = balance - $1,
-            pos = pos + $2
-            WHERE user_id = $3 AND guild_id = $4
-            """,
-            source_price, source_shoes, dest_player_id, self.guild_id
-        )
 
 class Shoe:
+    """
+    Shoe prices. Every guild with an event has its own market, and guild 0 is the default market
+    that new markets start from (and that prices from before per-guild markets belong to)
+    """
+    DEFAULT_MARKET = 0
+
+    # guild_id -> (cached_on, current price)
+    # other processes can change prices, so entries expire, and never outlive a price change
+    _prices = {}
+    _price_ttl = min(PRICE_CACHE_SECS, PRICE_CHANGE_HRS * 3600)
+
+    # advisory lock key taken by tick and catch_up, so two running bots never both change prices
+    PRICE_LOCK_KEY = 0x5430E5
+
+    @staticmethod
+    def _cache_prices(guild_ids, prices):
+        now = time.monotonic()
+        Shoe._prices.update((guild_id, (now, price)) for guild_id, price in zip(guild_ids, prices))
+
     @staticmethod
     async def check_last_change(pool: Pool):
         """
         Checks whether last change was 24 hours ago
 
-        Useful for task which sets price every 24 hours
+        Useful for task which sets price every 24 hours. All markets change together,
+        so the default market's last change is used
         """
-        last_change = await pool.fetchval("SELECT price_date FROM shoes ORDER BY price_date DESC LIMIT 1")
+        last_change = await pool.fetchval(queries.LATEST_PRICE_DATE, Shoe.DEFAULT_MARKET)
         
         # if difference between time now and last change is greater than 12 hours (ie last pos happened more than 12 hours ago)
         # ... return True
         return (utcnow() - last_change) >= timedelta(hours = PRICE_CHANGE_HRS)
 
     @staticmethod
-    async def get_price_history(pool: Pool, count:int = 10, date = None):
+    async def get_price(pool: Pool, guild_id: int = DEFAULT_MARKET) -> float:
+        """
+        Get current price of a guild's market, from cache or one indexed read.
+        Guilds without prices yet use the default market
+        """
+        cached = Shoe._prices.get(guild_id)
+        if cached is not None and (time.monotonic() - cached[0]) < Shoe._price_ttl:
+            return cached[1]
+
+        price = await pool.fetchval(queries.LATEST_PRICE, guild_id)
+
+        if price is None:
+            if guild_id == Shoe.DEFAULT_MARKET:
+                return first_price
+            # not cached, so the guild is picked up once its first price is set
+            return await Shoe.get_price(pool, Shoe.DEFAULT_MARKET)
+
+        Shoe._cache_prices((guild_id,), (price,))
+        return price
+
+    @staticmethod
+    async def get_price_history(pool: Pool, count:int = 10, date = None, guild_id: int = DEFAULT_MARKET):
         """
-        Get shoe price for last `count` days before `before` date
+        Get shoe price for last `count` days before `before` date, for a guild's market
+
+        Reads full resolution prices first, then hourly and daily closes for older compacted prices.
+        The tiers don't overlap in time, so each is an index scan limited to `count` rows
         """
         if date is None:
             date = utcnow()
 
-        price_history = await pool.fetch("SELECT * FROM shoes WHERE price_date <= $1 ORDER BY price_date DESC LIMIT $2", date, count)
+        price_history = await pool.fetch(queries.PRICE_HISTORY, date, count, guild_id)
+
+        # market has no prices of its own yet
+        if price_history == [] and guild_id != Shoe.DEFAULT_MARKET:
+            return await Shoe.get_price_history(pool, count, date)
         
         return price_history
     
     @staticmethod
-    async def set_price(pool: Pool, new_price = None) -> float:
+    async def set_price(pool: Pool, new_price = None, guild_id: int = DEFAULT_MARKET) -> float:
         """
-        Set price for current time.
+        Set price for current time, for a guild's market.
 
         new_price is for setting price manually, for owner command
         
-        For setting price automatically (i.e. from bg task):
+        For setting price automatically:
         It will use the price last set as the base price. 
         Using normal distribution for change, and adding to base, returns new price
         """
         if new_price is None:
-            change = np.random.default_rng().normal(mu, sd)
-            base = await pool.fetchval("SELECT price FROM shoes ORDER BY price_date DESC LIMIT 1")
+            change = (await randomness.ready()).normal(mu, sd)
+            base = await Shoe.get_price(pool, guild_id)
             price = base + change
             
         else:
             price = new_price
 
-        await pool.execute("INSERT INTO shoes (price) VALUES ($1)", price)
+        await pool.execute(queries.INSERT_PRICE, guild_id, price)
+        Shoe._cache_prices((guild_id,), (price,))
 
         return price
+
+    @staticmethod
+    async def _get_markets(pool: Pool) -> tuple:
+        """
+        Private method: Get every market (the default market first, then each guild with an event)
+        as guild ids, and NumPy arrays of latest prices, mus and sds
+        """
+        # latest price of each market, one index read each in a single round trip
+        markets = await pool.fetch(queries.MARKETS, Shoe.DEFAULT_MARKET)
+
+        import numpy as np
+
+        guild_ids = [r['guild_id'] for r in markets]
+        base = np.array([np.nan if r['price'] is None else r['price'] for r in markets], dtype = np.float64)
+        mus = np.array([mu if r['mu'] is None else r['mu'] for r in markets], dtype = np.float64)
+        sds = np.array([sd if r['sd'] is None else r['sd'] for r in markets], dtype = np.float64)
+
+        # new markets start from the default market's price (which is first in the list)
+        default = first_price if np.isnan(base[0]) else base[0]
+        base = np.where(np.isnan(base), default, base)
+
+        return guild_ids, base, mus, sds
+
+    @staticmethod
+    async def tick(pool: Pool) -> int:
+        """
+        Changes the price of every market at once, if the last change was PRICE_CHANGE_HRS ago:
+        the default market and each guild with an event.
+
+        Each market's change is drawn from a normal distribution with the guild's mu/sd
+        (or the defaults in params.py) as one NumPy array, and all new prices are inserted in one statement.
+        The check and insert happen under the price lock, so another process can't tick the same interval.
+        Returns number of markets changed (0 if not due or another process holds the lock)
+        """
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if not await conn.fetchval(queries.PRICE_LOCK, Shoe.PRICE_LOCK_KEY):
+                    return 0
+
+                if not await Shoe.check_last_change(conn):
+                    return 0
+
+                guild_ids, base, mus, sds = await Shoe._get_markets(conn)
+
+                prices = base + (await randomness.ready()).normal_array(mus, sds)
+
+                await conn.execute(
+                    """
+                    INSERT INTO shoes (guild_id, price)
+                    SELECT * FROM unnest($1::BIGINT[], $2::FLOAT[])
+                    """,
+                    guild_ids, prices.tolist()
+                )
+
+        Shoe._cache_prices(guild_ids, prices.tolist())
+
+        return len(guild_ids)
+
+    @staticmethod
+    async def catch_up(pool: Pool) -> int:
+        """
+        Makes up the price changes missed while the bot was down. Use on startup.
+
+        Works out how many PRICE_CHANGE_HRS intervals passed since the default market's last change,
+        draws that many steps for every market as one NumPy random walk, and inserts them all in one statement,
+        dated at the times they should have happened.
+        Runs under the price lock, so only one process makes up the gap.
+        Returns number of changes made per market (0 if none were missed or another process holds the lock)
+        """
+        import numpy as np
+
+        interval = timedelta(hours = PRICE_CHANGE_HRS)
+
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if not await conn.fetchval(queries.PRICE_LOCK, Shoe.PRICE_LOCK_KEY):
+                    return 0
+
+                last_change = await conn.fetchval(queries.LATEST_PRICE_DATE, Shoe.DEFAULT_MARKET)
+
+                if last_change is None:
+                    return 0
+
+                missed = int((utcnow() - last_change) / interval)
+
+                if missed < 1:
+                    return 0
+
+                guild_ids, base, mus, sds = await Shoe._get_markets(conn)
+                markets = len(guild_ids)
+
+                # one row of steps per market, summed along the row into a random walk
+                steps = (await randomness.ready()).normal_array(np.repeat(mus, missed), np.repeat(sds, missed)).reshape(markets, missed)
+                prices = base[:, None] + np.cumsum(steps, axis = 1)
+
+                dates = [last_change + interval * (k + 1) for k in range(missed)]
+
+                await conn.execute(
+                    """
+                    INSERT INTO shoes (guild_id, price_date, price)
+                    SELECT * FROM unnest($1::BIGINT[], $2::TIMESTAMPTZ[], $3::FLOAT[])
+                    """,
+                    np.repeat(guild_ids, missed).tolist(), dates * markets, prices.ravel().tolist()
+                )
+
+        Shoe._cache_prices(guild_ids, prices[:, -1].tolist())
+
+        return missed
+
+    @staticmethod
+    def forget(guild_id: int):
+        """
+        Drop cached price of a guild's market. Use when the event ends
+        """
+        Shoe._prices.pop(guild_id, None)
+
+    @staticmethod
+    async def compact(pool: Pool, tick_days: int, hourly_days: int):
+        """
+        Rolls prices older than `tick_days` into hourly open/high/low/close rows,
+        and hourly rows older than `hourly_days` into daily ones, for every market.
+
+        Cutoffs are truncated to the hour/day so a bucket is always compacted at once.
+        The latest price of a market is never compacted, as new prices are based on it
+        """
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(queries.COMPACT_TICKS, tick_days)
+
+                await conn.execute(queries.COMPACT_HOURLY, hourly_days)
     
 class Event:
+    __slots__ = ('guild_id', 'pool')
+
+    # guild_id -> (built_on, stats)
+    _stats_cache = {}
+
     def __init__(self, guild_id: int, pool: Pool) -> None:
         self.guild_id = guild_id
         self.pool = pool
@@ -224,8 +515,7 @@ class Event:
         """
         Returns boolean if event exists (True) or not (False)
         """
-        exists = await pool.fetchval("SELECT EXISTS (SELECT 1 FROM events WHERE guild_id = $1)",
-            guild_id)
+        exists = await pool.fetchval(queries.EVENT_EXISTS, guild_id)
         
         return exists
     
@@ -250,25 +540,28 @@ class Event:
         """
         Get giveaway shoes for this guild
         """
-        query = "SELECT pos_given FROM events WHERE guild_id = $1"
-        return await self.pool.fetchval(query, self.guild_id)
+        return await self.pool.fetchval(queries.GIVEAWAY_SHOES, self.guild_id)
     
     async def get_channel_id(self):
         """
         Get channel id for this guild
         """
-        query = "SELECT channel_id FROM events WHERE guild_id = $1"
-        return await self.pool.fetchval(query, self.guild_id)
+        return await self.pool.fetchval(queries.EVENT_CHANNEL, self.guild_id)
     
 
-    async def modify_details(self, *, new_channel: TextChannel = None, pos_given: int = None, shoe_ores: int = None) -> bool:
+    async def modify_details(
+        self, *, 
+        new_channel: TextChannel = None, pos_given: int = None, shoe_ores: int = None,
+        price_mu: float = None, price_sd: float = None
+    ) -> bool:
         """
-        Change channel for sending message, amount of pos given or shoe ores
+        Change channel for sending message, amount of pos given, shoe ores, 
+        or the mean and standard deviation of this guild's price changes
         Returns bool whether any details were changed (True) or not (False)
         """
         status = False
         
-        if None not in [new_channel, pos_given, shoe_ores]:
+        if None not in [new_channel, pos_given, shoe_ores] and price_mu is None and price_sd is None:
             await self.pool.execute(
                 """
                 UPDATE events 
@@ -296,27 +589,36 @@ class Event:
                 shoe_ores, self.guild_id)
             status = True
 
+        if price_mu is not None:
+            await self.pool.execute("UPDATE events SET price_mu = $1 WHERE guild_id = $2", 
+                price_mu, self.guild_id)
+            status = True
+
+        if price_sd is not None:
+            await self.pool.execute("UPDATE events SET price_sd = $1 WHERE guild_id = $2", 
+                price_sd, self.guild_id)
+            status = True
+
         return status
 
-    async def get_player_records(self, field = None):
+    async def get_player_records(self, field = None, limit: int = None):
         """
         Gets player records for this guild in descending order of "balance" (default) or "ores"
 
-        Useful for leaderboards
+        `limit` caps the number of records returned. Useful for leaderboards
         """
         if field == 'ores':
             db_field = 'day_ores'
         else:
             db_field = 'balance'
 
-        records = await self.pool.fetch(f"SELECT * FROM players WHERE guild_id = $1 ORDER BY {db_field} DESC",
-            self.guild_id)
+        records = await self.pool.fetch(queries.PLAYER_LEADERBOARD.format(db_field), self.guild_id, limit)
         
         return records
 
     async def end_event(self):
         """
-        Ends event: removes db entry in events and players table for this guild
+        Ends event: removes db entry in events, players, orders, ore_payouts and shoe price tables for this guild
         """
         await self.pool.execute(
             """
@@ -326,6 +628,26 @@ class Event:
             self.guild_id
         )
         
+        await self.pool.execute(
+            """
+            DELETE FROM orders
+                WHERE guild_id = $1;
+            """,
+            self.guild_id
+        )
+
+        await self.pool.execute(
+            """
+            DELETE FROM ore_payouts
+                WHERE guild_id = $1;
+            """,
+            self.guild_id
+        )
+
+        # the guild's shoe market
+        for table in ('shoes', 'shoes_hourly', 'shoes_daily'):
+            await self.pool.execute(f"DELETE FROM {table} WHERE guild_id = $1;", self.guild_id)
+        Shoe.forget(self.guild_id)
         await self.pool.execute(
             """
             DELETE FROM events
@@ -334,11 +656,13 @@ class Event:
             self.guild_id
         )
 
+        Leaderboard.invalidate(self.guild_id)
+
     async def get_info(self) -> Embed:
         """
         Return info for the server in an embed: last_pos, channel, and shoe_ores
         """
-        grecord = await self.pool.fetchrow("SELECT * FROM events WHERE guild_id = $1", self.guild_id)
+        grecord = await self.pool.fetchrow(queries.EVENT_DETAILS, self.guild_id)
         channel_id = grecord['channel_id']
         channel = f'<#{channel_id}>'
         shoe_ores = grecord['shoe_ores']
@@ -351,15 +675,223 @@ class Event:
         em.add_field(name = "Shoes given per day based on ores", value = shoe_ores)
         em.add_field(name = "Next shoe reward (ores)", value = format_dt(next_collect, 'R'))
 
+        # guild's price changes, or the defaults
+        price_mu = mu if grecord['price_mu'] is None else grecord['price_mu']
+        price_sd = sd if grecord['price_sd'] is None else grecord['price_sd']
+        em.add_field(name = "Price change (mean, std dev)", value = f"{price_mu}, {price_sd}")
+
         return em
     
-    async def show_leaderboard(self, guild: Guild) -> Embed:
+    async def show_leaderboard(self) -> Embed:
         """
         Returns embed of top 10 players
         """
-        records = await self.get_player_records()
+        return await Leaderboard.get_embed(self, 'balance')
+    
+    async def show_ore_leaderboard(self) -> Embed:
+        """
+        Returns embed of top 10 players by ore
+        """
+        return await Leaderboard.get_embed(self, 'ores')
+
+    async def get_stats(self) -> dict:
+        """
+        Economy stats for this guild: supply, gini coefficient, percentiles and ore participation
+
+        Players are streamed from a server-side cursor in chunks of STATS_CHUNK_SIZE into
+        preallocated arrays, so memory stays at a few bytes per player even for large guilds.
+        Results are cached for STATS_CACHE_SECS
+        """
+        cached = Event._stats_cache.get(self.guild_id)
+        if cached is not None and (time.monotonic() - cached[0]) < STATS_CACHE_SECS:
+            return cached[1]
+
+        import numpy as np
+
+        async with self.pool.acquire() as conn:
+            # cursors need a transaction. repeatable read gives the count and the cursor the same snapshot,
+            # ... so players added meanwhile are in neither and the arrays always fit
+            async with conn.transaction(isolation = 'repeatable_read', readonly = True):
+                count = await conn.fetchval(queries.GUILD_PLAYER_COUNT, self.guild_id)
+                shoe_ores = await conn.fetchval(queries.EVENT_SHOE_ORES, self.guild_id)
+
+                balances = np.empty(count, dtype = np.float64)
+                shoes = np.empty(count, dtype = np.int64)
+                ores = np.empty(count, dtype = np.int64)
+
+                cursor = await conn.cursor(queries.GUILD_PLAYER_STATS, self.guild_id)
+
+                filled = 0
+                while filled < count:
+                    rows = await cursor.fetch(STATS_CHUNK_SIZE)
+                    if not rows:
+                        break
+
+                    end = filled + len(rows)
+                    chunk = np.array([tuple(r) for r in rows], dtype = np.float64)
+
+                    balances[filled:end] = chunk[:, 0]
+                    shoes[filled:end] = chunk[:, 1]
+                    ores[filled:end] = chunk[:, 2]
+                    filled = end
+
+        balances = balances[:filled]
+        shoes = shoes[:filled]
+        ores = ores[:filled]
+
+        stats = {
+            'players': filled,
+            'total_balance': float(balances.sum()),
+            'total_shoes': int(shoes.sum()),
+            'gini': gini(balances),
+            'balance_percentiles': percentiles(balances),
+            'shoe_percentiles': percentiles(shoes),
+            'total_ores': int(ores.sum()),
+            'miners': int(np.count_nonzero(ores)),
+            'shoe_ores': shoe_ores
+        }
+
+        Event._stats_cache[self.guild_id] = (time.monotonic(), stats)
+
+        return stats
+
+    async def show_stats(self) -> Embed:
+        """
+        Returns embed of economy stats for this guild
+        """
+        stats = await self.get_stats()
+
+        em = Embed(
+            title = "Server economy",
+            timestamp = utcnow(),
+            colour = Colour.from_str(EMBED_COLOUR)
+        )
+
+        if stats['players'] == 0:
+            em.description = "There are no players playing here..."
+            return em
+
+        em.description = f"**Players:** {stats['players']}"
+
+        em.add_field(name = "Coin supply", value = round(stats['total_balance'], 2))
+        em.add_field(name = "Shoe supply", value = stats['total_shoes'])
+        em.add_field(name = "Gini (balance)", value = round(stats['gini'], 3))
+
+        em.add_field(
+            name = "Balance percentiles", 
+            value = "\n".join(f"p{p}: {round(v, 2)}" for p, v in stats['balance_percentiles'].items()),
+        )
+        em.add_field(
+            name = "Shoe percentiles", 
+            value = "\n".join(f"p{p}: {round(v, 2)}" for p, v in stats['shoe_percentiles'].items()),
+        )
+
+        participation = 100 * stats['miners'] / stats['players']
+        em.add_field(
+            name = "Ores today", 
+            value = f"{stats['total_ores']} ores by {stats['miners']} players ({participation:.1f}%)\n"
+                    f"{stats['shoe_ores']} shoes to be given"
+        )
+
+        return em
+
+
+class Leaderboard:
+    """
+    Per-guild leaderboard snapshots (top records and the rendered embed).
+
+    A snapshot is rebuilt on the next read after a write to that guild's players,
+    or once it is older than LEADERBOARD_REFRESH_SECS, whichever comes first.
+    """
+    TOP = 10
+
+    # (guild_id, field) -> (built_on, records, embed)
+    _snapshots = {}
+    # (guild_id, field) -> lock of the rebuild in progress, so concurrent reads only rebuild once
+    _locks = {}
+    # guild_id -> write counter, to drop snapshots built while a write happened
+    _versions = {}
+
+    @classmethod
+    def invalidate(cls, guild_id: int):
+        """
+        Marks all snapshots of a guild as stale. Call after writes to players table
+        """
+        cls._versions[guild_id] = cls._versions.get(guild_id, 0) + 1
+        cls._snapshots.pop((guild_id, 'balance'), None)
+        cls._snapshots.pop((guild_id, 'ores'), None)
+
+    @classmethod
+    def invalidate_many(cls, guild_ids):
+        """
+        Marks snapshots of all given guilds as stale
+        """
+        for guild_id in guild_ids:
+            cls.invalidate(guild_id)
+
+    @classmethod
+    def _fresh(cls, key):
+        snapshot = cls._snapshots.get(key)
+
+        if snapshot is not None and (time.monotonic() - snapshot[0]) < LEADERBOARD_REFRESH_SECS:
+            return snapshot
+        return None
+
+    @classmethod
+    async def get_snapshot(cls, event: Event, field: str) -> tuple:
+        """
+        Returns (built_on, records, embed) for the guild, rebuilding it if stale
+        """
+        key = (event.guild_id, field)
+
+        snapshot = cls._fresh(key)
+        if snapshot is not None:
+            return snapshot
+
+        lock = cls._locks.setdefault(key, asyncio.Lock())
+
+        async with lock:
+            # another read may have rebuilt it while we waited
+            snapshot = cls._fresh(key)
+            if snapshot is not None:
+                return snapshot
+
+            try:
+                version = cls._versions.get(event.guild_id, 0)
+                built_on = time.monotonic()
+                records = await event.get_player_records(field, limit = cls.TOP)
+                snapshot = (built_on, records, cls._render(records, field))
+
+                # only keep it if the guild wasn't invalidated during the query
+                if cls._versions.get(event.guild_id, 0) == version:
+                    cls._snapshots[key] = snapshot
+            finally:
+                # reads waiting on this lock still hold it, and find the new snapshot
+                if cls._locks.get(key) is lock:
+                    del cls._locks[key]
+
+        return snapshot
+
+    @classmethod
+    async def get_embed(cls, event: Event, field: str) -> Embed:
+        """
+        Returns leaderboard embed for the guild, from the snapshot if fresh
+        """
+        snapshot = await cls.get_snapshot(event, field)
+        return snapshot[2]
+
+    @staticmethod
+    def _render(records, field: str) -> Embed:
+        """
+        Builds the leaderboard embed from the top records
+        """
+        if field == 'ores':
+            title = "Ores Leaderboard (top 10)"
+        else:
+            title = "Leaderboard (top 10)"
+
         embed = Embed(
-            title = "Leaderboard (top 10)", 
+            title = title, 
             timestamp = utcnow(),
             colour = Colour.from_str(EMBED_COLOUR)
         )
@@ -369,63 +901,169 @@ class Event:
             embed.description = "There are no players playing here..."
             return embed
 
-        embed.description = ""
-        embed.set_footer(text = "Sorted by balance")
+        lines = []
 
         for position, record in enumerate(records, start = 1):
-            embed.description += "{0}. {1} - **{2} coins and {3} shoes**\n".format(
-                position,
-                guild.get_member(record['user_id']).mention, 
-                int(record['balance']),
-                record['pos']
-            )
+            if field == 'ores':
+                lines.append("{0}. {1} - **{2} ores**".format(
+                    position,
+                    mention(record['user_id']), 
+                    record['day_ores'],
+                ))
+            else:
+                lines.append("{0}. {1} - **{2} coins and {3} shoes**".format(
+                    position,
+                    mention(record['user_id']), 
+                    int(record['balance']),
+                    record['pos']
+                ))
 
-            # 10 players reached
-            if position >= 10:
-                break
+        embed.description = "\n".join(lines) + "\n"
+        embed.set_footer(text = "Sorted by ores" if field == 'ores' else "Sorted by balance")
 
         return embed
-    
-    async def show_ore_leaderboard(self, guild: Guild) -> Embed:
+
+    @staticmethod
+    async def refresh_global(pool: Pool):
         """
-        Returns embed of top 10 players by ore
+        Rebuilds the global_leaderboard materialized view. Concurrently, so reads and writes are never blocked
+        """
+        await pool.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY global_leaderboard;")
+
+    @classmethod
+    async def get_global(cls, pool: Pool, user_id: int, guild_id: int) -> tuple:
+        """
+        Returns (records, own) from the global leaderboard: the top 10 players of every guild,
+        and the player's own record in this guild (None if they aren't ranked). Index lookups only
+        """
+        records = await pool.fetch(queries.GLOBAL_LEADERBOARD, cls.TOP, user_id, guild_id)
+
+        own = next((r for r in records if r['user_id'] == user_id and r['guild_id'] == guild_id), None)
+        top = [r for r in records if r['rank'] <= cls.TOP]
+
+        # the player's record is in both parts when they are in the top 10
+        return list({r['rank']: r for r in top}.values()), own
+
+    @staticmethod
+    def render_global(records, own, guild_name) -> Embed:
+        """
+        Builds the global leaderboard embed. `guild_name(guild_id)` gives the name shown for each player's server
         """
-        records = await self.get_player_records("ores")
         embed = Embed(
-            title = "Ores Leaderboard (top 10)", 
+            title = "Global leaderboard (top 10)", 
             timestamp = utcnow(),
             colour = Colour.from_str(EMBED_COLOUR)
         )
 
-        # no players registered for this guild 
         if records == []:
-            embed.description = "There are no players playing here..."
+            embed.description = "Nobody is ranked yet..."
             return embed
 
-        embed.description = ""
-        embed.set_footer(text = "Sorted by ores")
-
-        for position, record in enumerate(records, start = 1):
-            embed.description += "{0}. {1} - **{2} ores**\n".format(
-                position,
-                guild.get_member(record['user_id']).mention, 
-                record['day_ores'],
+        embed.description = "\n".join(
+            "{0}. {1} ({2}) - **{3} coins and {4} shoes**".format(
+                record['rank'],
+                mention(record['user_id']),
+                guild_name(record['guild_id']),
+                int(record['balance']),
+                record['pos']
             )
+            for record in records
+        ) + "\n"
+
+        if own is not None:
+            embed.description += f"\nYou are **#{own['rank']}** across every server"
+        else:
+            embed.description += f"\nYou are not in the top {GLOBAL_LEADERBOARD_SIZE} across every server yet"
 
-            # 10 players reached
-            if position >= 10:
-                break
+        embed.set_footer(text = f"Sorted by balance, updated every {GLOBAL_LEADERBOARD_REFRESH_SECS // 60} minutes")
 
         return embed
 
 
+class OreHistory:
+    """
+    Daily ore payouts, in the ore_payouts table which is range partitioned by day (UTC).
+
+    Partitions are named ore_payouts_YYYYMMDD and created when a payout needs them,
+    so old days can be removed with a cheap DROP TABLE
+    """
+    @staticmethod
+    def partition_name(day: date) -> str:
+        return f"ore_payouts_{day:%Y%m%d}"
+
+    @staticmethod
+    async def ensure_partition(conn: Connection, day: date):
+        """
+        Creates partition for the day, if it doesn't exist
+        """
+        start = datetime.combine(day, datetime.min.time(), tzinfo = timezone.utc)
+        end = start + timedelta(days = 1)
+
+        # DDL can't take parameters, but all values here are generated from dates
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS {0} PARTITION OF ore_payouts
+                FOR VALUES FROM ('{1}') TO ('{2}');
+            """.format(OreHistory.partition_name(day), start.isoformat(), end.isoformat())
+        )
+
+    @staticmethod
+    async def record(conn: Connection, rows: list, paid_on: datetime):
+        """
+        Batch inserts payout rows of (guild_id, user_id, paid_on, ores, guild_ores, shoes).
+        Use inside the payout transaction
+        """
+        if rows == []:
+            return
+
+        await OreHistory.ensure_partition(conn, paid_on.astimezone(timezone.utc).date())
+
+        await conn.copy_records_to_table(
+            'ore_payouts', 
+            records = rows, 
+            columns = ('guild_id', 'user_id', 'paid_on', 'ores', 'guild_ores', 'shoes')
+        )
+
+    @staticmethod
+    async def drop_old(pool: Pool, keep_days: int):
+        """
+        Drops partitions of days older than `keep_days`
+        """
+        cutoff = OreHistory.partition_name(utcnow().date() - timedelta(days = keep_days))
+
+        partitions = await pool.fetch(
+            """
+            SELECT child.relname AS name FROM pg_inherits
+            INNER JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+            INNER JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+            WHERE parent.relname = 'ore_payouts';
+            """
+        )
+
+        for record in partitions:
+            # names sort the same way as their days
+            if record['name'] < cutoff:
+                await pool.execute(f"DROP TABLE IF EXISTS {record['name']}")
+
+    @staticmethod
+    async def get_player_history(pool: Pool, guild_id: int, user_id: int, days: int):
+        """
+        Get player's payouts for the last `days` days, newest first
+        """
+        return await pool.fetch(queries.ORE_HISTORY, guild_id, user_id, utcnow() - timedelta(days = days))
+
+
 class ViewHelper:
+    # one of these lives for every active giveaway, so keep them small
+    __slots__ = ('pool', 'mid', 'cid', 'id', 'used_users')
+
     def __init__(self, pool: Pool, message_id: int, channel_id: int, id: int, used_users) -> None:
         self.pool = pool
         self.mid = message_id
         self.cid = channel_id
         self.id = id
-        self.used_users = used_users
+        # user ids in claim order, 8 bytes each instead of a list of int objects
+        self.used_users = array('q', used_users or ())
 
     @staticmethod
     async def get_views(pool: Pool):
@@ -444,9 +1082,10 @@ class ViewHelper:
         """
         if isinstance(VIEW_INTERVAL_HRS, int):
             # NOTE: this is very dangerous.
-            query = "SELECT * FROM views WHERE (NOW() - created_on) >= INTERVAL '{0} hours'".format(VIEW_INTERVAL_HRS)
+            query = queries.OVERDUE_VIEWS.format(VIEW_INTERVAL_HRS)
 
-        # checks where NOW - created_on is greater than/= 12 hours (ie happened 12 hours ago atleast)
+        # checks where created_on is at least 12 hours before NOW (ie happened 12 hours ago atleast)
+        # written this way so the index on created_on can be used
         overdue_views = await pool.fetch(query)
         
         return overdue_views
@@ -459,7 +1098,7 @@ class ViewHelper:
         if view_ids is not None:
             await pool.execute("DELETE FROM views WHERE id = ANY($1)", view_ids)
         elif channel_ids is not None:
-            await pool.execute("DELETE FROM views WHERE channel_id = ANY($1)", channel_ids)
+            await pool.execute(queries.DELETE_CHANNEL_VIEWS, channel_ids)
 
     @staticmethod
     async def create_view(pool: Pool, channel_id: int, message_id: int):
@@ -479,8 +1118,7 @@ class ViewHelper:
         """
         Classmethod: get view object from message_id and channel_id
         """
-        record = await pool.fetchrow("SELECT * FROM views WHERE message_id = $1 AND channel_id = $2",
-            message_id, channel_id)
+        record = await pool.fetchrow(queries.VIEW_FROM_MESSAGE, message_id, channel_id)
         
         return cls(pool, message_id, channel_id, record['id'], record['used_users'])
     
@@ -495,8 +1133,7 @@ class ViewHelper:
         Adds user to list of used_users
         """        
         self.used_users.append(user_id)
-        await self.pool.execute("UPDATE views SET used_users = $1 WHERE id = $2",
-            self.used_users, self.id)
+        await self.pool.execute(queries.ADD_VIEW_USER, user_id, self.id)
         
     async def limit_reached(self, pos_given: int):
         """
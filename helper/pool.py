@@ -0,0 +1,217 @@
+import asyncio
+import contextlib
+import time
+from collections import deque
+
+import asyncpg
+
+from helper import tracing
+from params import (
+    POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_STATEMENT_CACHE_SIZE, POOL_COMMAND_TIMEOUT,
+    POOL_ACQUIRE_TIMEOUT, POOL_CONNECTION_LIFETIME, POOL_MAX_QUERIES, POOL_ADAPTIVE
+)
+
+# IMPORTANT
+# in adaptive mode only `limit` connections are used at once; acquires over it queue, and the adjust loop
+# ... grows the limit when acquires waited and shrinks it when idle, so asyncpg closes the unused connections.
+
+class MeteredAcquire:
+    """
+    Async context manager returned by MeteredPool.acquire
+    """
+    def __init__(self, pool, timeout) -> None:
+        self.pool = pool
+        self.timeout = timeout
+        self.con = None
+
+    async def __aenter__(self) -> asyncpg.Connection:
+        self.con = await self.pool._acquire(self.timeout)
+        return self.con
+
+    async def __aexit__(self, *exc):
+        await self.pool._release(self.con)
+        self.con = None
+
+
+class MeteredPool:
+    """
+    Wrapper around asyncpg.Pool that records acquire wait times and pool saturation,
+    with an optional adaptive limit on connections in use.
+
+    Supports the Pool methods used by the bot: fetch, fetchrow, fetchval, execute, executemany, acquire and close
+    """
+    # seconds between adaptive limit adjustments (well under POOL_ACQUIRE_TIMEOUT)
+    ADJUST_EVERY = 1
+    # an acquire waiting longer than this (seconds) counts towards growing the limit
+    GROW_WAIT = 0.05
+    # shrink when peak use over the last period is under this fraction of the limit
+    SHRINK_USE = 0.5
+
+    def __init__(self, pool: asyncpg.Pool, adaptive: bool = POOL_ADAPTIVE) -> None:
+        self.pool = pool
+        self.adaptive = adaptive
+        self.limit = POOL_MIN_SIZE if adaptive else POOL_MAX_SIZE
+        self.in_use = 0
+        self.waiting = 0
+        self.cond = asyncio.Condition()
+
+        # metrics
+        self.waits = deque(maxlen = 1000)
+        self.acquires = 0
+        self.timeouts = 0
+        self.peak_in_use = 0
+        self.period_peak = 0
+        self.period_waits = 0
+        self.saturated = 0
+
+        self.adjust_task = None
+        if adaptive:
+            self.adjust_task = asyncio.create_task(self._adjust_loop())
+
+    @classmethod
+    async def create(cls, dsn: str, **kwargs):
+        """
+        Constructor. Creates asyncpg pool with the sizes and timeouts in params.py
+        """
+        pool = await asyncpg.create_pool(
+            dsn,
+            min_size = POOL_MIN_SIZE,
+            max_size = POOL_MAX_SIZE,
+            max_queries = POOL_MAX_QUERIES,
+            max_inactive_connection_lifetime = POOL_CONNECTION_LIFETIME,
+            statement_cache_size = POOL_STATEMENT_CACHE_SIZE,
+            command_timeout = POOL_COMMAND_TIMEOUT,
+            **kwargs
+        )
+
+        return cls(pool)
+
+    async def _acquire(self, timeout = None) -> asyncpg.Connection:
+        """
+        Waits for a slot under the limit and a connection, recording the wait
+        """
+        timeout = POOL_ACQUIRE_TIMEOUT if timeout is None else timeout
+        start = time.perf_counter()
+        self.waiting += 1
+
+        try:
+            with tracing.span('db.acquire'):
+                con = await asyncio.wait_for(self._take(), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+
+        wait = time.perf_counter() - start
+        self.waits.append(wait)
+        self.acquires += 1
+
+        if wait >= self.GROW_WAIT:
+            self.period_waits += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        self.period_peak = max(self.period_peak, self.in_use)
+
+        if self.in_use >= self.limit:
+            self.saturated += 1
+
+        return con
+
+    async def _take(self) -> asyncpg.Connection:
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.in_use < self.limit)
+            self.in_use += 1
+
+        try:
+            return await self.pool.acquire()
+        except BaseException:
+            await self._free_slot()
+            raise
+
+    async def _free_slot(self):
+        async with self.cond:
+            self.in_use -= 1
+            self.cond.notify()
+
+    async def _release(self, con: asyncpg.Connection):
+        try:
+            await self.pool.release(con)
+        finally:
+            await self._free_slot()
+
+    def acquire(self, *, timeout = None) -> MeteredAcquire:
+        return MeteredAcquire(self, timeout)
+
+    async def fetch(self, query, *args, timeout = None):
+        async with self.acquire() as con:
+            return await con.fetch(query, *args, timeout = timeout)
+
+    async def fetchrow(self, query, *args, timeout = None):
+        async with self.acquire() as con:
+            return await con.fetchrow(query, *args, timeout = timeout)
+
+    async def fetchval(self, query, *args, column = 0, timeout = None):
+        async with self.acquire() as con:
+            return await con.fetchval(query, *args, column = column, timeout = timeout)
+
+    async def execute(self, query, *args, timeout = None):
+        async with self.acquire() as con:
+            return await con.execute(query, *args, timeout = timeout)
+
+    async def executemany(self, command, args, *, timeout = None):
+        async with self.acquire() as con:
+            return await con.executemany(command, args, timeout = timeout)
+
+    async def close(self):
+        if self.adjust_task is not None:
+            self.adjust_task.cancel()
+
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.adjust_task
+
+        await self.pool.close()
+
+    async def _adjust_loop(self):
+        """
+        Grows the limit by the acquires still queued when acquires had to wait last period,
+        and shrinks it by one when connections sat idle
+        """
+        while True:
+            await asyncio.sleep(self.ADJUST_EVERY)
+
+            async with self.cond:
+                if (self.waiting or self.period_waits) and self.period_peak >= self.limit and self.limit < POOL_MAX_SIZE:
+                    self.limit = min(POOL_MAX_SIZE, self.limit + max(1, self.waiting))
+                    self.cond.notify_all()
+
+                elif not self.waiting and self.period_peak < self.limit * self.SHRINK_USE and self.limit > POOL_MIN_SIZE:
+                    self.limit -= 1
+
+            self.period_peak = self.in_use
+            self.period_waits = 0
+
+    def get_stats(self) -> dict:
+        """
+        Get pool metrics: acquire wait percentiles (ms), saturation and sizes
+        """
+        waits = sorted(self.waits)
+
+        def pct(p):
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 2) if waits else 0.0
+
+        return {
+            'limit': self.limit,
+            'size': self.pool.get_size(),
+            'idle': self.pool.get_idle_size(),
+            'in_use': self.in_use,
+            'waiting': self.waiting,
+            'peak_in_use': self.peak_in_use,
+            'acquires': self.acquires,
+            'timeouts': self.timeouts,
+            'saturation': self.in_use / self.limit,
+            'saturated_acquires': self.saturated,
+            'wait_p50_ms': pct(0.50),
+            'wait_p95_ms': pct(0.95),
+            'wait_p99_ms': pct(0.99),
+            'wait_max_ms': round(waits[-1] * 1000, 2) if waits else 0.0
+        }
@@ -0,0 +1,187 @@
+import asyncio
+import sys
+import threading
+import time
+import weakref
+from collections import Counter
+
+from params import PROFILE_INTERVAL_MS, PROFILE_MAX_SECS
+
+# IMPORTANT
+# a sampler thread counts the loop thread's stack every PROFILE_INTERVAL_MS when it used CPU, under its task's label.
+# the output is in collapsed stack format, which flamegraph tools read.
+
+# most frames kept per sample (the innermost ones)
+MAX_DEPTH = 96
+
+# seconds a thread waiting for the GIL waits before asking for it, while profiling.
+# with the default, the sampler mostly gets the GIL when the loop releases it in select, and every sample lands there
+SWITCH_INTERVAL = 0.0001
+
+# task -> label, for tasks handling an interaction
+_labels = weakref.WeakKeyDictionary()
+
+
+def label(name: str):
+    """
+    Labels the current task for profiles. Samples taken while it runs are put under `name`
+    """
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        return
+
+    if task is not None:
+        _labels[task] = name
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    # files are shown by their last two path parts, e.g. helper/objects.py
+    filename = code.co_filename.replace('\\', '/').rsplit('/', 2)
+    return f"{code.co_name} ({'/'.join(filename[-2:])}:{code.co_firstlineno})"
+
+
+class Profiler:
+    def __init__(self) -> None:
+        self.loop = None
+        self.running = False
+        self.done = None
+        self.timer = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.loop_thread = None
+        self.previous_switch_interval = None
+
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self.ended = None
+
+    def start(self, loop: asyncio.AbstractEventLoop, seconds: float):
+        """
+        Starts sampling `loop` for up to `seconds`, capped at PROFILE_MAX_SECS.
+        Must be called from the loop. Raises RuntimeError if a profile is already running
+        """
+        if self.running:
+            raise RuntimeError("A profile is already running")
+
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = time.monotonic()
+        self.ended = None
+        self.done = asyncio.Event()
+        self.running = True
+
+        self.previous_switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(SWITCH_INTERVAL)
+
+        self.stopping.clear()
+        self.thread = threading.Thread(target = self._run, name = "profiler", daemon = True)
+        self.thread.start()
+
+        self.timer = loop.call_later(min(seconds, PROFILE_MAX_SECS), self.stop)
+
+    def stop(self):
+        """
+        Stops sampling. Does nothing when no profile is running
+        """
+        if not self.running:
+            return
+
+        self.stopping.set()
+        self.timer.cancel()
+        sys.setswitchinterval(self.previous_switch_interval)
+
+        self.running = False
+        self.ended = time.monotonic()
+        self.done.set()
+
+    async def wait(self):
+        """
+        Waits for the profile to end
+        """
+        await self.done.wait()
+
+    def _cpu_clock(self):
+        """
+        Function returning the loop thread's CPU time, or None where threads have no CPU clock
+        """
+        try:
+            clock = time.pthread_getcpuclockid(self.loop_thread)
+            time.clock_gettime(clock)
+        except (AttributeError, OSError):
+            return None
+
+        return lambda: time.clock_gettime(clock)
+
+    def _run(self):
+        """
+        Sampler thread: samples the loop thread every PROFILE_INTERVAL_MS until stopped
+        """
+        interval = PROFILE_INTERVAL_MS / 1000
+        cpu_time = self._cpu_clock()
+        last_cpu = cpu_time() if cpu_time else None
+
+        while not self.stopping.wait(interval):
+            if cpu_time is not None:
+                now = cpu_time()
+                # the loop was waiting the whole time
+                if now == last_cpu:
+                    continue
+                last_cpu = now
+
+            frame = sys._current_frames().get(self.loop_thread)
+
+            if frame is None:
+                return
+
+            self._sample(frame)
+
+    def _sample(self, frame):
+        """
+        Counts the stack of `frame`, put under what the loop is running
+        """
+        # what the loop is running right now
+        task = asyncio.current_task(self.loop)
+
+        if task is None:
+            where = 'loop'
+        else:
+            where = _labels.get(task) or task.get_name()
+
+        stack = []
+        while frame is not None and len(stack) < MAX_DEPTH:
+            stack.append(_frame_name(frame))
+            frame = frame.f_back
+
+        stack.append(where)
+        stack.reverse()
+
+        self.stacks[';'.join(stack)] += 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        """
+        The profile in collapsed stack format, most sampled stacks first
+        """
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def summary(self, top: int = 10) -> list:
+        """
+        Samples per label, as (label, samples, fraction) for the `top` labels
+        """
+        per_label = Counter()
+
+        for stack, count in self.stacks.items():
+            per_label[stack.split(';', 1)[0]] += count
+
+        total = sum(per_label.values()) or 1
+
+        return [(name, count, count / total) for name, count in per_label.most_common(top)]
+
+
+# the process's profiler
+profiler = Profiler()
@@ -0,0 +1,281 @@
+# IMPORTANT
+# SQL of the statements on command paths, shared with the plan check in benchmarks/query_plans.py.
+# templates with {0} are filled with .format(), only ever with values from the code.
+
+# players
+
+PLAYER_EXISTS = "SELECT EXISTS (SELECT 1 FROM players WHERE user_id = $1 AND guild_id = $2)"
+
+PLAYER_DETAILS = "SELECT * FROM players WHERE user_id = $1 AND guild_id = $2"
+
+CREATE_PLAYER = "INSERT INTO players VALUES ($1, $2, 0, 0)"
+
+CLAIM_SHOES = "UPDATE players SET pos = pos + 1 WHERE user_id = $1 AND guild_id = $2"
+
+SELL_SHOES = """
+    UPDATE players
+        SET pos = pos - $1,
+        balance = balance + $2
+    WHERE user_id = $3 AND guild_id = $4
+"""
+
+# fields given as NULL keep their value, and the old values are returned for the ledger
+MODIFY_PLAYER = """
+    UPDATE players
+    SET balance = COALESCE($1, players.balance), pos = COALESCE($2, players.pos)
+    FROM (SELECT balance, pos FROM players WHERE guild_id = $3 AND user_id = $4) AS old
+    WHERE players.guild_id = $3 AND players.user_id = $4
+    RETURNING COALESCE(old.balance, 0) AS old_balance, COALESCE(old.pos, 0) AS old_pos, players.balance, players.pos
+"""
+
+PLAYER_PAYOUT = """
+    SELECT players.day_ores, events.ore_total, events.shoe_ores, events.last_collect
+    FROM players
+    LEFT JOIN events ON events.guild_id = players.guild_id
+    WHERE players.user_id = $1 AND players.guild_id = $2
+"""
+
+PLAYER_PROFILE = """
+    SELECT players.*, events.ore_total, events.shoe_ores
+    FROM players
+    LEFT JOIN events ON events.guild_id = players.guild_id
+    WHERE players.user_id = $1 AND players.guild_id = $2
+"""
+
+ADD_ORES = """
+    WITH player AS (
+        UPDATE players
+        SET day_ores = day_ores + $1
+        WHERE user_id = $2 AND guild_id = $3
+        RETURNING day_ores
+    ), event AS (
+        UPDATE events
+        SET ore_total = ore_total + $1
+        WHERE guild_id = $3
+        RETURNING ore_total, shoe_ores
+    )
+    SELECT player.day_ores, event.ore_total, event.shoe_ores FROM player, event
+"""
+
+# {0} is the column to sort by, balance or day_ores
+PLAYER_LEADERBOARD = "SELECT * FROM players WHERE guild_id = $1 ORDER BY {0} DESC LIMIT $2"
+
+GLOBAL_LEADERBOARD = """
+    (SELECT * FROM global_leaderboard WHERE rank <= $1)
+    UNION ALL
+    (SELECT * FROM global_leaderboard WHERE user_id = $2 AND guild_id = $3)
+    ORDER BY rank
+"""
+
+GUILD_PLAYER_COUNT = "SELECT COUNT(*) FROM players WHERE guild_id = $1"
+
+# streamed through a cursor for the guild's economy stats
+GUILD_PLAYER_STATS = "SELECT COALESCE(balance, 0), COALESCE(pos, 0), COALESCE(day_ores, 0) FROM players WHERE guild_id = $1"
+
+# events
+
+EVENT_EXISTS = "SELECT EXISTS (SELECT 1 FROM events WHERE guild_id = $1)"
+
+GIVEAWAY_SHOES = "SELECT pos_given FROM events WHERE guild_id = $1"
+
+EVENT_CHANNEL = "SELECT channel_id FROM events WHERE guild_id = $1"
+
+EVENT_SHOE_ORES = "SELECT shoe_ores FROM events WHERE guild_id = $1"
+
+EVENT_DETAILS = "SELECT * FROM events WHERE guild_id = $1"
+
+# prices
+
+LATEST_PRICE_DATE = "SELECT price_date FROM shoes WHERE guild_id = $1 ORDER BY price_date DESC LIMIT 1"
+
+LATEST_PRICE = "SELECT price FROM shoes WHERE guild_id = $1 ORDER BY price_date DESC LIMIT 1"
+
+INSERT_PRICE = "INSERT INTO shoes (guild_id, price) VALUES ($1, $2)"
+
+PRICE_HISTORY = """
+    SELECT price_date, price FROM (
+        (SELECT price_date, price FROM shoes
+            WHERE guild_id = $3 AND price_date <= $1 ORDER BY price_date DESC LIMIT $2)
+        UNION ALL
+        (SELECT bucket AS price_date, close AS price FROM shoes_hourly
+            WHERE guild_id = $3 AND bucket <= $1 ORDER BY bucket DESC LIMIT $2)
+        UNION ALL
+        (SELECT bucket AS price_date, close AS price FROM shoes_daily
+            WHERE guild_id = $3 AND bucket <= $1 ORDER BY bucket DESC LIMIT $2)
+    ) AS prices
+    ORDER BY price_date DESC LIMIT $2
+"""
+
+# latest price of each market, one index read each in a single round trip
+MARKETS = """
+    SELECT markets.guild_id, markets.mu, markets.sd, latest.price FROM (
+        SELECT $1::BIGINT AS guild_id, NULL::FLOAT AS mu, NULL::FLOAT AS sd
+        UNION ALL
+        SELECT guild_id, price_mu, price_sd FROM events
+    ) AS markets
+    LEFT JOIN LATERAL (
+        SELECT price FROM shoes
+        WHERE shoes.guild_id = markets.guild_id
+        ORDER BY price_date DESC LIMIT 1
+    ) AS latest ON TRUE
+"""
+
+# held until the transaction ends, so only one process changes prices at a time
+PRICE_LOCK = "SELECT pg_try_advisory_xact_lock($1)"
+
+COMPACT_TICKS = """
+    WITH moved AS (
+        DELETE FROM shoes
+        WHERE price_date < date_trunc('hour', NOW() - $1 * INTERVAL '1 day')
+            AND id NOT IN (
+                SELECT DISTINCT ON (guild_id) id FROM shoes
+                ORDER BY guild_id, price_date DESC
+            )
+        RETURNING guild_id, price_date, price
+    )
+    INSERT INTO shoes_hourly (guild_id, bucket, open, high, low, close, ticks)
+    SELECT
+        guild_id,
+        date_trunc('hour', price_date),
+        (array_agg(price ORDER BY price_date))[1],
+        MAX(price),
+        MIN(price),
+        (array_agg(price ORDER BY price_date DESC))[1],
+        COUNT(*)
+    FROM moved
+    GROUP BY 1, 2
+    ON CONFLICT (guild_id, bucket) DO UPDATE SET
+        high = GREATEST(shoes_hourly.high, EXCLUDED.high),
+        low = LEAST(shoes_hourly.low, EXCLUDED.low),
+        close = EXCLUDED.close,
+        ticks = shoes_hourly.ticks + EXCLUDED.ticks;
+"""
+
+COMPACT_HOURLY = """
+    WITH moved AS (
+        DELETE FROM shoes_hourly
+        WHERE bucket < date_trunc('day', NOW() - $1 * INTERVAL '1 day')
+        RETURNING guild_id, bucket, open, high, low, close, ticks
+    )
+    INSERT INTO shoes_daily (guild_id, bucket, open, high, low, close, ticks)
+    SELECT
+        guild_id,
+        date_trunc('day', bucket),
+        (array_agg(open ORDER BY bucket))[1],
+        MAX(high),
+        MIN(low),
+        (array_agg(close ORDER BY bucket DESC))[1],
+        SUM(ticks)
+    FROM moved
+    GROUP BY 1, 2
+    ON CONFLICT (guild_id, bucket) DO UPDATE SET
+        high = GREATEST(shoes_daily.high, EXCLUDED.high),
+        low = LEAST(shoes_daily.low, EXCLUDED.low),
+        close = EXCLUDED.close,
+        ticks = shoes_daily.ticks + EXCLUDED.ticks;
+"""
+
+# views
+
+# {0} is VIEW_INTERVAL_HRS. written this way so the index on created_on can be used
+OVERDUE_VIEWS = "SELECT * FROM views WHERE created_on <= NOW() - INTERVAL '{0} hours'"
+
+VIEW_FROM_MESSAGE = "SELECT * FROM views WHERE message_id = $1 AND channel_id = $2"
+
+DELETE_CHANNEL_VIEWS = "DELETE FROM views WHERE channel_id = ANY($1)"
+
+ADD_VIEW_USER = "UPDATE views SET used_users = array_append(used_users, $1) WHERE id = $2"
+
+# ore payouts
+
+OVERDUE_ORE_GUILDS = "SELECT guild_id FROM events WHERE last_collect <= NOW() - INTERVAL '24 hours';"
+
+ORE_PAYOUT_PLAYERS = """
+    SELECT players.user_id, players.guild_id, players.day_ores, events.ore_total, events.shoe_ores
+    FROM players
+    INNER JOIN events ON players.guild_id = events.guild_id
+    WHERE players.guild_id = ANY($1) AND players.day_ores > 0;
+"""
+
+# ores mined since the players were fetched are kept for the next payout
+PAY_ORES = """
+    UPDATE players
+    SET pos = pos + $1, day_ores = day_ores - $2
+    WHERE user_id = $3 AND guild_id = $4;
+"""
+
+# restarts the guilds' day, and rebuilds their ore totals from what is left
+CLOSE_ORE_DAY = """
+    UPDATE events
+    SET last_collect = NOW(),
+        ore_total = (SELECT COALESCE(SUM(day_ores), 0) FROM players WHERE players.guild_id = events.guild_id)
+    WHERE guild_id = ANY($1);
+"""
+
+LEDGER_ENTRIES = """
+    SELECT kind, balance, shoes, price, other_id, actor_id, created_on FROM ledger
+    WHERE guild_id = $1 AND user_id = $2
+    ORDER BY created_on DESC
+    LIMIT $3
+"""
+
+ORE_HISTORY = """
+    SELECT paid_on, ores, guild_ores, shoes FROM ore_payouts
+    WHERE guild_id = $1 AND user_id = $2 AND paid_on >= $3
+    ORDER BY paid_on DESC
+"""
+
+# orders
+
+# held by the connection of the process that matches orders, until it is released
+MARKET_LOCK = "SELECT pg_try_advisory_lock($1)"
+
+ESCROW_SHOES = """
+    UPDATE players SET pos = pos - $1
+    WHERE user_id = $2 AND guild_id = $3 AND pos >= $1
+    RETURNING TRUE
+"""
+
+ESCROW_BALANCE = """
+    UPDATE players SET balance = balance - $1
+    WHERE user_id = $2 AND guild_id = $3 AND balance >= $1
+    RETURNING TRUE
+"""
+
+# fills and refunds
+CREDIT_PLAYER = """
+    UPDATE players
+    SET pos = pos + $1, balance = balance + $2
+    WHERE user_id = $3 AND guild_id = $4
+"""
+
+DELETE_ORDERS = "DELETE FROM orders WHERE id = ANY($1)"
+
+FILL_ORDER = "UPDATE orders SET shoes = $1 WHERE id = $2"
+
+INSERT_ORDER = """
+    INSERT INTO orders (guild_id, user_id, side, price, shoes)
+    VALUES ($1, $2, $3, $4, $5)
+    RETURNING id
+"""
+
+CANCEL_ORDER = """
+    DELETE FROM orders
+    WHERE id = $1 AND guild_id = $2 AND user_id = $3
+    RETURNING side, price, shoes
+"""
+
+PLAYER_ORDERS = """
+    SELECT id, side, price, shoes FROM orders
+    WHERE guild_id = $1 AND user_id = $2
+    ORDER BY id
+"""
+
+# {0} is ASC for sells and DESC for buys
+MARKET_DEPTH = """
+    SELECT price, SUM(shoes) AS shoes, COUNT(*) AS orders FROM orders
+    WHERE guild_id = $1 AND side = $2
+    GROUP BY price
+    ORDER BY price {0}
+    LIMIT $3
+"""
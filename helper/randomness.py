@@ -0,0 +1,185 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from params import RANDOM_BLOCK_SIZE, RANDOM_SEED
+
+# IMPORTANT
+# numbers are drawn in blocks of RANDOM_BLOCK_SIZE, each block from a generator seeded with its number,
+# ... so a block gives the same numbers whether the worker thread or the loop draws it.
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# one worker, so a generator is never used by two threads at once
+_executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'randomness')
+
+
+class Stream:
+    """
+    Block buffered stream of numbers, each block from its own generator
+    """
+    def __init__(self, seq: 'np.random.SeedSequence', draw, block: int) -> None:
+        self.seq = seq
+        # draw(rng, size) -> numpy array
+        self.draw = draw
+        self.block = block
+        # number of the block in the buffer
+        self.block_number = 0
+        self.buffer = self._draw_block(0)
+        self.index = 0
+        # next block, being drawn on the worker thread
+        self.pending = None
+
+    def _draw_block(self, number: int) -> list:
+        import numpy as np
+
+        seq = np.random.SeedSequence(self.seq.entropy, spawn_key = self.seq.spawn_key + (number,))
+        # python numbers, so taking one doesn't create a numpy scalar
+        return self.draw(np.random.default_rng(seq), self.block).tolist()
+
+    def _refill(self):
+        self.block_number += 1
+
+        if self.pending is not None and self.pending.done():
+            self.buffer = self.pending.result()
+        else:
+            # the worker is behind: draw the same block here rather than block on it
+            if self.pending is not None:
+                self.pending.cancel()
+            self.buffer = self._draw_block(self.block_number)
+
+        self.pending = None
+        self.index = 0
+
+    def _check_prefetch(self):
+        if self.pending is None and self.index >= self.block // 2:
+            self.pending = _executor.submit(self._draw_block, self.block_number + 1)
+
+    def next(self):
+        """
+        Next number
+        """
+        if self.index >= self.block:
+            self._refill()
+
+        value = self.buffer[self.index]
+        self.index += 1
+        self._check_prefetch()
+
+        return value
+
+    def take(self, n: int) -> list:
+        """
+        Next `n` numbers
+        """
+        values = []
+
+        while n > 0:
+            if self.index >= self.block:
+                self._refill()
+
+            chunk = self.buffer[self.index:self.index + n]
+            self.index += len(chunk)
+            n -= len(chunk)
+            values.extend(chunk)
+            self._check_prefetch()
+
+        return values
+
+
+class Randomness:
+    """
+    Shared source of the game's random numbers: ore rolls and normal deviates
+    """
+    # ores mined per /mine are from 0 to 10
+    ORE_MAX = 10
+
+    def __init__(self, seed: int = None, block: int = RANDOM_BLOCK_SIZE) -> None:
+        import numpy as np
+
+        self.seed = seed
+        ore_seq, normal_seq = np.random.SeedSequence(seed).spawn(2)
+
+        self.ores = Stream(
+            ore_seq,
+            lambda rng, size: rng.integers(0, self.ORE_MAX + 1, size = size),
+            block
+        )
+        self.normals = Stream(
+            normal_seq,
+            lambda rng, size: rng.standard_normal(size),
+            block
+        )
+
+    def ore_roll(self) -> int:
+        """
+        Ores mined by one /mine
+        """
+        return self.ores.next()
+
+    def normal(self, mu: float, sd: float) -> float:
+        """
+        One draw from a normal distribution
+        """
+        return mu + sd * self.normals.next()
+
+    def normal_array(self, mus: 'np.ndarray', sds: 'np.ndarray') -> 'np.ndarray':
+        """
+        One draw for each pair of mean and standard deviation
+        """
+        import numpy as np
+
+        return mus + sds * np.array(self.normals.take(len(mus)), dtype = np.float64)
+
+
+# the process's randomness, made on first use, use `seed` to make it reproducible
+service = None
+_service_lock = threading.Lock()
+# future making the service on the worker thread. its own lock, as get() holds _service_lock during the import
+_warming = None
+_warming_lock = threading.Lock()
+
+def seed(value: int = None):
+    """
+    Restarts the process's randomness from a seed (None for a random one)
+    """
+    global service
+    service = Randomness(value)
+
+def get() -> Randomness:
+    """
+    The process's randomness, made from RANDOM_SEED on first use.
+    Blocks while it is made, so code running on the event loop uses ready() instead
+    """
+    global service
+
+    if service is None:
+        with _service_lock:
+            if service is None:
+                service = Randomness(RANDOM_SEED)
+
+    return service
+
+def warm():
+    """
+    Starts making the process's randomness on the worker thread (importing NumPy).
+    Returns its concurrent future
+    """
+    global _warming
+
+    with _warming_lock:
+        if _warming is None:
+            _warming = _executor.submit(get)
+
+    return _warming
+
+async def ready() -> Randomness:
+    """
+    The process's randomness, waiting for it to be made on the worker thread without blocking the loop
+    """
+    if service is None:
+        await asyncio.wrap_future(warm())
+
+    return service
@@ -0,0 +1,52 @@
+import os
+import time
+from contextlib import contextmanager
+
+def rss() -> int:
+    """
+    Resident memory of this process in bytes (Linux only, 0 elsewhere)
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return 0
+
+
+class StartupTimer:
+    """
+    Times the phases of startup, from `started` (a time.perf_counter() value taken before the imports).
+    Phases can overlap, so each is kept with the time it began
+    """
+    def __init__(self, started: float) -> None:
+        self.started = started
+        # (name, seconds from started to its beginning, seconds it took)
+        self.phases = []
+        self.reported = False
+
+    def add(self, name: str, begun: float, ended: float = None):
+        """
+        Records a phase that ran from the perf_counter() value `begun` to `ended` (now by default)
+        """
+        ended = time.perf_counter() if ended is None else ended
+        self.phases.append((name, begun - self.started, ended - begun))
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Records the time the body takes (awaits included) as a phase
+        """
+        begun = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, begun)
+
+    def report(self) -> str:
+        """
+        One line per phase in the order they began: when it began, how long it took, and its name
+        """
+        return "\n".join(
+            f"{begun:7.2f}s {took * 1000:8.1f} ms  {name}"
+            for name, begun, took in sorted(self.phases, key = lambda phase: phase[1])
+        )
@@ -0,0 +1,208 @@
+import asyncio
+import random
+import time
+import traceback
+from collections import deque
+from datetime import timedelta
+
+from discord.utils import utcnow
+
+# IMPORTANT
+# each background job is its own task. runs never overlap, and failures are retried with backoff.
+
+class Job:
+    """
+    A supervised background job, and the record of its runs
+    """
+    # most recent runs kept per job
+    HISTORY = 50
+
+    def __init__(self, name: str, func, interval: float, jitter: float, max_backoff: float, before = None) -> None:
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.before = before
+
+        self.task = None
+        # call_later handle of a pending restart
+        self.restart = None
+        self.running = False
+        # consecutive failures, for backoff
+        self.failures = 0
+
+        self.runs = 0
+        self.total_failures = 0
+        self.skipped = 0
+        self.restarts = 0
+        self.last_error = None
+        self.last_run = None
+        self.next_run = None
+        # (started, duration, ok) of recent runs
+        self.history = deque(maxlen = self.HISTORY)
+
+    def delay(self) -> float:
+        """
+        Seconds until next run: jittered interval, or backoff after failures
+        """
+        if self.failures:
+            return min(self.max_backoff, 2 ** self.failures)
+
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def run_once(self):
+        """
+        Runs the job once, recording its duration and any failure
+        """
+        self.running = True
+        self.last_run = utcnow()
+        start = time.perf_counter()
+
+        try:
+            await self.func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failures += 1
+            self.total_failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            self.history.append((self.last_run, time.perf_counter() - start, False))
+            print(f"Job {self.name} failed:")
+            traceback.print_exc()
+        else:
+            self.failures = 0
+            self.history.append((self.last_run, time.perf_counter() - start, True))
+        finally:
+            self.runs += 1
+            self.running = False
+
+    async def loop(self):
+        if self.before is not None:
+            await self.before()
+
+        while True:
+            started = time.monotonic()
+            await self.run_once()
+
+            delay = self.delay()
+
+            if not self.failures:
+                # intervals are counted from the start of the run
+                elapsed = time.monotonic() - started
+
+                if elapsed > delay:
+                    # the run took longer than the interval: skip the runs that would have overlapped
+                    missed = int(elapsed // self.interval)
+                    self.skipped += missed
+                    delay = max(0.0, (missed + 1) * self.interval - elapsed)
+                else:
+                    delay -= elapsed
+
+            self.next_run = utcnow() + timedelta(seconds = delay)
+            await asyncio.sleep(delay)
+
+    def get_health(self) -> dict:
+        durations = [d for _, d, _ in self.history]
+
+        return {
+            'name': self.name,
+            'running': self.running,
+            'runs': self.runs,
+            'failures': self.total_failures,
+            'failing': self.failures,
+            'skipped': self.skipped,
+            'restarts': self.restarts,
+            'last_run': self.last_run,
+            'next_run': self.next_run,
+            'avg_secs': sum(durations) / len(durations) if durations else 0.0,
+            'max_secs': max(durations) if durations else 0.0,
+            'last_error': self.last_error
+        }
+
+
+class Supervisor:
+    """
+    Runs and watches background jobs
+    """
+    def __init__(self) -> None:
+        self.jobs = {}
+        self.started = False
+
+    def add(self, name: str, func, *, seconds: float, jitter: float = 0.05, max_backoff: float = 300, before = None):
+        """
+        Adds a job calling `func()` every `seconds`. `before()` is awaited once before the first run.
+        Starts it right away if the supervisor is running
+        """
+        job = Job(name, func, seconds, jitter, max_backoff, before)
+        self.remove(name)
+        self.jobs[name] = job
+
+        if self.started:
+            self._spawn(job)
+
+        return job
+
+    def remove(self, name: str):
+        """
+        Stops and removes a job
+        """
+        job = self.jobs.pop(name, None)
+
+        if job is not None:
+            self._cancel(job)
+
+    def start(self):
+        self.started = True
+
+        for job in self.jobs.values():
+            self._spawn(job)
+
+    async def stop(self):
+        """
+        Cancels every job, and waits for them to finish (so none is left inside a query)
+        """
+        self.started = False
+        tasks = [job.task for job in self.jobs.values() if job.task is not None]
+
+        for job in self.jobs.values():
+            self._cancel(job)
+
+        await asyncio.gather(*tasks, return_exceptions = True)
+
+    def _cancel(self, job: Job):
+        if job.restart is not None:
+            job.restart.cancel()
+            job.restart = None
+
+        if job.task is not None:
+            job.task.cancel()
+
+    def _spawn(self, job: Job):
+        job.task = asyncio.create_task(job.loop(), name = f"job:{job.name}")
+        job.task.add_done_callback(lambda task: self._on_done(job, task))
+
+    def _on_done(self, job: Job, task: asyncio.Task):
+        """
+        Restarts a job whose task died (e.g. its `before()` failed) after its backoff, unless it was stopped
+        """
+        if task.cancelled() or not self.started or self.jobs.get(job.name) is not job:
+            return
+
+        job.failures += 1
+        job.total_failures += 1
+        job.restarts += 1
+        job.last_error = repr(task.exception())
+
+        delay = job.delay()
+        job.next_run = utcnow() + timedelta(seconds = delay)
+        job.restart = asyncio.get_running_loop().call_later(delay, self._restart, job)
+
+    def _restart(self, job: Job):
+        job.restart = None
+
+        if self.started and self.jobs.get(job.name) is job:
+            self._spawn(job)
+
+    def get_health(self) -> list:
+        return [job.get_health() for job in self.jobs.values()]
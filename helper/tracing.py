@@ -0,0 +1,263 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+from params import TRACE_SAMPLE_RATE, TRACE_FILE, TRACE_MAX_BYTES, TRACE_BACKUPS
+
+# IMPORTANT
+# each interaction is a root span (sampled at TRACE_SAMPLE_RATE), with its queries and discord HTTP calls as children.
+# traces are written as OTLP/JSON lines to TRACE_FILE by a background thread.
+
+SERVICE_NAME = 'shoeman-bot'
+
+# OTLP span kinds and status codes
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current = ContextVar('current_span', default = None)
+
+_logger = logging.getLogger('shoeman.traces')
+_logger.propagate = False
+_listener = None
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, trace, parent_id, name: str, kind: int, attributes: dict) -> None:
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, key: str, value):
+        """
+        Set attribute on the span
+        """
+        self.attributes[key] = value
+
+    def to_otlp(self) -> dict:
+        span = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end),
+            'attributes': [_attribute(k, v) for k, v in self.attributes.items()],
+            'status': {'code': STATUS_OK}
+        }
+
+        if self.parent_id is not None:
+            span['parentSpanId'] = self.parent_id
+
+        if self.error is not None:
+            span['status'] = {'code': STATUS_ERROR, 'message': self.error}
+
+        return span
+
+
+class Trace:
+    __slots__ = ('trace_id', 'spans')
+
+    def __init__(self) -> None:
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def _export(trace: Trace):
+    """
+    Writes finished trace to the trace file, as an OTLP/JSON export request
+    """
+    if _listener is None:
+        return
+
+    request = {
+        'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', SERVICE_NAME)]},
+            'scopeSpans': [{
+                'scope': {'name': 'shoeman'},
+                'spans': [s.to_otlp() for s in trace.spans if s.end is not None]
+            }]
+        }]
+    }
+
+    _logger.info(json.dumps(request, separators = (',', ':')))
+
+
+def _export_later(trace: Trace):
+    """
+    Exports the trace once the callbacks already scheduled on the loop have run.
+    asyncpg calls query loggers with call_soon, so the last queries' spans are added after the root span ends
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _export(trace)
+        return
+
+    loop.call_soon(_export, trace)
+
+
+def setup(path: str = TRACE_FILE):
+    """
+    Starts the trace file writer, and instruments discord HTTP calls. Call once on startup
+    """
+    global _listener
+
+    if _listener is not None or TRACE_SAMPLE_RATE <= 0:
+        return
+
+    handler = RotatingFileHandler(path, maxBytes = TRACE_MAX_BYTES, backupCount = TRACE_BACKUPS, encoding = 'utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+
+    # file writes happen on the listener's thread
+    q = queue.SimpleQueue()
+    _logger.addHandler(QueueHandler(q))
+    _logger.setLevel(logging.INFO)
+
+    _listener = QueueListener(q, handler)
+    _listener.start()
+
+    _instrument_http()
+
+
+def teardown():
+    """
+    Flushes and stops the trace file writer
+    """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+@contextmanager
+def root_span(name: str, kind: int = KIND_SERVER, **attributes):
+    """
+    Starts a new trace, if it is sampled. Spans opened inside it become its children
+    """
+    if _listener is None or random.random() >= TRACE_SAMPLE_RATE:
+        # not sampled: make sure children don't attach to an outer trace either
+        token = _current.set(None)
+        try:
+            yield None
+        finally:
+            _current.reset(token)
+        return
+
+    trace = Trace()
+    try:
+        with _open(trace, None, name, kind, attributes) as s:
+            yield s
+    finally:
+        _export_later(trace)
+
+
+@contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, **attributes):
+    """
+    Child span of the current span. Does nothing when there is no sampled trace
+    """
+    parent = _current.get()
+
+    if parent is None:
+        yield None
+        return
+
+    with _open(parent.trace, parent.span_id, name, kind, attributes) as s:
+        yield s
+
+
+@contextmanager
+def _open(trace: Trace, parent_id, name: str, kind: int, attributes: dict):
+    s = Span(trace, parent_id, name, kind, attributes)
+    trace.spans.append(s)
+    token = _current.set(s)
+
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.end = time.time_ns()
+        _current.reset(token)
+
+
+def _log_query(record):
+    """
+    asyncpg query logger. Runs in the context of the task that made the query, so it becomes a child span
+    """
+    parent = _current.get()
+
+    if parent is None:
+        return
+
+    end = time.time_ns()
+    s = Span(parent.trace, parent.span_id, 'db.query', KIND_CLIENT, {'db.system': 'postgresql', 'db.statement': record.query})
+    s.start = end - int(record.elapsed * 1e9)
+    s.end = end
+
+    if record.exception is not None:
+        s.error = f"{type(record.exception).__name__}: {record.exception}"
+
+    parent.trace.spans.append(s)
+
+
+async def init_connection(conn):
+    """
+    Pool `init` callback: traces every query made on the connection
+    """
+    conn.add_query_logger(_log_query)
+
+
+def _instrument_http():
+    """
+    Wraps discord.py's HTTP clients, so interaction responses, followups and other API calls are child spans
+    """
+    from discord.http import HTTPClient
+    from discord.webhook.async_ import AsyncWebhookAdapter
+
+    def wrap(request):
+        async def traced_request(self, route, *args, **kwargs):
+            if _current.get() is None:
+                return await request(self, route, *args, **kwargs)
+
+            method = getattr(route, 'method', '')
+            path = getattr(route, 'path', '')
+
+            with span(f"discord {method} {path}", KIND_CLIENT, **{'http.method': method, 'http.route': path}):
+                return await request(self, route, *args, **kwargs)
+
+        traced_request.__wrapped__ = request
+        return traced_request
+
+    HTTPClient.request = wrap(HTTPClient.request)
+    AsyncWebhookAdapter.request = wrap(AsyncWebhookAdapter.request)
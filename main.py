@@ -1,18 +1,39 @@
+import time
+
+# for measuring time to ready, imports included
+started = time.perf_counter()
+
 import discord
-from discord.ext import commands, tasks
-import asyncpg
+from discord.ext import commands
 import config
 import helper.game_tasks as gt
 from helper.objects import ViewHelper
+from helper.pool import MeteredPool
+from helper import tracing, ledger, command_sync
+from helper.middleware import BotTree, finish
+from helper.market import OrderBook
+from helper.supervisor import Supervisor
+from helper.loop_monitor import monitor
+from helper import cooldowns, randomness
 
 import traceback
+import asyncio
+
+from params import MEMBER_INTENT, API_ENABLED, SYNC_ON_STARTUP, USE_UVLOOP
+from helper.runtime import StartupTimer
+
+# imports are the first phase of startup
+imported = time.perf_counter()
+startup = StartupTimer(started)
+startup.add('imports', started, imported)
 
 description = "A game bot by Rinceri"
 extensions = [
     'cogs.owner',
     'cogs.user_commands',
     'cogs.admin',
-    'cogs.mining'
+    'cogs.mining',
+    'cogs.market'
 ]
 
 
@@ -21,72 +42,172 @@ def get_command_prefixes(bot: commands.Bot, msg: discord.Message):
     
 
 class Shoeman(commands.Bot):
-    pool: asyncpg.Pool
+    pool: MeteredPool
 
     def __init__(self) -> None:
         intents = discord.Intents(
             guilds = True,
-            members = True,
+            members = MEMBER_INTENT,
             messages = True,
             emojis = True,
         )
 
+        if MEMBER_INTENT:
+            cache = {}
+        else:
+            # members come with interactions, and mentions are rendered from ids
+            # so there is no need to download and cache every member of every guild
+            cache = {
+                'chunk_guilds_at_startup': False,
+                'member_cache_flags': discord.MemberCacheFlags.none()
+            }
+
         super().__init__(
             command_prefix = get_command_prefixes,
             intents = intents,
-            description = description
+            description = description,
+            tree_cls = BotTree,
+            **cache
         )
 
         self.my_views = []
+        self.api = None
+        self.setup_done = None
+        self.supervisor = Supervisor()
 
     async def setup_hook(self):
+        # everything between the imports and here is logging in to discord
+        startup.add('login', imported)
+
+        # start writing sampled traces
+        tracing.setup()
+
+        # start measuring event loop lag
+        monitor.start()
+
         # creating pool
-        self.pool = await asyncpg.create_pool(config.connection_uri)
+        with startup.phase('pool'):
+            self.pool = await MeteredPool.create(config.connection_uri, init = tracing.init_connection)
+
+        # start writing the ledger
+        ledger.writer.start(self.pool)
+
+        # the steps below only need the pool, not each other, so they run at the same time.
+        # most of their time is spent waiting on the database, which they can do together
+        await asyncio.gather(
+            self.load_extensions(),
+            self.restore_views(),
+            # load cooldowns still running, and share them with other processes
+            self.timed('cooldowns', cooldowns.store.start(self.pool)),
+            # make up price changes missed while the bot was down, before the price job runs
+            self.timed('price catch up', gt.catch_up_prices(self.pool))
+        )
 
-        # loading extensions
-        for extension in extensions:
+        # start background jobs, each on its own
+        self.supervisor.add('price_fluct', self.price_fluct, seconds = 15 * 60, before = self.wait_until_ready)
+        self.supervisor.add('compact_prices', self.compact_prices, seconds = 60 * 60, before = self.wait_until_ready)
+        self.supervisor.add('pos_giveaway', self.pos_giveaway, seconds = 15 * 60, before = self.wait_until_ready)
+        self.supervisor.start()
+
+        # start dashboard api
+        if API_ENABLED:
+            from helper.api import DashboardAPI
+            self.api = DashboardAPI(self)
+            await self.api.start()
+
+        self.setup_done = time.perf_counter()
+
+    async def timed(self, name: str, coro):
+        """
+        Awaits `coro`, recording it as a startup phase
+        """
+        with startup.phase(name):
+            return await coro
+
+    async def load_extension_logged(self, extension: str):
+        with startup.phase(f'extension {extension}'):
             try:
                 await self.load_extension(extension)
             except Exception as e:
                 print(e)
 
-        # adding persistent views
-        views = await ViewHelper.get_views(self.pool)
-
-        for record in views:
-            # create instance of VH for GiveawayView
-            vh = ViewHelper(
-                pool = self.pool, 
-                message_id = record['message_id'], 
-                channel_id = record['channel_id'],
-                id = record['id'],
-                used_users = record['used_users']
-            )
-            # create GiveawayView for add_view and my_views
-            view = gt.GiveawayView(self.pool, vh)
-            self.add_view(view, message_id = record['message_id'])
-            self.my_views.append(view)
-
-        # start bg task
-        self.bg_task.start()
-
-    @tasks.loop(minutes = 15)
-    async def bg_task(self):
+    async def load_extensions(self):
+        """
+        Loads the extensions at the same time, then syncs commands (which needs all of them loaded)
+        """
+        await asyncio.gather(*(self.load_extension_logged(extension) for extension in extensions))
+
+        # sync commands with discord, where they changed since the last sync
+        if SYNC_ON_STARTUP:
+            with startup.phase('command sync'):
+                try:
+                    results = await command_sync.sync_all(self)
+                except discord.HTTPException as e:
+                    print(f"Could not sync commands: {e}")
+                else:
+                    for scope, result in results.items():
+                        if result['synced']:
+                            where = 'global' if scope == command_sync.GLOBAL else f'guild {scope}'
+                            print(f"Synced {where} commands: {command_sync.describe(result)}")
+
+    async def restore_views(self):
+        """
+        Adds back the persistent giveaway views
+        """
+        with startup.phase('views'):
+            views = await ViewHelper.get_views(self.pool)
+
+            for record in views:
+                # create instance of VH for GiveawayView
+                vh = ViewHelper(
+                    pool = self.pool, 
+                    message_id = record['message_id'], 
+                    channel_id = record['channel_id'],
+                    id = record['id'],
+                    used_users = record['used_users']
+                )
+                # create GiveawayView for add_view and my_views
+                view = gt.GiveawayView(self.pool, vh)
+                self.add_view(view, message_id = record['message_id'])
+                self.my_views.append(view)
+
+    async def price_fluct(self):
         await gt.price_fluct(self.pool)
-        await gt.pos_giveaway(self, self.pool)
 
-    @bg_task.before_loop
-    async def before_bg_task(self):
-        await self.wait_until_ready()
+    async def compact_prices(self):
+        await gt.compact_prices(self.pool)
+
+    async def pos_giveaway(self):
+        await gt.pos_giveaway(self, self.pool)
 
     async def on_ready(self):
         print(f"Logged in as {self.user}: (ID: {self.user.id})")
+
+        # on_ready also runs after reconnects, startup is only reported once
+        if not startup.reported:
+            startup.reported = True
+            startup.add('gateway ready', self.setup_done)
+            print(f"Startup phases:\n{startup.report()}")
+
+            # NumPy and the random generators are made on first use, start now instead of on the first /mine
+            randomness.warm()
+
         print("---------")
 
     async def close(self):
-        # closing the connection pool gracefully
+        await self.supervisor.stop()
+        monitor.stop()
+
+        if self.api is not None:
+            await self.api.stop()
+
+        # write what is left of the ledger, then close the connection pool gracefully
+        await ledger.writer.stop()
+        await cooldowns.store.stop()
+        await OrderBook.release_lock(self.pool)
         await self.pool.close()
         await super().close()
+        tracing.teardown()
 
     async def on_command_error(
         self, 
@@ -109,9 +230,26 @@ async def on_app_command_error(
 ):
     # cog check failed
     if isinstance(error, discord.app_commands.errors.CheckFailure):
+        await finish(itx)
         return
     else:
         traceback.print_exc()
+        await finish(itx, error)
+
+def use_uvloop():
+    """
+    Makes asyncio create uvloop loops, if it is installed
+    """
+    try:
+        import uvloop
+    except ImportError:
+        print("USE_UVLOOP is set but uvloop is not installed, using asyncio's loop")
+        return
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 if __name__ == "__main__":
+    if USE_UVLOOP:
+        use_uvloop()
+
     client.run(config.token)
\ No newline at end of file
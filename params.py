@@ -3,5 +3,71 @@ mu = 0.0
 sd = 100
 
 PRICE_CHANGE_HRS = 12
+PRICE_TICK_DAYS = 30
+PRICE_HOURLY_DAYS = 365
+PRICE_CACHE_SECS = 60
+
+# random numbers drawn at once, and seed for reproducible runs (None for random)
+RANDOM_BLOCK_SIZE = 65536
+RANDOM_SEED = None
 VIEW_INTERVAL_HRS = 12
-EMBED_COLOUR = '#63ab33'
\ No newline at end of file
+EMBED_COLOUR = '#63ab33'
+MEMBER_INTENT = False
+SYNC_ON_STARTUP = True
+
+LEADERBOARD_REFRESH_SECS = 60
+GLOBAL_LEADERBOARD_SIZE = 1000
+GLOBAL_LEADERBOARD_REFRESH_SECS = 300
+ORE_HISTORY_DAYS = 90
+STATS_CACHE_SECS = 120
+STATS_CHUNK_SIZE = 5000
+
+# database pool
+POOL_MIN_SIZE = 2
+POOL_MAX_SIZE = 20
+POOL_MAX_QUERIES = 50000
+POOL_STATEMENT_CACHE_SIZE = 100
+POOL_COMMAND_TIMEOUT = 10
+POOL_ACQUIRE_TIMEOUT = 2
+POOL_CONNECTION_LIFETIME = 300
+POOL_ADAPTIVE = True
+
+# tracing
+TRACE_SAMPLE_RATE = 0.01
+TRACE_FILE = 'traces.jsonl'
+TRACE_MAX_BYTES = 10_000_000
+TRACE_BACKUPS = 5
+
+# seconds after an interaction is created before it is deferred automatically (discord allows 3)
+DEFER_AFTER_SECS = 2.0
+
+# cooldowns: /mine uses, and seconds between syncs of cooldowns with other processes
+MINE_COOLDOWN_SECS = 60
+COOLDOWN_SYNC_SECS = 1
+
+# ledger of balance and shoe changes
+LEDGER_BATCH_SIZE = 500
+LEDGER_FLUSH_SECS = 5
+LEDGER_MAX_BUFFER = 100000
+
+# fair scheduling of interactions between guilds
+FAIR_MAX_ACTIVE = 16
+FAIR_GUILD_MAX_ACTIVE = 4
+FAIR_GUILD_WEIGHTS = {}
+FAIR_LATENCY_SAMPLES = 200
+
+# event loop: lag measured every LOOP_LAG_INTERVAL_MS, stack printed when blocked for LOOP_LAG_THRESHOLD_MS
+LOOP_LAG_INTERVAL_MS = 100
+LOOP_LAG_THRESHOLD_MS = 250
+USE_UVLOOP = False
+
+# sampling profiler, see the `profile` owner command
+PROFILE_INTERVAL_MS = 5
+PROFILE_MAX_SECS = 120
+
+# read-only dashboard api
+API_ENABLED = False
+API_HOST = '127.0.0.1'
+API_PORT = 8080
+API_CACHE_SECS = 30
+API_RATE_PER_MIN = 60